@@ -1,103 +1,399 @@
-import pandas as pd
 import hashlib
+import hmac
+import csv
+import io
+import os
+from itertools import repeat
 from rich.console import Console
-from rich.table import Table
-from loguru import logger
+from lazy import LazyImport
+from locks import bump_generation, file_lock, generation
+from metrics import timed
+from sessions import SessionCache
+from pager import Pager
+
+pd = LazyImport('pandas')
+Table = LazyImport('rich.table', 'Table')
+logger = LazyImport('loguru', 'logger')
 
 console = Console()
 
-def load_admin_credentials(admin_file='.\\APelahishokr\\admin.txt'):
+ACCOUNT_COLUMNS = ['Username', 'Password', 'Email', 'Role']
+DELTA_SUFFIX = '.delta'
+DELTA_COMPACT_ROWS = 1000
+IMPORT_BATCH_ROWS = 10000
+IMPORT_ROLES = ('user', 'Inactive')
+ADMIN_FILE = os.path.join('APelahishokr', 'admin.txt')
+HASH_SCHEME = 'pbkdf2_sha256'
+HASH_ITERATIONS = int(os.environ.get('PMS_HASH_ITERATIONS', 600000))
+SALT_BYTES = 16
+
+admin_credentials_cache = {}
+
+
+def batched(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def hash_password(password, iterations=None):
+    # Module level so process pool workers can pickle it.
+    iterations = iterations or HASH_ITERATIONS
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{HASH_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored, iterations=None):
+    # Returns (matches, needs_rehash); bare SHA-256 digests from older versions always need a rehash.
+    iterations = iterations or HASH_ITERATIONS
+    parts = stored.split('$')
+    if len(parts) == 4 and parts[0] == HASH_SCHEME:
+        try:
+            stored_iterations, salt = int(parts[1]), bytes.fromhex(parts[2])
+        except ValueError:
+            return False, False
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, stored_iterations).hex()
+        return hmac.compare_digest(digest, parts[3]), stored_iterations < iterations
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored), True
+
+
+def load_admin_credentials(admin_file=ADMIN_FILE):
+    # A stat is much cheaper than re-reading the file; a rewrite changes mtime or size.
+    stat = os.stat(admin_file)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = admin_credentials_cache.get(admin_file)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
     with open(admin_file, 'r') as file:
         lines = file.read().splitlines()
     if len(lines) < 2 or not lines[0].startswith('Username:') or not lines[1].startswith('Password:'):
         raise ValueError("Admin file must contain a username and a password in the format 'username:' and 'password:'.")
     admin_username = lines[0].split('Username:')[1].strip()
     admin_password = lines[1].split('Password:')[1].strip()
+    admin_credentials_cache[admin_file] = (signature, (admin_username, admin_password))
     return admin_username, admin_password
+
+
+def read_rows(filename, offset):
+    # Complete CSV rows appended after offset, and the offset just past them.
+    try:
+        with open(filename, 'rb') as file:
+            file.seek(offset)
+            data = file.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b'\n') + 1
+    return list(csv.reader(io.StringIO(data[:end].decode('utf-8'), newline=''))), offset + end
+
+
 class UserAccount:
-    def __init__(self, accounts_file):
+    def __init__(self, accounts_file, admin_file=ADMIN_FILE, hash_iterations=None):
         self.accounts_file = accounts_file
-        self.accounts = self.load_accounts()
-        logger.add(".\\APelahishokr\\application.log", rotation="1 MB")
+        self.admin_file = admin_file
+        self.hash_iterations = hash_iterations or HASH_ITERATIONS
+        self.delta_file = accounts_file + DELTA_SUFFIX
+        self.sessions = SessionCache(accounts_file, admin_file=admin_file)
+        with file_lock(self.accounts_file, shared=True):
+            self.accounts = self.load_accounts()
 
+    @timed('load_accounts')
     def load_accounts(self):
         logger.info("Loading accounts from {}", self.accounts_file)
+        # Called with the accounts lock held, so the file, the change log and the generation agree.
+        self.generation = generation(self.accounts_file)
         try:
-            return pd.read_csv(self.accounts_file)
+            with open(self.accounts_file, 'rb') as file:
+                self.accounts_offset = os.fstat(file.fileno()).st_size
+                accounts = pd.read_csv(file, dtype=str, keep_default_na=False)
         except FileNotFoundError:
             logger.warning("Accounts file not found, creating a new one.")
-            return pd.DataFrame(columns=['Username', 'Password', 'Email', 'Role'])
+            accounts = pd.DataFrame(columns=ACCOUNT_COLUMNS)
+            self.accounts_offset = 0
+        self.build_indexes(accounts)
+        self.apply_changes(accounts)
+        return accounts
+
+    @timed('catch_up_accounts')
+    def catch_up(self):
+        # Other sessions only append rows until one of them compacts, which replaces the accounts file.
+        if generation(self.accounts_file) != self.generation:
+            self.accounts = self.load_accounts()
+            return
+        rows, self.accounts_offset = read_rows(self.accounts_file, self.accounts_offset)
+        for row in rows:
+            if len(row) == len(ACCOUNT_COLUMNS) and row != ACCOUNT_COLUMNS and row[0] not in self.username_index:
+                self.add_row(row)
+        changes, self.delta_offset = read_rows(self.delta_file, self.delta_offset)
+        for change in changes:
+            if change[0] in self.username_index and (len(change) == 2 or change[1] in ACCOUNT_COLUMNS):
+                self.set_value(change[0], 'Role' if len(change) == 2 else change[1], change[-1])
+        self.delta_rows += len(changes)
+
+    def add_row(self, row):
+        position = len(self._accounts) + len(self.pending)
+        self.pending.append(row)
+        self.username_index[row[0]] = position
+        self.email_index[row[2]] = position
 
+    @property
+    def accounts(self):
+        # Rows added by sign_up are batched and folded into the DataFrame on first access.
+        if self.pending:
+            new_accounts = pd.DataFrame(self.pending, columns=ACCOUNT_COLUMNS)
+            self._accounts = pd.concat([self._accounts, new_accounts], ignore_index=True)
+            self.pending = []
+        return self._accounts
+
+    @accounts.setter
+    def accounts(self, accounts):
+        self._accounts = accounts
+        self.pending = []
+
+    def load_changes(self):
+        # Role changes are [username, role]; other columns are [username, column, value].
+        rows, self.delta_offset = read_rows(self.delta_file, 0)
+        return [row for row in rows if len(row) == 2 or (len(row) == 3 and row[1] in ACCOUNT_COLUMNS)]
+
+    def apply_changes(self, accounts):
+        changes = self.load_changes()
+        for change in changes:
+            row = self.username_index.get(change[0])
+            if row is not None:
+                column = 'Role' if len(change) == 2 else change[1]
+                accounts.iat[row, accounts.columns.get_loc(column)] = change[-1]
+        self.delta_rows = len(changes)
+
+    def build_indexes(self, accounts):
+        self.username_index = {username: row for row, username in enumerate(accounts['Username'])}
+        self.email_index = {email: row for row, email in enumerate(accounts['Email'])}
+
+    def find_account(self, username):
+        row = self.username_index.get(username)
+        if row is None:
+            return None
+        if row >= len(self._accounts):
+            return pd.Series(self.pending[row - len(self._accounts)], index=ACCOUNT_COLUMNS)
+        return self._accounts.iloc[row]
+
+    def account_exists(self, username, email):
+        return username in self.username_index or email in self.email_index
+
+    @timed('save_accounts')
     def save_accounts(self):
         logger.info("Saving accounts to {}", self.accounts_file)
-        self.accounts.to_csv(self.accounts_file, index=False)
+        temp_file = self.accounts_file + '.tmp'
+        self.accounts.to_csv(temp_file, index=False)
+        os.replace(temp_file, self.accounts_file)
+
+    def append_account(self, row):
+        self.append_accounts([row])
+
+    def append_accounts(self, rows):
+        # Callers hold the accounts lock and have caught up, so this process has read everything before the end.
+        write_header = not os.path.exists(self.accounts_file)
+        with open(self.accounts_file, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if write_header:
+                writer.writerow(ACCOUNT_COLUMNS)
+            writer.writerows(rows)
+        self.accounts_offset = os.path.getsize(self.accounts_file)
+
+    def append_change(self, username, column, value):
+        with file_lock(self.accounts_file):
+            self.catch_up()
+            self.write_change(username, column, value)
+
+    def write_change(self, username, column, value):
+        # Called with the accounts lock held and caught up.
+        with open(self.delta_file, 'a', newline='') as file:
+            csv.writer(file).writerow([username, value] if column == 'Role' else [username, column, value])
+        self.delta_offset = os.path.getsize(self.delta_file)
+        self.delta_rows += 1
+        if self.delta_rows >= DELTA_COMPACT_ROWS:
+            self.compact_accounts()
+
+    def append_role_change(self, username, role):
+        self.append_change(username, 'Role', role)
+
+    def set_value(self, username, column, value):
+        row = self.username_index[username]
+        if row >= len(self._accounts):
+            self.pending[row - len(self._accounts)][ACCOUNT_COLUMNS.index(column)] = value
+        else:
+            self._accounts.iat[row, self._accounts.columns.get_loc(column)] = value
+
+    @timed('set_account_field')
+    def set_account_field(self, username, column, value):
+        with file_lock(self.accounts_file):
+            self.catch_up()
+            self.set_value(username, column, value)
+            self.write_change(username, column, value)
+        if column == 'Role':
+            # Cached sessions carry the role they were issued with and skip the accounts file, so they have to go.
+            self.sessions.revoke(username)
+
+    @timed('compact_accounts')
+    def compact_accounts(self):
+        with file_lock(self.accounts_file):
+            self.catch_up()
+            logger.info("Compacting account role changes into {}", self.accounts_file)
+            self.save_accounts()
+            if os.path.exists(self.delta_file):
+                os.remove(self.delta_file)
+            self.generation = bump_generation(self.accounts_file)
+            self.accounts_offset = os.path.getsize(self.accounts_file)
+            self.delta_offset = self.delta_rows = 0
 
     def encrypt_password(self, password):
-        logger.info("Encrypting password")
-        return hashlib.sha256(password.encode()).hexdigest()
+        logger.debug("Encrypting password")
+        return hash_password(password, self.hash_iterations)
 
+    def hash_passwords(self, passwords, workers=None, pool=None):
+        # The KDF is CPU-bound, so large batches are spread over one process per core.
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(passwords) < 2 * workers:
+            return [hash_password(password, self.hash_iterations) for password in passwords]
+        if pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(workers) as pool:
+                return self.hash_passwords(passwords, workers, pool)
+        chunksize = max(len(passwords) // (workers * 4), 1)
+        return list(pool.map(hash_password, passwords, repeat(self.hash_iterations), chunksize=chunksize))
+
+    @timed('import_accounts')
+    def import_accounts(self, records, workers=None):
+        # Batches are validated, hashed and appended in turn, so neither the file nor its passwords are
+        # ever held in memory whole; one process pool serves every batch.
+        try:
+            admin_user, _ = load_admin_credentials(self.admin_file)
+        except FileNotFoundError:
+            admin_user = None
+        workers = workers or os.cpu_count() or 1
+        imported = skipped = 0
+        pool = None
+        try:
+            for batch in batched(records, IMPORT_BATCH_ROWS):
+                candidates = []
+                usernames, emails = set(), set()
+                for record in batch:
+                    username = (record.get('username') or '').strip()
+                    email = (record.get('email') or '').strip()
+                    password = record.get('password') or ''
+                    role = (record.get('role') or 'user').strip()
+                    if not username or not password or role not in IMPORT_ROLES or username == admin_user \
+                            or self.account_exists(username, email) or username in usernames or email in emails:
+                        skipped += 1
+                        continue
+                    usernames.add(username)
+                    emails.add(email)
+                    candidates.append([username, password, email, role])
+                if pool is None and workers > 1 and len(candidates) >= 2 * workers:
+                    from concurrent.futures import ProcessPoolExecutor
+                    pool = ProcessPoolExecutor(workers)
+                # Hashing takes seconds, so the lock is only taken afterwards to recheck and append.
+                hashes = self.hash_passwords([account[1] for account in candidates], workers, pool)
+                for account, encrypted_password in zip(candidates, hashes):
+                    account[1] = encrypted_password
+                with file_lock(self.accounts_file):
+                    self.catch_up()
+                    accepted = [account for account in candidates if not self.account_exists(account[0], account[2])]
+                    skipped += len(candidates) - len(accepted)
+                    self.append_accounts(accepted)
+                    for account in accepted:
+                        self.add_row(account)
+                imported += len(accepted)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        logger.info("Imported {} accounts, skipped {}", imported, skipped)
+        return imported, skipped
+
+    @timed('sign_up')
     def sign_up(self, username, password, email, role='user'):
-        logger.info("Attempting to sign up user: {}", username)
-        admin_user, _ = load_admin_credentials()
-        if username in self.accounts['Username'].values or email in self.accounts['Email'].values or username == admin_user:
+        logger.debug("Attempting to sign up user: {}", username)
+        admin_user, _ = load_admin_credentials(self.admin_file)
+        if self.account_exists(username, email) or username == admin_user:
             console.print("[bold red]Error:[/bold red] Username or email already exists.")
             logger.warning("Sign up failed: Username or email already exists")
             return False
 
         encrypted_password = self.encrypt_password(password)
-        new_account = pd.DataFrame({
-            'Username': [username],
-            'Password': [encrypted_password],
-            'Email': [email],
-            'Role': [role]
-        })
- self.accounts = pd.concat([self.accounts, new_account], ignore_index=True)
-        self.save_accounts()
+        new_account = [username, encrypted_password, email, role]
+        with file_lock(self.accounts_file):
+            # Another session may have taken the name while the password was hashing.
+            self.catch_up()
+            if self.account_exists(username, email):
+                console.print("[bold red]Error:[/bold red] Username or email already exists.")
+                logger.warning("Sign up failed: Username or email already exists")
+                return False
+            self.append_account(new_account)
+            self.add_row(new_account)
         logger.info("User signed up successfully: {}", username)
         return True
 
+    @timed('login')
     def login(self, username, password):
-        admin_user, admin_pass = load_admin_credentials()
+        admin_user, admin_pass = load_admin_credentials(self.admin_file)
         if (username == admin_user and password == admin_pass):
             return pd.DataFrame({"Username": [admin_user], "Password": [admin_pass], "Email": [""], "Role": ["admin"]}).iloc[0]
 
-        logger.info("Attempting to login user: {}", username)
-        encrypted_password = self.encrypt_password(password)
-        account = self.accounts[(self.accounts['Username'] == username) & (self.accounts['Password'] == encrypted_password)]
-        if len(account) == 0:
+        logger.debug("Attempting to login user: {}", username)
+        with file_lock(self.accounts_file, shared=True):
+            self.catch_up()
+        account = self.find_account(username)
+        matches, outdated = (False, False) if account is None else verify_password(password, account['Password'], self.hash_iterations)
+        if not matches:
             console.print("[bold red]Error:[/bold red] Invalid username or password.")
             logger.warning("Login failed: Invalid username or password")
             return None
-        elif account["Role"].values[0] == "Inactive":
+        elif account["Role"] == "Inactive":
             console.print("[bold red]Error:[/bold red] Your account has been deactivated.")
             logger.warning("Login failed: deactivated account login attempt")
             return None
         else:
+            if outdated:
+                self.set_account_field(username, 'Password', self.encrypt_password(password))
+                logger.info("Upgraded password hash for user: {}", username)
             console.print("[bold green]Login successful![/bold green]")
             logger.info("User logged in successfully: {}", username)
-            return account.iloc[0]
-def is_admin(self, account):
+            return account
+
+    def is_admin(self, account):
         return account['Role'] == 'admin'
 
     def modify_user_status(self):
+        pager = Pager(len(self.accounts))
         while True:
-            # Display all accounts
+            # Display one page of accounts
             table = Table(show_header=True, header_style="bold magenta")
             table.add_column("Index", style="dim", width=6)
             table.add_column("Username")
             table.add_column("Email")
             table.add_column("Role")
 
-            for idx, row in self.accounts.iterrows():
-                table.add_row(str(idx), row['Username'], row['Email'], row['Role'])
+            page = self.accounts.iloc[pager.start:pager.stop]
+            for idx, username, email, role in zip(page.index, page['Username'], page['Email'], page['Role']):
+                table.add_row(str(idx), username, email, role)
 
             console.print(table)
-# Prompt for user selection
+            console.print(pager.footer())
+
+            # Prompt for user selection
             index = console.input("\nEnter the index of the user to modify (or press Enter to exit): ")
 
             if index == "":
                 break
 
+            if pager.navigate(index):
+                continue
+
             if not index.isdigit() or int(index) not in range(len(self.accounts)):
                 console.print("[bold red]Error:[/bold red] Invalid index.")
                 continue
@@ -105,8 +401,7 @@ def is_admin(self, account):
             index = int(index)
             user_role = self.accounts.at[index, 'Role']
             new_role = 'Inactive' if user_role != 'Inactive' else 'user'
-            self.accounts.at[index, 'Role'] = new_role
-            self.save_accounts()
+            self.set_account_field(self.accounts.at[index, 'Username'], 'Role', new_role)
 
             console.print(f"[bold green]User at index {index} has been changed to {new_role}.[/bold green]")
             logger.info("User role modified: {} -> {}", self.accounts.at[index, 'Username'], new_role)
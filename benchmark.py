@@ -0,0 +1,402 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import date, timedelta
+from loguru import logger
+from account import UserAccount, HASH_ITERATIONS
+
+
+def write_accounts(accounts_file, count):
+    with open(accounts_file, 'w') as file:
+        file.write('Username,Password,Email,Role\n')
+        for i in range(count):
+            file.write(f'user{i},{i:064x},user{i}@example.com,user\n')
+
+
+def time_per_call(func, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def bench_auth(sizes, lookups):
+    logger.remove()
+    print(f"{'accounts':>10} {'lookup (us)':>12} {'duplicate check (us)':>22}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            accounts_file = os.path.join(directory, 'accounts.csv')
+            write_accounts(accounts_file, size)
+            user_account = UserAccount(accounts_file)
+            step = max(size // lookups, 1)
+            names = [(f'user{i}',) for i in range(0, size, step)]
+            pairs = [(f'user{i}', f'new{i}@example.com') for i in range(0, size, step)]
+            lookup = time_per_call(user_account.find_account, names)
+            duplicate = time_per_call(user_account.account_exists, pairs)
+            print(f"{size:>10} {lookup:>12.2f} {duplicate:>22.2f}")
+
+
+def rss_kb():
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def write_tasks(tasks_file, count):
+    statuses = ['Backlog', 'To Do', 'Doing', 'Done', 'Archived']
+    priorities = ['Critical', 'High', 'Medium', 'Low']
+    with open(tasks_file, 'w') as file:
+        for i in range(count):
+            file.write(json.dumps({
+                'title': f'Task {i}',
+                'description': f'Description of task {i}',
+                'start_date': '2024-05-28',
+                'end_date': '2024-06-28',
+                'assigned_to': [f'user{i % 500}', f'user{i % 37}'],
+                'priority': priorities[i % 4],
+                'status': statuses[i % 5],
+                'comments': [[f'leader{i % 100}', '2024-05-28 10:00:00', 'No comments']]
+            }) + '\n')
+
+
+def measure_memory(mode, tasks_file):
+    from models import Task
+    before = rss_kb()
+    tasks = {}
+    with open(tasks_file) as file:
+        for i, line in enumerate(file):
+            task = json.loads(line)
+            tasks[str(i)] = task if mode == 'dicts' else Task.from_dict(task, None, str(i))
+    print(rss_kb() - before)
+
+
+def bench_memory(count):
+    with tempfile.TemporaryDirectory() as directory:
+        tasks_file = os.path.join(directory, 'tasks.jsonl')
+        write_tasks(tasks_file, count)
+        results = {}
+        for mode in ('dicts', 'models'):
+            output = subprocess.run([sys.executable, __file__, 'memory', '--mode', mode, '--file', tasks_file],
+                                    capture_output=True, text=True, check=True).stdout
+            results[mode] = int(output.split()[-1])
+    print(f"{'representation':>15} {'RSS (MB)':>10} {'bytes/task':>11}")
+    for mode, kilobytes in results.items():
+        print(f"{mode:>15} {kilobytes / 1024:>10.1f} {kilobytes * 1024 / count:>11.0f}")
+    print(f"models use {results['models'] / results['dicts']:.0%} of the plain dict RSS")
+
+
+def build_projects(project_count, task_count):
+    statuses = ['Backlog', 'To Do', 'Doing', 'Done', 'Archived']
+    priorities = ['Critical', 'High', 'Medium', 'Low']
+    projects = {}
+    for p in range(project_count):
+        projects[f'project{p}'] = {'title': f'Project {p}', 'leader': f'leader{p % 50}',
+                                   'users': [f'leader{p % 50}'] + [f'user{(p + u) % 500}' for u in range(10)], 'tasks': {}}
+    for i in range(task_count):
+        projects[f'project{i % project_count}']['tasks'][str(i)] = {
+            'title': f'Task {i}',
+            'description': f'Description of task {i}',
+            'start_date': '2024-05-28',
+            'end_date': '2024-06-28',
+            'assigned_to': [f'user{i % 500}'],
+            'priority': priorities[i % 4],
+            'status': statuses[i % 5],
+            'comments': [[f'leader{i % 100}', '2024-05-28 10:00:00', 'No comments']]
+        }
+    return projects
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_snapshot(project_count, task_count):
+    from main import load_projects, save_projects
+    from store import write_snapshot
+    logger.remove()
+    print(f"{'format':>8} {'size (MB)':>10} {'open (s)':>9} {'first project (s)':>18} {'all tasks (s)':>14} {'save (s)':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        data = build_projects(project_count, task_count)
+        for extension in ('json', 'bin'):
+            filename = os.path.join(directory, f'projects.{extension}')
+            write_snapshot(filename, data)
+            projects, opened = timed(load_projects, filename, False)
+            first = next(iter(projects.values()))
+            _, first_project = timed(lambda: first['tasks'])
+            _, all_tasks = timed(lambda: [project['tasks'] for project in projects.values()])
+            _, saved = timed(save_projects, filename, projects)
+            size = os.path.getsize(filename) / 1024 / 1024
+            print(f"{extension:>8} {size:>10.1f} {opened:>9.3f} {first_project:>18.4f} {opened + all_tasks:>14.3f} {saved:>9.3f}")
+
+
+def bench_hashing(count, workers_list, iterations):
+    logger.remove()
+    records = [{'username': f'user{i}', 'password': f'password{i}', 'email': f'user{i}@example.com'} for i in range(count)]
+    print(f"{count} users, {iterations} PBKDF2 iterations, {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'seconds':>9} {'users/sec':>10}")
+    for workers in workers_list:
+        with tempfile.TemporaryDirectory() as directory:
+            user_account = UserAccount(os.path.join(directory, 'accounts.csv'), os.path.join(directory, 'admin.txt'), iterations)
+            start = time.perf_counter()
+            user_account.import_accounts(records, workers)
+            elapsed = time.perf_counter() - start
+        print(f"{workers:>8} {elapsed:>9.2f} {count / elapsed:>10.1f}")
+
+
+def bench_logging(calls):
+    from main import add_user_to_project, remove_user_from_project
+    from store import ProjectStore, attach_project
+    import logs
+    print(f"{'sinks':>28} {'mutation (us)':>14} {'login (us)':>11}")
+    for label in ('synchronous file, DEBUG', 'setup_logging defaults'):
+        with tempfile.TemporaryDirectory() as directory:
+            logger.remove()
+            logs.handlers.clear()
+            if label == 'setup_logging defaults':
+                logs.setup_logging(os.path.join(directory, 'application.log'))
+            else:
+                logger.add(os.path.join(directory, 'application.log'), level='DEBUG')
+            projects = ProjectStore()
+            attach_project(projects, 'p1', {'title': 'Project', 'leader': 'leader', 'users': ['leader'], 'tasks': {}})
+            pairs = [(projects, 'p1', f'user{i}') for i in range(calls)]
+            with redirect_stdout(io.StringIO()):
+                mutation = time_per_call(lambda *args: (add_user_to_project(*args), remove_user_from_project(*args)), pairs) / 2
+                with open(os.path.join(directory, 'admin.txt'), 'w') as file:
+                    file.write('Username: admin\nPassword: admin')
+                user_account = UserAccount(os.path.join(directory, 'accounts.csv'), os.path.join(directory, 'admin.txt'), 1)
+                user_account.sign_up('alice', 'password', 'alice@example.com')
+                login = time_per_call(user_account.login, [('alice', 'password')] * calls)
+            logger.remove()
+        print(f"{label:>28} {mutation:>14.1f} {login:>11.1f}")
+
+
+SCALES = {
+    # accounts, projects, fewest and most tasks per project
+    'small': (1000, 20, 10, 100),
+    'medium': (100000, 100, 10, 1000),
+    'large': (1000000, 200, 10, 10000),
+}
+SUITE_PASSWORD = 'password'
+
+
+def generate_accounts(accounts_file, count, iterations, rng):
+    # Every row shares one hash with a fixed salt: hashing a million passwords would dominate the setup, and
+    # login cost depends on the iteration count, not on the salt.
+    salt = bytes(rng.getrandbits(8) for _ in range(16))
+    digest = hashlib.pbkdf2_hmac('sha256', SUITE_PASSWORD.encode(), salt, iterations).hex()
+    password = f"pbkdf2_sha256${iterations}${salt.hex()}${digest}"
+    with open(accounts_file, 'w') as file:
+        file.write('Username,Password,Email,Role\n')
+        for i in range(count):
+            file.write(f"user{i},{password},user{i}@example.com,{'Inactive' if rng.random() < 0.05 else 'user'}\n")
+
+
+def generate_projects(project_count, min_tasks, max_tasks, user_count, rng):
+    # Task counts are log-uniform, so a few large projects sit among many small ones.
+    statuses = ['Backlog', 'To Do', 'Doing', 'Done', 'Archived']
+    priorities = ['Critical', 'High', 'Medium', 'Low']
+    projects = {}
+    for p in range(project_count):
+        leader = f'user{rng.randrange(user_count)}'
+        users = [leader] + [f'user{rng.randrange(user_count)}' for _ in range(rng.randint(2, 20))]
+        tasks = {}
+        task_count = max_tasks if p == 0 else round(min_tasks * (max_tasks / min_tasks) ** rng.random())
+        for t in range(1, task_count + 1):
+            start = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+            tasks[str(t)] = {
+                'title': f'Task {t} of project {p}',
+                'description': f'Description of task {t}',
+                'start_date': start.isoformat(),
+                'end_date': (start + timedelta(days=rng.randrange(1, 90))).isoformat(),
+                'assigned_to': rng.sample(users, min(len(users), rng.randint(1, 3))),
+                'priority': rng.choice(priorities),
+                'status': rng.choice(statuses),
+                'comments': [[rng.choice(users), f'{start.isoformat()} 10:00:00', f'Comment {c}']
+                             for c in range(rng.randrange(4))]
+            }
+        projects[f'project{p}'] = {'title': f'Project {p}', 'leader': leader, 'users': users, 'tasks': tasks}
+    return projects
+
+
+@contextmanager
+def headless(answers=''):
+    # Rich writes to whatever sys.stdout is at print time, and input() reads the canned answers.
+    stdin = sys.stdin
+    sys.stdin = io.StringIO(answers)
+    try:
+        with redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        sys.stdin = stdin
+
+
+def measure(func, repeat, answers=''):
+    # Run -1 warms caches and lazy imports and is not counted.
+    samples = []
+    for run in range(-1, repeat):
+        with headless(answers):
+            start = time.perf_counter()
+            func(run)
+            if run >= 0:
+                samples.append((time.perf_counter() - start) * 1000)
+    return {'repeat': repeat, 'min_ms': min(samples), 'median_ms': statistics.median(samples),
+            'mean_ms': statistics.fmean(samples)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_suite(scale, repeat, iterations, seed):
+    from main import load_projects, save_projects, search_tasks, view_tasks
+    from store import write_snapshot
+    logger.remove()
+    account_count, project_count, min_tasks, max_tasks = SCALES[scale]
+    rng = random.Random(seed)
+    results = []
+
+    def record(name, func, count=repeat, answers=''):
+        result = dict(name=name, **measure(func, count, answers))
+        results.append(result)
+        print(f"{name:>28} {result['median_ms']:>12.3f} {result['min_ms']:>10.3f} {count:>7}", file=sys.stderr)
+
+    print(f"{'operation':>28} {'median (ms)':>12} {'min (ms)':>10} {'runs':>7}", file=sys.stderr)
+    with tempfile.TemporaryDirectory() as directory:
+        accounts_file = os.path.join(directory, 'accounts.csv')
+        admin_file = os.path.join(directory, 'admin.txt')
+        with open(admin_file, 'w') as file:
+            file.write('Username: admin\nPassword: admin')
+        generate_accounts(accounts_file, account_count, iterations, rng)
+        projects_file = os.path.join(directory, 'projects.json')
+        write_snapshot(projects_file, generate_projects(project_count, min_tasks, max_tasks, account_count, rng))
+
+        accounts = [None]
+        record('load_accounts', lambda run: accounts.__setitem__(0, UserAccount(accounts_file, admin_file, iterations)))
+        user_account = accounts[0]
+        active = user_account.accounts.loc[user_account.accounts['Role'] == 'user', 'Username'].tolist()
+        names = [rng.choice(active) for _ in range(repeat)]
+        record('login', lambda run: user_account.login(names[run], SUITE_PASSWORD))
+        record('sign_up', lambda run: user_account.sign_up(f'bench{run}', SUITE_PASSWORD, f'bench{run}@example.com'))
+        # Toggles the first account on one run and back on the next.
+        record('modify_user_status', lambda run: user_account.modify_user_status(), answers='0\n\n')
+
+        loaded = [None]
+        record('load_projects', lambda run: loaded.__setitem__(0, load_projects(projects_file)))
+        projects = loaded[0]
+        leader = projects['project0']['leader']
+        record('view_tasks (leader)', lambda run: view_tasks(projects, leader, 'user'), answers='\n')
+        record('view_tasks (admin)', lambda run: view_tasks(projects, 'admin', 'admin'), answers='\n')
+        # The warm-up run builds the search index, so these time queries alone.
+        record('search_tasks (leader)', lambda run: search_tasks(projects, leader, 'user', 'task comm'))
+        record('search_tasks (admin)', lambda run: search_tasks(projects, 'admin', 'admin', f'task {run + 1} descr'))
+        snapshot_file = os.path.join(directory, 'snapshot.json')
+        record('save_projects', lambda run: save_projects(snapshot_file, projects))
+
+    return {
+        'meta': {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                 'scale': scale, 'accounts': account_count, 'projects': project_count,
+                 'tasks': sum(len(project['tasks']) for project in projects.values()),
+                 'seed': seed, 'iterations': iterations, 'repeat': repeat},
+        'results': results,
+    }
+
+
+def compare_results(report, baseline, threshold):
+    # Medians are compared, since a single slow run (a page fault, another process) skews the mean.
+    previous = {result['name']: result for result in baseline['results']}
+    regressions = []
+    print(f"{'operation':>28} {'baseline (ms)':>14} {'current (ms)':>13} {'ratio':>7}", file=sys.stderr)
+    for result in report['results']:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        flag = ' regression' if ratio > threshold else ''
+        if flag:
+            regressions.append(result['name'])
+        print(f"{result['name']:>28} {before['median_ms']:>14.3f} {result['median_ms']:>13.3f} {ratio:>6.2f}x{flag}",
+              file=sys.stderr)
+    if baseline['meta'].get('scale') != report['meta']['scale']:
+        print(f"Warning: baseline was run at scale {baseline['meta'].get('scale')}", file=sys.stderr)
+    return regressions
+
+
+parser = argparse.ArgumentParser(description="Performance benchmarks")
+subparsers = parser.add_subparsers(dest='command')
+
+auth_parser = subparsers.add_parser('auth', help='Account lookup latency by number of accounts')
+auth_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help='Account counts to test')
+auth_parser.add_argument('--lookups', type=int, default=1000, help='Lookups per size')
+
+memory_parser = subparsers.add_parser('memory', help='Resident memory of plain task dicts versus Task models')
+memory_parser.add_argument('--tasks', type=int, default=1000000, help='Number of tasks')
+memory_parser.add_argument('--mode', choices=['dicts', 'models'], help=argparse.SUPPRESS)
+memory_parser.add_argument('--file', type=str, help=argparse.SUPPRESS)
+
+snapshot_parser = subparsers.add_parser('snapshot', help='Load and save time of the JSON store versus the binary snapshot')
+snapshot_parser.add_argument('--projects', type=int, default=1000, help='Number of projects')
+snapshot_parser.add_argument('--tasks', type=int, default=200000, help='Number of tasks')
+
+logging_parser = subparsers.add_parser('logging', help='Per-call logging overhead on mutations and logins')
+logging_parser.add_argument('--calls', type=int, default=2000, help='Calls per measurement')
+
+hashing_parser = subparsers.add_parser('hashing', help='Bulk provisioning throughput by number of hashing workers')
+hashing_parser.add_argument('--users', type=int, default=200, help='Number of accounts to provision')
+hashing_parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}), help='Worker counts to test')
+hashing_parser.add_argument('--iterations', type=int, default=HASH_ITERATIONS, help='PBKDF2 iterations per password')
+
+suite_parser = subparsers.add_parser('suite', help='Time the core operations on generated data and write JSON results')
+suite_parser.add_argument('--scale', choices=list(SCALES), default='small', help='Data set size: small (1k accounts), medium (100k) or large (1M)')
+suite_parser.add_argument('--repeat', type=int, default=20, help='Runs per operation')
+suite_parser.add_argument('--iterations', type=int, default=HASH_ITERATIONS, help='PBKDF2 iterations of the generated accounts')
+suite_parser.add_argument('--seed', type=int, default=0, help='Seed of the data generators')
+suite_parser.add_argument('--output', type=str, help='Write the JSON results here instead of stdout')
+suite_parser.add_argument('--baseline', type=str, help='Earlier JSON results to compare against; exits 1 on a regression')
+suite_parser.add_argument('--threshold', type=float, default=1.25, help='Median slowdown counted as a regression (default: 1.25)')
+
+# Hashing workers re-import this module on platforms that spawn processes.
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    if args.command == 'auth':
+        bench_auth(args.sizes, args.lookups)
+    elif args.command == 'memory' and args.mode:
+        measure_memory(args.mode, args.file)
+    elif args.command == 'memory':
+        bench_memory(args.tasks)
+    elif args.command == 'snapshot':
+        bench_snapshot(args.projects, args.tasks)
+    elif args.command == 'logging':
+        bench_logging(args.calls)
+    elif args.command == 'hashing':
+        bench_hashing(args.users, args.workers, args.iterations)
+    elif args.command == 'suite':
+        report = bench_suite(args.scale, args.repeat, args.iterations, args.seed)
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(report, file, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+        if args.baseline:
+            with open(args.baseline) as file:
+                if compare_results(report, json.load(file), args.threshold):
+                    sys.exit(1)
+    else:
+        parser.print_help()
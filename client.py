@@ -0,0 +1,63 @@
+import json
+import os
+import socket
+from collections import namedtuple
+from http.client import HTTPConnection
+
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+
+Reply = namedtuple('Reply', 'status result error messages')
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceClient:
+    # Talks to `manager.py serve`; an address is host:port, or the path of a Unix socket.
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=30):
+        if os.sep in address or address.endswith('.sock'):
+            self.connection = UnixHTTPConnection(address, timeout)
+        else:
+            host, _, port = address.rpartition(':')
+            self.connection = HTTPConnection(host or 'localhost', int(port), timeout=timeout)
+        self.session = None
+
+    def call(self, operation, **arguments):
+        headers = {'Content-Type': 'application/json'}
+        if self.session:
+            headers['Authorization'] = f'Bearer {self.session}'
+        body = json.dumps(arguments)
+        try:
+            response = self.send(operation, body, headers)
+        except ConnectionError:
+            # The server drops idle keep-alive connections when it restarts; reconnect once.
+            self.connection.close()
+            response = self.send(operation, body, headers)
+        payload = json.loads(response.read() or b'{}')
+        return Reply(response.status, payload.get('result'), payload.get('error'), payload.get('messages', []))
+
+    def send(self, operation, body, headers):
+        self.connection.request('POST', f'/{operation}', body, headers)
+        return self.connection.getresponse()
+
+    def login(self, username, password):
+        reply = self.call('login', username=username, password=password)
+        if reply.status == 200:
+            self.session = reply.result['session']
+        return reply
+
+    def logout(self):
+        reply = self.call('logout')
+        self.session = None
+        return reply
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,84 @@
+import json
+import os
+from collections import deque
+from locks import file_lock
+from models import to_json
+
+HISTORY_SUFFIX = '.history'
+HISTORY_TAIL = 10
+
+
+def history_count(task):
+    log = task.get('history_log')
+    return log[0] if log else len(task.get('history') or [])
+
+
+class HistoryStore:
+    # Entries live in an append-only file; each record points back at the previous one for the same task,
+    # so a task only carries [count, offset of newest record].
+    def __init__(self, filename):
+        # Appends take the project store's lock; inside a store transaction it is already held.
+        self.lock_file = filename
+        self.filename = filename + HISTORY_SUFFIX
+        self.tails = {}
+        self.chains = {}
+
+    def append(self, task, entry):
+        # History still stored inline from older versions moves out on the first new entry.
+        entries = [*(task.get('history') or []), entry]
+        count, head = task.get('history_log') or (0, None)
+        key = (task.project.id, task.id)
+        with file_lock(self.lock_file), open(self.filename, 'ab') as file:
+            offset = file.seek(0, os.SEEK_END)
+            for record in entries:
+                line = json.dumps(dict(record, id=task.project.id, task=task.id, prev=head),
+                                  separators=(',', ':'), default=to_json).encode('utf-8') + b'\n'
+                file.write(line)
+                head = offset
+                offset += len(line)
+        task['history_log'] = [count + len(entries), head]
+        task['history'] = None
+        self.tails.setdefault(key, deque(maxlen=HISTORY_TAIL)).extend(entries)
+        self.chains.pop(key, None)
+
+    def forget(self, project_id=None, task_id=None):
+        # Another process appended to this task's chain, so the cached newest entries are no longer the newest.
+        if project_id is None:
+            self.tails.clear()
+            self.chains.clear()
+            return
+        self.tails.pop((project_id, task_id), None)
+        self.chains.pop((project_id, task_id), None)
+
+    def read(self, file, offset):
+        file.seek(offset)
+        record = json.loads(file.readline())
+        prev = record.pop('prev')
+        del record['id'], record['task']
+        return record, prev
+
+    def entries(self, task, start, stop):
+        # Newest first, so the first page never reaches far into the file.
+        log = task.get('history_log')
+        if not log:
+            return (task.get('history') or [])[::-1][start:stop]
+        count, head = log
+        stop = min(stop, count)
+        key = (task.project.id, task.id)
+        tail = self.tails.get(key, ())
+        entries = [tail[-1 - index] for index in range(start, min(stop, len(tail)))]
+        first = max(start, len(tail))
+        if first >= stop:
+            return entries
+        chain = self.chains.get(key)
+        if chain is None or chain[0] != head:
+            chain = self.chains[key] = [head]
+        records = {}
+        with open(self.filename, 'rb') as file:
+            while len(chain) < stop:
+                record, prev = self.read(file, chain[-1])
+                records[chain[-1]] = record
+                chain.append(prev)
+            for offset in chain[first:stop]:
+                entries.append(records[offset] if offset in records else self.read(file, offset)[0])
+        return entries
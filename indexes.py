@@ -0,0 +1,453 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from models import CLOSED_STATUSES, is_date
+
+
+def unlink(buckets, key, value):
+    bucket = buckets.get(key)
+    if bucket is not None:
+        bucket.pop(value, None)
+        if not bucket:
+            del buckets[key]
+
+
+class MembershipIndex:
+    def __init__(self, projects):
+        self.led = {}
+        self.joined = {}
+        self.users = {}
+        for project_id, project in projects.items():
+            self.add(project_id, project)
+
+    def add(self, project_id, project):
+        self.led.setdefault(project['leader'], {})[project_id] = None
+        self.users[project_id] = set(project['users'])
+        for username in self.users[project_id]:
+            self.joined.setdefault(username, {})[project_id] = None
+
+    def discard(self, project_id, project):
+        unlink(self.led, project['leader'], project_id)
+        for username in self.users.pop(project_id, ()):
+            unlink(self.joined, username, project_id)
+
+    def project_added(self, project):
+        self.add(project.id, project)
+
+    def project_removed(self, project):
+        self.discard(project.id, project)
+
+    def users_changed(self, project):
+        users = set(project['users'])
+        previous = self.users.get(project.id, set())
+        for username in users - previous:
+            self.joined.setdefault(username, {})[project.id] = None
+        for username in previous - users:
+            unlink(self.joined, username, project.id)
+        self.users[project.id] = users
+
+    def led_by(self, username):
+        return list(self.led.get(username, ()))
+
+    def accessible_to(self, username):
+        project_ids = dict(self.led.get(username, {}))
+        project_ids.update(self.joined.get(username, {}))
+        return list(project_ids)
+
+
+class TaskIndex:
+    FIELDS = ('status', 'priority', 'assigned_to')
+
+    def __init__(self, projects):
+        self.tasks = {}
+        self.by_status = {}
+        self.by_priority = {}
+        self.by_assignee = {}
+        for project_id, project in projects.items():
+            for task_id, task in project['tasks'].items():
+                self.add((project_id, task_id), task)
+
+    def add(self, key, task):
+        status, priority, assignees = task.get('status'), task.get('priority'), set(task.get('assigned_to', ()))
+        self.tasks[key] = (status, priority, assignees)
+        self.by_status.setdefault(status, {})[key] = None
+        self.by_priority.setdefault(priority, {})[key] = None
+        for username in assignees:
+            self.by_assignee.setdefault(username, {})[key] = None
+
+    def discard(self, key):
+        entry = self.tasks.pop(key, None)
+        if entry is None:
+            return
+        status, priority, assignees = entry
+        unlink(self.by_status, status, key)
+        unlink(self.by_priority, priority, key)
+        for username in assignees:
+            unlink(self.by_assignee, username, key)
+
+    def project_added(self, project):
+        for task_id, task in project['tasks'].items():
+            self.add((project.id, task_id), task)
+
+    def project_removed(self, project):
+        for task_id in project['tasks']:
+            self.discard((project.id, task_id))
+
+    def task_added(self, task):
+        self.add((task.project.id, task.id), task)
+
+    def task_removed(self, task):
+        self.discard((task.project.id, task.id))
+
+    def task_changed(self, task, field):
+        if field in self.FIELDS:
+            key = (task.project.id, task.id)
+            self.discard(key)
+            self.add(key, task)
+
+    def query(self, status=None, priority=None, assignee=None, exclude_status=None):
+        buckets = []
+        if status is not None:
+            buckets.append(self.by_status.get(status, {}))
+        if priority is not None:
+            buckets.append(self.by_priority.get(priority, {}))
+        if assignee is not None:
+            buckets.append(self.by_assignee.get(assignee, {}))
+        if not buckets:
+            buckets.append(self.tasks)
+        # Walk the smallest bucket and probe the others.
+        buckets.sort(key=len)
+        excluded = self.by_status.get(exclude_status, {}) if exclude_status is not None else {}
+        return [key for key in buckets[0] if key not in excluded and all(key in bucket for bucket in buckets[1:])]
+
+
+def adjust(counter, key, step):
+    counter[key] += step
+    if not counter[key]:
+        del counter[key]
+
+
+def empty_counts():
+    return {'tasks': 0, 'status': Counter(), 'priority': Counter(), 'load': Counter()}
+
+
+def count_entry(task):
+    return task.get('status'), task.get('priority'), frozenset(task.get('assigned_to') or ())
+
+
+def tally(counts, entry, step):
+    status, priority, assignees = entry
+    counts['tasks'] += step
+    adjust(counts['status'], status, step)
+    adjust(counts['priority'], priority, step)
+    if status not in CLOSED_STATUSES:
+        for username in assignees:
+            adjust(counts['load'], username, step)
+
+
+def count_tasks(tasks):
+    counts = empty_counts()
+    for task in tasks.values():
+        tally(counts, count_entry(task), 1)
+    return counts
+
+
+def pack_counts(counts):
+    # As pairs, so statuses and priorities that are not strings survive the round trip through JSON.
+    return {'tasks': counts['tasks'], **{name: list(counts[name].items()) for name in ('status', 'priority', 'load')}}
+
+
+def counts_record(tasks):
+    # Saved with a project so it can be listed before its tasks load; legacy unhashable values are left uncounted.
+    try:
+        return pack_counts(count_tasks(tasks))
+    except TypeError:
+        return None
+
+
+def unpack_counts(data):
+    return {'tasks': data['tasks'], **{name: Counter(dict(map(tuple, data[name])))
+                                       for name in ('status', 'priority', 'load')}}
+
+
+class CounterIndex:
+    # Task counts per project by status and priority, plus open tasks per assignee, adjusted as tasks change
+    # so a summary adds up projects instead of walking their tasks. A project is only counted once asked for;
+    # until its tasks are loaded, sharded and binary stores answer from the counts saved with it.
+    FIELDS = ('status', 'priority', 'assigned_to')
+
+    def __init__(self, projects):
+        self.projects = projects
+        self.tasks = {}
+        self.counts = {}
+
+    def counts_for(self, project_id):
+        counts = self.counts.get(project_id)
+        if counts is None:
+            saved = self.saved_counts(project_id)
+            if saved is not None:
+                return saved
+            counts = self.counts[project_id] = empty_counts()
+            for task_id, task in self.projects[project_id]['tasks'].items():
+                self.add((project_id, task_id), task)
+        return counts
+
+    def saved_counts(self, project_id):
+        loader = getattr(self.projects, 'loader', None)
+        if loader is None or getattr(self.projects[project_id], '_tasks', True) is not None:
+            return None
+        saved = loader.saved_counts(project_id)
+        return None if saved is None else unpack_counts(saved)
+
+    def count(self, key, entry, step):
+        tally(self.counts[key[0]], entry, step)
+
+    def add(self, key, task):
+        entry = self.tasks[key] = count_entry(task)
+        self.count(key, entry, 1)
+
+    def discard(self, key):
+        entry = self.tasks.pop(key, None)
+        if entry is not None:
+            self.count(key, entry, -1)
+
+    def project_removed(self, project):
+        if self.counts.pop(project.id, None) is not None:
+            for task_id in project['tasks']:
+                self.tasks.pop((project.id, task_id), None)
+
+    def task_added(self, task):
+        if task.project.id in self.counts:
+            self.add((task.project.id, task.id), task)
+
+    def task_removed(self, task):
+        self.discard((task.project.id, task.id))
+
+    def task_changed(self, task, field):
+        if field in self.FIELDS and task.project.id in self.counts:
+            key = (task.project.id, task.id)
+            self.discard(key)
+            self.add(key, task)
+
+    def summary(self, project_ids):
+        total = empty_counts()
+        for project_id in project_ids:
+            counts = self.counts_for(project_id)
+            total['tasks'] += counts['tasks']
+            for name in ('status', 'priority', 'load'):
+                total[name].update(counts[name])
+        return total
+
+
+def remove_sorted(entries, entry):
+    position = bisect_left(entries, entry)
+    if position < len(entries) and entries[position] == entry:
+        del entries[position]
+
+
+class DeadlineIndex:
+    # Open tasks with a valid end date as sorted (end_date, project id, task id) entries, for everyone, per
+    # project and per assignee, so a date range is one bisect plus the tasks in it.
+    FIELDS = ('end_date', 'status', 'assigned_to')
+
+    def __init__(self, projects):
+        self.tasks = {}
+        self.everyone = []
+        self.by_project = {}
+        self.by_user = {}
+        # Appended, then sorted once; inserting each in place would move the lists on every task.
+        for project_id, project in projects.items():
+            for task_id, task in project['tasks'].items():
+                self.add((project_id, task_id), task, list.append)
+        for entries in [self.everyone, *self.by_project.values(), *self.by_user.values()]:
+            entries.sort()
+
+    def add(self, key, task, place=insort):
+        end_date = task.get('end_date')
+        if task.get('status') in CLOSED_STATUSES or not is_date(end_date):
+            return
+        assignees = set(task.get('assigned_to') or ())
+        self.tasks[key] = (end_date, assignees)
+        entry = (end_date,) + key
+        place(self.everyone, entry)
+        place(self.by_project.setdefault(key[0], []), entry)
+        for username in assignees:
+            place(self.by_user.setdefault(username, []), entry)
+
+    def discard(self, key):
+        indexed = self.tasks.pop(key, None)
+        if indexed is None:
+            return
+        end_date, assignees = indexed
+        entry = (end_date,) + key
+        remove_sorted(self.everyone, entry)
+        for buckets, bucket_key in [(self.by_project, key[0])] + [(self.by_user, username) for username in assignees]:
+            entries = buckets.get(bucket_key)
+            if entries is not None:
+                remove_sorted(entries, entry)
+                if not entries:
+                    del buckets[bucket_key]
+
+    def project_added(self, project):
+        for task_id, task in project['tasks'].items():
+            self.add((project.id, task_id), task)
+
+    def project_removed(self, project):
+        for task_id in project['tasks']:
+            self.discard((project.id, task_id))
+
+    def task_added(self, task):
+        self.add((task.project.id, task.id), task)
+
+    def task_removed(self, task):
+        self.discard((task.project.id, task.id))
+
+    def task_changed(self, task, field):
+        if field in self.FIELDS:
+            key = (task.project.id, task.id)
+            self.discard(key)
+            self.add(key, task)
+
+    def between(self, first=None, last=None, project_id=None, username=None):
+        # Entries due on or after first and before last; None leaves that end open.
+        if username is not None:
+            entries = self.by_user.get(username, [])
+        elif project_id is not None:
+            entries = self.by_project.get(project_id, [])
+        else:
+            entries = self.everyone
+        start = 0 if first is None else bisect_left(entries, (first,))
+        stop = len(entries) if last is None else bisect_left(entries, (last,))
+        if username is not None and project_id is not None:
+            return [entry for entry in entries[start:stop] if entry[1] == project_id]
+        return entries[start:stop]
+
+
+WORD = re.compile(r'\w+')
+# Words in a title count for more than the same words further down.
+TITLE_WEIGHT = 3
+EXACT_BONUS = 2
+
+
+def words(text):
+    return WORD.findall(text.lower()) if isinstance(text, str) else []
+
+
+def comment_text(entry):
+    # [author, time, text] entries, or a bare line from a legacy comments string.
+    return entry[-1] if isinstance(entry, (list, tuple)) and entry else entry
+
+
+class SearchIndex:
+    # Inverted index from words in a task's title, description and comments to weighted (project id, task id)
+    # postings, with the words kept sorted so a prefix is one bisect away from every word it starts.
+    FIELDS = ('title', 'description', 'comments')
+
+    def __init__(self, projects):
+        self.tasks = {}
+        self.postings = {}
+        self.terms = []
+        # Appended, then sorted once, as in DeadlineIndex.
+        for project_id, project in projects.items():
+            for task_id, task in project['tasks'].items():
+                self.add((project_id, task_id), task, list.append)
+        self.terms.sort()
+
+    def add(self, key, task, place=insort):
+        weights = Counter()
+        for word in words(task.get('title')):
+            weights[word] += TITLE_WEIGHT
+        weights.update(words(task.get('description')))
+        comments = task.get('comments') or ()
+        for entry in [comments] if isinstance(comments, str) else comments:
+            weights.update(words(comment_text(entry)))
+        self.tasks[key] = weights
+        for term, weight in weights.items():
+            self.link(key, term, weight, place)
+
+    def link(self, key, term, weight, place=insort):
+        posting = self.postings.get(term)
+        if posting is None:
+            posting = self.postings[term] = {}
+            place(self.terms, term)
+        posting[key] = weight
+
+    def discard(self, key):
+        weights = self.tasks.pop(key, None)
+        if weights is None:
+            return
+        for term in weights:
+            posting = self.postings[term]
+            del posting[key]
+            if not posting:
+                del self.postings[term]
+                remove_sorted(self.terms, term)
+
+    def project_added(self, project):
+        for task_id, task in project['tasks'].items():
+            self.add((project.id, task_id), task)
+
+    def project_removed(self, project):
+        for task_id in project['tasks']:
+            self.discard((project.id, task_id))
+
+    def task_added(self, task):
+        self.add((task.project.id, task.id), task)
+
+    def task_removed(self, task):
+        self.discard((task.project.id, task.id))
+
+    def task_changed(self, task, field):
+        if field in self.FIELDS:
+            key = (task.project.id, task.id)
+            self.discard(key)
+            self.add(key, task)
+
+    def comment_added(self, task, entry):
+        key = (task.project.id, task.id)
+        weights = self.tasks.setdefault(key, Counter())
+        for word in words(comment_text(entry)):
+            weights[word] += 1
+            self.link(key, word, weights[word])
+
+    def starting_with(self, prefix):
+        position = bisect_left(self.terms, prefix)
+        while position < len(self.terms) and self.terms[position].startswith(prefix):
+            yield self.terms[position]
+            position += 1
+
+    def search(self, text, limit=None, allowed=None):
+        # Every word of the query must start a word of the task; exact words score higher than longer ones.
+        # The rarest word picks the candidates and the others are only looked up for those, so a word that
+        # is in every task costs as much as the rarest one matches.
+        tokens = []
+        for token in dict.fromkeys(words(text)):
+            terms = [(self.postings[term], EXACT_BONUS if term == token else 1) for term in self.starting_with(token)]
+            tokens.append((sum(len(posting) for posting, _ in terms), terms))
+        if not tokens:
+            return []
+        tokens.sort(key=lambda token: token[0])
+        scores = None
+        for size, terms in tokens:
+            if scores is None or len(scores) * len(terms) >= size:
+                matches = {}
+                for posting, bonus in terms:
+                    for key, weight in posting.items():
+                        matches[key] = matches.get(key, 0) + weight * bonus
+                if scores is None:
+                    scores = {key: score for key, score in matches.items() if allowed is None or allowed(key)}
+                else:
+                    scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+            else:
+                for key in list(scores):
+                    score = sum(posting.get(key, 0) * bonus for posting, bonus in terms)
+                    if score:
+                        scores[key] += score
+                    else:
+                        del scores[key]
+            if not scores:
+                return []
+        ranked = ((-score, key) for key, score in scores.items())
+        ranked = heapq.nsmallest(limit, ranked) if limit else sorted(ranked)
+        return [(key, -score) for score, key in ranked]
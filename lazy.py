@@ -0,0 +1,29 @@
+import importlib
+
+
+class LazyImport:
+    def __init__(self, module, name=None):
+        self._module = module
+        self._name = name
+        self._target = None
+
+    def _resolve(self):
+        if self._target is None:
+            target = importlib.import_module(self._module)
+            self._target = getattr(target, self._name) if self._name else target
+        return self._target
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+
+def prefetch(*modules):
+    # Import in the background while the user is still typing at a prompt.
+    import threading
+    def run():
+        for module in modules:
+            importlib.import_module(module)
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,112 @@
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+LOCK_SUFFIX = '.lock'
+
+# path -> [file, depth, shared]; a process takes each lock once and nests inside it.
+held = {}
+# Lock files stay open, so taking an uncontended lock is a single system call.
+files = {}
+
+
+def forget_locks():
+    # A forked child shares the parent's open file descriptions, and with them its flock state.
+    held.clear()
+    files.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_locks)
+
+
+@lru_cache(maxsize=None)
+def lock_path(filename):
+    # abspath costs a getcwd() call, which would otherwise dominate every nested lock.
+    return os.path.abspath(filename) + LOCK_SUFFIX
+
+
+def acquire(file, shared):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        return
+    # msvcrt has no shared mode, so on Windows readers take the exclusive lock as well.
+    file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def release(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(filename, shared=False):
+    # Advisory lock on a sidecar file. Writers hold it exclusively only while they catch up with other
+    # processes and append; readers share it, so they never wait for each other.
+    path = lock_path(filename)
+    shared = shared and fcntl is not None
+    entry = held.get(path)
+    if entry is not None:
+        upgrade = entry[2] and not shared
+        if upgrade:
+            acquire(entry[0], False)
+            entry[2] = False
+        entry[1] += 1
+        try:
+            yield
+        finally:
+            entry[1] -= 1
+            if upgrade:
+                acquire(entry[0], True)
+                entry[2] = True
+        return
+    while True:
+        file = files.get(path)
+        if file is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            file = files[path] = open(path, 'a+')
+        acquire(file, shared)
+        if os.fstat(file.fileno()).st_nlink:
+            break
+        # The lock file was deleted while open; others would lock its replacement.
+        release(file)
+        file.close()
+        del files[path]
+    held[path] = [file, 1, shared]
+    try:
+        yield
+    finally:
+        del held[path]
+        release(file)
+
+
+def generation(filename):
+    # Compactions bump a counter kept in the held lock file, so other processes can tell a replaced file from
+    # one that merely grew; file identity is not enough once inode numbers are reused.
+    file = held[lock_path(filename)][0]
+    file.seek(0)
+    return int(file.read() or 0)
+
+
+def bump_generation(filename):
+    value = generation(filename) + 1
+    file = held[lock_path(filename)][0]
+    file.truncate(0)
+    file.write(str(value))
+    file.flush()
+    return value
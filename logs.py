@@ -0,0 +1,84 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from lazy import LazyImport
+
+logger = LazyImport('loguru', 'logger')
+
+LOG_FILE = os.path.join('APelahishokr', 'application.log')
+LOG_LEVEL = os.environ.get('PMS_LOG_LEVEL', 'INFO')
+LOG_JSON = os.environ.get('PMS_LOG_JSON', '') not in ('', '0')
+LOG_SAMPLE = int(os.environ.get('PMS_LOG_SAMPLE', 1))
+LOG_ROTATION_BYTES = 1024 * 1024
+
+handlers = []
+
+
+class Sampler:
+    # Hot paths log at DEBUG; when that level is enabled keep one record in every N per call site.
+    def __init__(self, every):
+        self.every = every
+        self.counts = {}
+
+    def __call__(self, record):
+        if self.every <= 1 or record['level'].no > 10:
+            return True
+        site = (record['name'], record['line'])
+        count = self.counts.get(site, 0)
+        self.counts[site] = count + 1
+        return count % self.every == 0
+
+
+class BackgroundSink:
+    # loguru formats in the calling thread; writes, flushes and rotation happen on a daemon thread.
+    # loguru's own enqueue=True pickles every record through a multiprocessing queue, which costs more than it saves.
+    def __init__(self, filename, rotation_bytes=LOG_ROTATION_BYTES):
+        self.filename = filename
+        self.rotation_bytes = rotation_bytes
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, message):
+        self.queue.put(str(message))
+
+    def rotate(self, file):
+        file.close()
+        root, extension = os.path.splitext(self.filename)
+        os.replace(self.filename, f"{root}.{time.strftime('%Y-%m-%d_%H-%M-%S')}_{time.time_ns() % 10**9:09d}{extension}")
+        return open(self.filename, 'a', encoding='utf-8')
+
+    def run(self):
+        file = open(self.filename, 'a', encoding='utf-8')
+        size = file.tell()
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            file.write(message)
+            size += len(message)
+            if size >= self.rotation_bytes:
+                file = self.rotate(file)
+                size = 0
+            elif self.queue.empty():
+                file.flush()
+        file.close()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+
+
+def setup_logging(filename=LOG_FILE, level=LOG_LEVEL, serialize=LOG_JSON, sample=LOG_SAMPLE):
+    # One process-wide sink; later calls are no-ops so callers never stack duplicates.
+    if handlers:
+        return handlers[0]
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    sink = BackgroundSink(filename)
+    logger.remove()
+    handlers.append(logger.add(sink.put, level=level, serialize=serialize, filter=Sampler(sample)))
+    return handlers[0]
@@ -1,123 +1,222 @@
-import json
+import atexit
 import os
+import sys
+import time
 import uuid
 import re
-from enum import Enum
-from datetime import datetime
-from account import UserAccount
-import pandas as pd
+import heapq
+from datetime import date, datetime, timedelta
+from account import ADMIN_FILE, UserAccount
+from store import (
+    JOURNAL_COMPACT_BYTES,
+    ProjectStore,
+    open_store,
+    default_projects_file,
+    index_of,
+    compact_projects,
+    write_snapshot,
+    notify,
+    history_of,
+    attach_project,
+    detach_project,
+    attach_task,
+    detach_task,
+    transaction,
+    catch_up,
+    version_of,
+    is_attached,
+    changed_since
+)
+from indexes import CounterIndex, DeadlineIndex, MembershipIndex, SearchIndex, TaskIndex
+from models import PRIORITY_VALUES, STATUS_VALUES, TaskStatus, TaskPriority, is_date, parse_date
+from history import history_count
 from rich.console import Console
-from rich.table import Table
-from loguru import logger
+from itertools import islice
+from lazy import LazyImport, prefetch
+from logs import setup_logging
+from metrics import timed
+from pager import Pager
+from sessions import SessionCache, clear_token, read_token, write_token
+
+Table = LazyImport('rich.table', 'Table')
+logger = LazyImport('loguru', 'logger')
 
 console = Console()
-logger.add(".\\APelahishokr\\application.log", rotation="1 MB")
+COMMENTS_SHOWN = 3
+SEARCH_RESULTS = 20
+
 
 
 
+enum_lookup = {}
+
+def parse_enum(enum_class, text):
+    lookup = enum_lookup.get(enum_class)
+    if lookup is None:
+        lookup = {}
+        for member in enum_class:
+            lookup[member.name] = lookup[member.value.replace(' ', '').upper()] = member.value
+        enum_lookup[enum_class] = lookup
+    try:
+        return lookup[text.replace(' ', '').upper()]
+    except KeyError:
+        raise ValueError(f"Invalid {enum_class.__name__}: {text}") from None
 
-class TaskStatus(Enum):
-    BACKLOG = "Backlog"
-    TODO = "To Do"
-    DOING = "Doing"
-    DONE = "Done"
-    ARCHIVED = "Archived"
 
+def parse_usernames(text):
+    return [username.strip() for username in text.split(',') if username.strip()]
 
-class TaskPriority(Enum):
-    CRITICAL = "Critical"
-    HIGH = "High"
-    MEDIUM = "Medium"
-    LOW = "Low"
 
+def validate_dates(start_date, end_date):
+    if is_date(start_date) and is_date(end_date) and end_date < start_date:
+        raise ValueError(f"End date {end_date} is before start date {start_date}.")
 
-def load_projects(filename):
+
+def prompt_date(prompt):
+    while True:
+        try:
+            return parse_date(input(prompt))
+        except ValueError as error:
+            console.print(f"[bold red]Error:[/bold red] {error}")
+
+
+@timed('load_projects')
+def load_projects(filename, journal=True):
     logger.info("Loading projects from {}", filename)
-    try:
-        with open(filename, 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        logger.warning("Projects file not found, creating a new one.")
-        return {}
+    projects = open_store(filename, journal)
+    projects.index(MembershipIndex)
+    return projects
 
 
-def save_projects(filename, projects):
+@timed('save_projects')
+def save_projects(filename, projects, force=False):
+    # force writes changes held back by the save interval, as on logout; unchanged projects are never rewritten.
+    own_file = isinstance(projects, ProjectStore) and filename == projects.filename
+    journal = getattr(projects, 'journal', None)
+    if journal is not None and own_file:
+        # Mutations are already on disk in the journal; only fold it in once it grows large.
+        if journal.size >= JOURNAL_COMPACT_BYTES:
+            compact_projects(projects)
+        return
+    if own_file and not projects.save_due(force):
+        if projects.dirty and not projects.flush_at_exit:
+            projects.flush_at_exit = True
+            atexit.register(save_projects, filename, projects, True)
+        return
+    if own_file and projects.shards is not None:
+        conflicts = projects.shards.save(projects)
+        projects.mark_saved()
+        for project_id in conflicts:
+            title = projects[project_id]['title'] if project_id in projects else project_id
+            console.print(f"[bold yellow]Warning:[/bold yellow] Project '{title}' was changed by another user; "
+                          "your changes to it were not saved.")
+        return
     logger.info("Saving projects to {}", filename)
-    with open(filename, 'w') as file:
-        json.dump(projects, file, indent=4)
+    write_snapshot(filename, projects)
+    if own_file:
+        projects.mark_saved()
 
 
-def create_project(projects, title, leader):
+@timed('create_project')
+def create_project(projects, title, leader, project_id=None):
     logger.info("Creating project: {} by leader: {}", title, leader)
-    project_id = str(uuid.uuid4())
-    projects[project_id] = {'title': title, 'leader': leader, 'users': [leader], 'tasks': {}}
+    project_id = project_id or str(uuid.uuid4())
+    with transaction(projects):
+        attach_project(projects, project_id, {'title': title, 'leader': leader, 'users': [leader], 'tasks': {}})
     return projects
 
 
+@timed('add_user_to_project')
 def add_user_to_project(projects, project_id, username):
-    logger.info("Adding user: {} to project ID: {}", username, project_id)
-    if username not in projects[project_id]['users']:
-        projects[project_id]['users'].append(username)
-        logger.info("User added successfully to project ID: {}", project_id)
-        return True
-    else:
-        console.print("[bold yellow]Warning:[/bold yellow] User already has access to this project.")
-        logger.warning("User already has access to project ID: {}", project_id)
-        return False
+    logger.debug("Adding user: {} to project ID: {}", username, project_id)
+    with transaction(projects):
+        if project_id not in projects:
+            console.print("[bold red]Error:[/bold red] Project ID not found.")
+            return False
+        if username not in projects[project_id]['users']:
+            projects[project_id]['users'].append(username)
+            notify(projects[project_id], 'users_changed')
+            logger.info("User added successfully to project ID: {}", project_id)
+            return True
+    console.print("[bold yellow]Warning:[/bold yellow] User already has access to this project.")
+    logger.warning("User already has access to project ID: {}", project_id)
+    return False
 
 
 def can_access_project(project, username, role):
     return username == project['leader'] or username in project['users'] or role == "admin"
 
 
+@timed('remove_user_from_project')
 def remove_user_from_project(projects, project_id, username):
-    logger.info("Removing user: {} from project ID: {}", username, project_id)
-    if username in projects[project_id]['users']:
-        projects[project_id]['users'].remove(username)
-        logger.info("User removed successfully from project ID: {}", project_id)
-        return True
-    else:
-        console.print("[bold yellow]Warning:[/bold yellow] User not found in this project.")
-        logger.warning("User not found in project ID: {}", project_id)
-        return False
-
-
+    logger.debug("Removing user: {} from project ID: {}", username, project_id)
+    with transaction(projects):
+        if project_id not in projects:
+            console.print("[bold red]Error:[/bold red] Project ID not found.")
+            return False
+        if username in projects[project_id]['users']:
+            projects[project_id]['users'].remove(username)
+            notify(projects[project_id], 'users_changed')
+            logger.info("User removed successfully from project ID: {}", project_id)
+            return True
+    console.print("[bold yellow]Warning:[/bold yellow] User not found in this project.")
+    logger.warning("User not found in project ID: {}", project_id)
+    return False
+
+
+@timed('remove_task_from_project')
 def remove_task_from_project(project, task_id):
-    if task_id in project['tasks']:
-        del project['tasks'][task_id]
-        console.print("[bold green]Task removed successfully![/bold green]")
-    else:
-        console.print("[bold red]Error:[/bold red] Task ID not found.")
+    with transaction(project):
+        if task_id in project['tasks']:
+            detach_task(project, task_id)
+            console.print("[bold green]Task removed successfully![/bold green]")
+            return
+    console.print("[bold red]Error:[/bold red] Task ID not found.")
 
 
+@timed('remove_project')
 def remove_project(projects, project_id):
-    if project_id in projects:
-        del projects[project_id]
-        console.print("[bold green]Project removed successfully![/bold green]")
-    else:
-        console.print("[bold red]Error:[/bold red] Project ID not found.")
+    with transaction(projects):
+        if project_id in projects:
+            detach_project(projects, project_id)
+            console.print("[bold green]Project removed successfully![/bold green]")
+            return
+    console.print("[bold red]Error:[/bold red] Project ID not found.")
+
+
+def next_task_id(project):
+    task_number = len(project['tasks']) + 1
+    while str(task_number) in project['tasks']:
+        task_number += 1
+    return str(task_number)
 
 
 def add_task(project):
-    task_id = len(project['tasks']) + 1
     task_title = input("Enter task title: ")
     task_description = input("Enter task description: ")
-    start_date = input("Enter start date (YYYY-MM-DD): ")
-    end_date = input("Enter end date (YYYY-MM-DD): ")
-    assigned_to = input("Enter comma-separated usernames assigned to this task: ").split(',')
+    start_date = prompt_date("Enter start date (YYYY-MM-DD): ")
+    while True:
+        end_date = prompt_date("Enter end date (YYYY-MM-DD): ")
+        try:
+            validate_dates(start_date, end_date)
+            break
+        except ValueError as error:
+            console.print(f"[bold red]Error:[/bold red] {error}")
+    assigned_to = parse_usernames(input("Enter comma-separated usernames assigned to this task: "))
     while True:
         try:
-            priority=TaskPriority[ input("Enter task priority (Critical/High/Medium/Low): ").upper()].value
+            priority = parse_enum(TaskPriority, input("Enter task priority (Critical/High/Medium/Low): "))
             break
         except ValueError:
             console.print("[bold red]Error:[/bold red] Invalid input.")
     while True:
         try:
-            status = TaskStatus[input("Enter task status (Backlog/ToDo/Doing/Done/Archived): ").upper()].value
+            status = parse_enum(TaskStatus, input("Enter task status (Backlog/ToDo/Doing/Done/Archived): "))
             break
         except ValueError:
             console.print("[bold red]Error:[/bold red] Invalid input.")
-    comments = project["leader"]+": "+input("Enter comments for the task: ")
+    comment = input("Enter comments for the task: ")
+    comments = [[project["leader"], str(datetime.now()), comment]] if comment else []
 
     task = {
         'title': task_title,
@@ -127,14 +226,88 @@ def add_task(project):
         'assigned_to': assigned_to,
         'priority': priority,
         'status': status,
-        'comments': comments,
-        'hisotry' : []
+        'comments': comments
     }
-    project['tasks'][task_id] = task
+    create_task(project, task)
+
+
+@timed('create_task')
+def create_task(project, task):
+    # Numbered only once the lock is held, so tasks added by other sessions meanwhile keep their ids.
+    with transaction(project):
+        if not is_attached(project):
+            console.print("[bold red]Error:[/bold red] Project was removed by another user.")
+            return None
+        task_id = next_task_id(project)
+        attach_task(project, task_id, task)
     console.print("[bold green]Task added successfully![/bold green]")
+    return task_id
+
+@timed('import_projects')
+def import_projects(projects, records):
+    imported = skipped = 0
+    with transaction(projects):
+        for record in records:
+            title, leader = (record.get('title') or '').strip(), (record.get('leader') or '').strip()
+            project_id = (record.get('id') or '').strip() or str(uuid.uuid4())
+            if not title or not leader or project_id in projects:
+                skipped += 1
+                continue
+            users = record.get('users') or []
+            if isinstance(users, str):
+                users = parse_usernames(users)
+            attach_project(projects, project_id, {'title': title, 'leader': leader, 'tasks': {},
+                                                  'users': [leader] + [user for user in users if user != leader]})
+            imported += 1
+    logger.info("Imported {} projects, skipped {}", imported, skipped)
+    return imported, skipped
+
+
+@timed('import_tasks')
+def import_tasks(projects, records):
+    imported = skipped = 0
+    with transaction(projects):
+        for record in records:
+            project = projects.get(record.get('project') or '')
+            title = (record.get('title') or '').strip()
+            if project is None or not title:
+                skipped += 1
+                continue
+            try:
+                priority = parse_enum(TaskPriority, record.get('priority') or '')
+                status = parse_enum(TaskStatus, record.get('status') or '')
+                start_date = parse_date(record.get('start_date') or '')
+                end_date = parse_date(record.get('end_date') or '')
+                validate_dates(start_date, end_date)
+            except ValueError:
+                skipped += 1
+                continue
+            assigned_to = record.get('assigned_to') or []
+            if isinstance(assigned_to, str):
+                assigned_to = parse_usernames(assigned_to)
+            task_id = (record.get('id') or '').strip() or next_task_id(project)
+            if task_id in project['tasks']:
+                skipped += 1
+                continue
+            attach_task(project, task_id, {
+                'title': title,
+                'description': record.get('description') or '',
+                'start_date': start_date,
+                'end_date': end_date,
+                'assigned_to': assigned_to,
+                'priority': priority,
+                'status': status,
+                'comments': record.get('comments') or ''
+            })
+            imported += 1
+    logger.info("Imported {} tasks, skipped {}", imported, skipped)
+    return imported, skipped
+
 
 def view_projects(projects, username, role):
-    leader_projects = {idx: (pid,proj) for idx, (pid, proj) in enumerate(projects.items()) if proj['leader'] == username or role=="admin"}
+    catch_up(projects)
+    project_ids = list(projects) if role == "admin" else index_of(projects, MembershipIndex).led_by(username)
+    leader_projects = {idx: (pid, projects[pid]) for idx, pid in enumerate(project_ids)}
 
     console.print("[bold cyan]Projects you are leading:[/bold cyan]")
     table = Table(show_header=True, header_style="bold magenta")
@@ -142,9 +315,14 @@ def view_projects(projects, username, role):
     table.add_column("Project ID")
     table.add_column("Title")
     table.add_column("Leader")
+    table.add_column("Tasks", justify="right")
+    table.add_column("By Status")
+    counters = index_of(projects, CounterIndex)
     i=0
     for  project_id, (id,project) in leader_projects.items():
-        table.add_row(str(i), id, project['title'],project['leader'])
+        counts = counters.counts_for(id)
+        table.add_row(str(i), id, project['title'],project['leader'], str(counts['tasks']),
+                      format_counts(counts['status'], STATUS_VALUES))
         i+=1
 
     console.print(table)
@@ -192,19 +370,29 @@ def manage_project(projects, project_id, project, username,role):
 
 
 def manage_tasks(project,username,role):
+    pager = Pager(len(project['tasks']))
     while True:
-        view_tasks_for_project(project, username,role)
+        catch_up(project.store)
+        pager.update(len(project['tasks']))
+        view_tasks_for_project(project, username,role, pager)
         task_index = input("Enter the Task Index you want to manage (or press Enter to go back): ")
         if not task_index:
             break
+        if pager.navigate(task_index):
+            continue
 
         try:
             task_index = int(task_index)
-            task_list = list(project['tasks'].items())
-            if 0 <= task_index and task_index< len(task_list):
-                task_id, task = task_list[task_index]
-                print(0)
-                view_task_history(task)
+            if 0 <= task_index and task_index< len(project['tasks']):
+                task_id, task = next(islice(project['tasks'].items(), task_index, None))
+                history_pager = Pager(history_count(task))
+                view_task_history(task, history_pager)
+                while history_pager.pages > 1 and history_pager.navigate(input("Navigate history (or press Enter to continue): ")):
+                    view_task_history(task, history_pager)
+                comments_pager = Pager(len(task.get('comments') or []))
+                view_task_comments(task, comments_pager)
+                while comments_pager.pages > 1 and comments_pager.navigate(input("Navigate comments (or press Enter to continue): ")):
+                    view_task_comments(task, comments_pager)
 
                 if not (can_access_task(task, project['leader'], username, role) and username!=project['leader'] and role!='admin'):
                    update_task(task, project['leader'])
@@ -220,6 +408,7 @@ def can_access_task(task, project_leader, username, role):
 
 def update_task(task, username):
     while True:
+        version = version_of(task)
         console.print(f"\n[bold]Updating Task: {task['title']}[/bold]")
         console.print("1. [bold]Title[/bold]")
         console.print("2. [bold]Description[/bold]")
@@ -234,56 +423,108 @@ def update_task(task, username):
         choice = input("Enter the number of the attribute you want to update (or '9' to finish): ")
 
         if choice == '1':
-            task['title'] = input(f"Enter new title (leave blank to keep '{task['title']}'): ") or task['title']
-            record_task_history(task, 'title', task['title'])
+            set_task_field(task, 'title', input(f"Enter new title (leave blank to keep '{task['title']}'): ") or task['title'], username, version)
         elif choice == '2':
-            task['description'] = input(f"Enter new description (leave blank to keep '{task['description']}'): ") or task['description']
-            record_task_history(task, 'description', task['description'])
+            set_task_field(task, 'description', input(f"Enter new description (leave blank to keep '{task['description']}'): ") or task['description'], username, version)
         elif choice == '3':
-            task['start_date'] = input(f"Enter new start date (leave blank to keep '{task['start_date']}'): ") or task['start_date']
-            record_task_history(task, 'start_date', task['start_date'])
+            set_task_date(task, 'start_date', input(f"Enter new start date (leave blank to keep '{task['start_date']}'): "), username, version)
         elif choice == '4':
-            task['end_date'] = input(f"Enter new end date (leave blank to keep '{task['end_date']}'): ") or task['end_date']
-            record_task_history(task, 'end_date', task['end_date'])
+            set_task_date(task, 'end_date', input(f"Enter new end date (leave blank to keep '{task['end_date']}'): "), username, version)
         elif choice == '5':
-            new_assigned_to = input(f"Enter new assigned users (comma-separated, leave blank to keep '{', '.join(task['assigned_to'])}'): ").split(',')
-            task['assigned_to']+=new_assigned_to
-            record_task_history(task, 'assigned_to', ', '.join(task['assigned_to']))
+            new_assigned_to = parse_usernames(input(f"Enter new assigned users (comma-separated, leave blank to keep '{', '.join(task['assigned_to'])}'): "))
+            set_task_field(task, 'assigned_to', task['assigned_to'] + new_assigned_to, username, version)
         elif choice == '6':
             new_pr = input(f"Enter new priority (leave blank to keep '{task['priority']}'): ") or task['priority']
             try:
-                task['priority']=TaskPriority[new_pr.upper()].value
+                set_task_field(task, 'priority', parse_enum(TaskPriority, new_pr), username, version)
             except ValueError:
                 console.print("[bold red]Error:[/bold red] Invalid input.")
-            record_task_history(task, 'priority', task['priority'])
         elif choice == '7':
             new_status = input(f"Enter new status (leave blank to keep '{task['status']}'): ") or task['status']
             try:
-                task['status']=TaskPriority[new_status.upper()].value
+                set_task_field(task, 'status', parse_enum(TaskStatus, new_status), username, version)
             except ValueError:
                 console.print("[bold red]Error:[/bold red] Invalid input.")
-            record_task_history(task, 'status', new_status)
-            task['status'] = new_status
         elif choice == '8':
-            task['comments'] = input(f"Enter new comments (leave blank to keep '{task['comments']}'): ") or task['comments']
-            record_task_history(task, 'comments', task['comments'])
+            add_comment(task, username, input("Enter a new comment (leave blank to skip): "))
         elif choice == '9':
             console.print("[bold green]Task update complete![/bold green]")
             break
         else:
             console.print("[bold red]Error:[/bold red] Invalid choice. Please enter a number between 1 and 9.")
 
-def record_task_history(task, field, new_value):
-    task.setdefault('history', []).append({
+def set_task_date(task, field, text, username, version=None):
+    if not text.strip():
+        return False
+    try:
+        value = parse_date(text)
+        if field == 'start_date':
+            validate_dates(value, task.get('end_date'))
+        else:
+            validate_dates(task.get('start_date'), value)
+    except ValueError as error:
+        console.print(f"[bold red]Error:[/bold red] {error}")
+        return False
+    return set_task_field(task, field, value, username, version)
+
+
+def record_task_history(task, field, old_value, new_value, username):
+    entry = {
         'field': field,
-        'old': task.get(field),
+        'old': old_value,
         'new': new_value,
         'updated_by': username,
         'date': str(datetime.now())
-    })
+    }
+    history = history_of(task)
+    if history is None:
+        task.setdefault('history', []).append(entry)
+    else:
+        migrated = 'history' in task
+        history.append(task, entry)
+        if migrated:
+            notify(task, 'task_changed', 'history')
+        notify(task, 'task_changed', 'history_log')
+    notify(task, 'history_added', entry)
+
+
+@timed('set_task_field')
+def set_task_field(task, field, value, username, version=None):
+    # version is the project version the new value was based on; a change to the same field by another
+    # session after that is a conflict, while changes to other fields merge.
+    version = version_of(task) if version is None else version
+    with transaction(task):
+        if not is_attached(task):
+            console.print("[bold red]Error:[/bold red] Task was removed by another user.")
+            return False
+        if changed_since(task, field, version):
+            console.print(f"[bold red]Error:[/bold red] {field} was changed by another user to '{task.get(field)}'; "
+                          "your change was not saved.")
+            logger.warning("Conflicting update of {} on task {} of project ID: {}", field, task.id, task.project.id)
+            return False
+        record_task_history(task, field, task.get(field), value, username)
+        task[field] = value
+        notify(task, 'task_changed', field)
+    return True
+
+
+@timed('add_comment')
+def add_comment(task, username, text):
+    # Comments are appended, never rewritten, so history and the journal only carry the new entry.
+    if not text:
+        return
+    with transaction(task):
+        if not is_attached(task):
+            console.print("[bold red]Error:[/bold red] Task was removed by another user.")
+            return
+        entry = [username, str(datetime.now()), text]
+        record_task_history(task, 'comments', '', text, username)
+        task.setdefault('comments', []).append(entry)
+        notify(task, 'comment_added', entry)
 
 def update_task_status_or_comment(task, username):
     while True:
+        version = version_of(task)
         console.print(f"\n[bold]Updating Task: {task['title']}[/bold]")
         console.print("1. [bold]Status[/bold]")
         console.print("2. [bold]Comments[/bold]")
@@ -294,21 +535,29 @@ def update_task_status_or_comment(task, username):
         if choice == '1':
             new_status = input(f"Enter new status (leave blank to keep '{task['status']}'): ") or task['status']
             try:
-                new_status=TaskPriority[new_status.upper()].value
+                if not set_task_field(task, 'status', parse_enum(TaskStatus, new_status), username, version):
+                    continue
             except ValueError:
                 console.print("[bold red]Error:[/bold red] Invalid input.")
-            record_task_history(task, 'status', new_status)
-            task['status'] = new_status
+                continue
             console.print("[bold green]Task status updated successfully![/bold green]")
         elif choice == '2':
-            task['comments'] =task['comments']+'\n'+username + ": "+input(f"Enter new comments : ")
-            record_task_history(task, 'comments', task['comments'])
+            add_comment(task, username, input(f"Enter new comments : "))
             console.print("[bold green]Task comments updated successfully![/bold green]")
         elif choice == '3':
             break
         else:
             console.print("[bold red]Error:[/bold red] Invalid choice. Please enter a number between 1 and 3.")
-def view_task_history(task):
+def task_history(task, start, stop):
+    history = history_of(task)
+    if history is None:
+        return task.get('history', [])[::-1][start:stop]
+    return history.entries(task, start, stop)
+
+
+@timed('view_task_history')
+def view_task_history(task, pager=None):
+    pager = pager or Pager(history_count(task))
     console.print(f"[bold cyan]History for Task: {task['title']}[/bold cyan]")
     table = Table(show_header=True, header_style="bold magenta")
     table.add_column("Field", style="dim", width=12)
@@ -316,50 +565,235 @@ def view_task_history(task):
     table.add_column("New Value")
     table.add_column("Updated By")
 
-    for record in task.get('history', []):
-        table.add_row(record['field'], record['old'], record['new'], record['updated_by'])
+    for record in task_history(task, pager.start, pager.stop):
+        table.add_row(record['field'], str(record['old']), str(record['new']), record['updated_by'])
 
     console.print(table)
-def view_tasks_for_project(project, username,role):
+    console.print(pager.footer())
+def format_comments(comments, limit=COMMENTS_SHOWN):
+    if not comments or isinstance(comments, str):
+        return comments or ''
+    lines = [f"{author}: {text}" if author else text for author, _, text in comments[-limit:]]
+    if len(comments) > limit:
+        lines.insert(0, f"[dim]({len(comments) - limit} earlier)[/dim]")
+    return '\n'.join(lines)
+
+
+@timed('view_task_comments')
+def view_task_comments(task, pager=None):
+    comments = task.get('comments') or []
+    pager = pager or Pager(len(comments))
+    console.print(f"[bold cyan]Comments for Task: {task['title']}[/bold cyan]")
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Author", style="dim", width=12)
+    table.add_column("Date")
+    table.add_column("Comment")
+    for author, when, text in comments[::-1][pager.start:pager.stop]:
+        table.add_row(author or '', when or '', text)
+    console.print(table)
+    console.print(pager.footer())
+
+
+@timed('view_tasks_for_project')
+def view_tasks_for_project(project, username,role, pager=None):
+    pager = pager or Pager(len(project['tasks']))
     console.print(f"[bold cyan]Tasks in Project: {project['title']}[/bold cyan]")
 
     table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Index", style="dim", width=6)
     table.add_column("Task ID", style="dim", width=12)
     table.add_column("Title")
     table.add_column("Priority")
     table.add_column("Status")
     table.add_column("Comments")
 
-    for task_id, task in project['tasks'].items():
-        table.add_row(str(task_id), task['title'], task['priority'], task['status'], task['comments'])
+    page = islice(project['tasks'].items(), pager.start, pager.stop)
+    for index, (task_id, task) in enumerate(page, pager.start):
+        table.add_row(str(index), str(task_id), task['title'], task['priority'], task['status'], format_comments(task.get('comments')))
 
     console.print(table)
+    console.print(pager.footer())
 
 
-def view_tasks(projects, username, role):
-    user_projects = {pid: proj for pid, proj in projects.items() if can_access_project(proj, username, role)}
+@timed('query_tasks')
+def query_tasks(projects, status=None, priority=None, assignee=None, exclude_status=None, sort_by=None):
+    keys = index_of(projects, TaskIndex).query(status, priority, assignee, exclude_status)
+    results = [(project_id, task_id, projects[project_id]['tasks'][task_id]) for project_id, task_id in keys]
+    if sort_by:
+        results.sort(key=lambda result: result[2].get(sort_by) or '')
+    return results
+
+
+@timed('view_query_results')
+def view_query_results(results):
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Project ID", style="dim")
+    table.add_column("Task ID", style="dim")
+    table.add_column("Title")
+    table.add_column("Priority")
+    table.add_column("Status")
+    table.add_column("Assigned To")
+    table.add_column("End Date")
+    for project_id, task_id, task in results:
+        table.add_row(project_id, str(task_id), task['title'], task['priority'], task['status'],
+                      ', '.join(task['assigned_to']), task['end_date'])
+    console.print(table)
 
-    console.print("[bold cyan]Tasks you have access to:[/bold cyan]")
-    for project_id, project in user_projects.items():
-        console.print(f"\n[bold]Project ID: {project_id}[/bold], Title: {project['title']}")
 
-        table = Table(show_header=True, header_style="bold magenta")
-        table.add_column("Task ID", style="dim", width=12)
-        table.add_column("Title")
-        table.add_column("Description")
-        table.add_column("Priority")
-        table.add_column("Status")
-        table.add_column("Comments")
-        user_tasks = {task_id: task for task_id, task in project['tasks'].items() if len(project['tasks'])!=0 and (username in task["assigned_to"] or role=="admin" or username==project["leader"])}
-        for task_id, task in user_tasks.items():
-            table.add_row(str(task_id), task['title'],task['description'], task['priority'], task['status'], task['comments'])
+def deadline_keys(projects, username, role, first=None, last=None):
+    # Open tasks due in [first, last) that the user is assigned to or leads, soonest first.
+    index = index_of(projects, DeadlineIndex)
+    if role == "admin":
+        return index.between(first, last)
+    ranges = [index.between(first, last, username=username)]
+    for project_id in index_of(projects, MembershipIndex).led_by(username):
+        ranges.append(index.between(first, last, project_id=project_id))
+    keys = []
+    for entry in heapq.merge(*ranges):
+        if not keys or keys[-1] != entry:
+            keys.append(entry)
+    return keys
 
-        console.print(table)
 
+def overdue_tasks(projects, username, role, today=None):
+    today = today or date.today().isoformat()
+    return [(project_id, task_id, projects[project_id]['tasks'][task_id])
+            for _, project_id, task_id in deadline_keys(projects, username, role, last=today)]
+
+
+def due_soon_tasks(projects, username, role, days=7, today=None):
+    today = today or date.today().isoformat()
+    last = (date.fromisoformat(today) + timedelta(days=days + 1)).isoformat()
+    return [(project_id, task_id, projects[project_id]['tasks'][task_id])
+            for _, project_id, task_id in deadline_keys(projects, username, role, today, last)]
+
+
+def view_deadlines(projects, username, role):
+    catch_up(projects)
+    days = input("Show tasks due within how many days? (default 7): ").strip()
+    days = int(days) if days.isdigit() else 7
+    console.print("[bold red]Overdue tasks:[/bold red]")
+    view_query_results(overdue_tasks(projects, username, role))
+    console.print(f"[bold cyan]Tasks due in the next {days} days:[/bold cyan]")
+    view_query_results(due_soon_tasks(projects, username, role, days))
+
+
+def format_counts(counter, order=()):
+    # Known values in enum order, then anything older versions let through.
+    keys = [key for key in order if counter.get(key)] + sorted((key for key in counter if key not in order), key=str)
+    return ', '.join(f"{key}: {counter[key]}" for key in keys)
+
+
+def dashboard_row(table, project_id, title, counts):
+    statuses = [str(counts['status'].get(status, 0)) for status in STATUS_VALUES]
+    table.add_row(project_id, title, str(counts['tasks']), *statuses, format_counts(counts['priority'], PRIORITY_VALUES))
+
+
+def view_dashboard(projects, username, role):
+    # Read from counters kept up to date as tasks change, so this costs one row per project.
+    catch_up(projects)
+    counters = index_of(projects, CounterIndex)
+    project_ids = list(projects) if role == "admin" else index_of(projects, MembershipIndex).led_by(username)
+    table = Table(title="Dashboard", show_header=True, header_style="bold magenta")
+    table.add_column("Project ID", style="dim")
+    table.add_column("Title")
+    table.add_column("Tasks", justify="right")
+    for status in STATUS_VALUES:
+        table.add_column(status, justify="right")
+    table.add_column("By Priority")
+    for project_id in project_ids:
+        dashboard_row(table, project_id, projects[project_id]['title'], counters.counts_for(project_id))
+    summary = counters.summary(project_ids)
+    table.add_section()
+    dashboard_row(table, "", "[bold]Total[/bold]", summary)
+    console.print(table)
+
+    load = Table(title="Open tasks per assignee", show_header=True, header_style="bold magenta")
+    load.add_column("Username")
+    load.add_column("Open Tasks", justify="right")
+    for assignee, count in summary['load'].most_common():
+        load.add_row(assignee, str(count))
+    console.print(load)
+    return summary
+
+
+def accessible_task_keys(projects, username, role):
+    if role == "admin":
+        return [(project_id, task_id) for project_id, project in projects.items() for task_id in project['tasks']]
+    assigned = {}
+    for project_id, task_id in index_of(projects, TaskIndex).by_assignee.get(username, ()):
+        assigned.setdefault(project_id, []).append(task_id)
+    keys = []
+    for project_id in index_of(projects, MembershipIndex).accessible_to(username):
+        project = projects[project_id]
+        task_ids = project['tasks'] if project['leader'] == username else assigned.get(project_id, ())
+        keys.extend((project_id, task_id) for task_id in task_ids)
+    return keys
+
+
+def can_search_task(projects, username, role):
+    # The rule view_tasks applies, checked against the indexes instead of each task.
+    if role == "admin":
+        return None
+    memberships = index_of(projects, MembershipIndex)
+    led = memberships.led.get(username, {})
+    joined = memberships.joined.get(username, {})
+    assigned = index_of(projects, TaskIndex).by_assignee.get(username, {})
+    return lambda key: key[0] in led or (key[0] in joined and key in assigned)
+
+
+@timed('search_tasks')
+def search_tasks(projects, username, role, text, limit=SEARCH_RESULTS):
+    # Best matches first, among the tasks the user may open.
+    ranked = index_of(projects, SearchIndex).search(text, limit, can_search_task(projects, username, role))
+    return [(project_id, task_id, projects[project_id]['tasks'][task_id]) for (project_id, task_id), _ in ranked]
+
+
+def view_search(projects, username, role):
     while True:
+        text = input("Search tasks (or press Enter to go back): ").strip()
+        if not text:
+            break
+        catch_up(projects)
+        results = search_tasks(projects, username, role, text)
+        if not results:
+            console.print("[bold yellow]No matching tasks.[/bold yellow]")
+            continue
+        view_query_results(results)
+
+
+@timed('view_task_page')
+def view_task_page(projects, keys, pager):
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Project ID", style="dim")
+    table.add_column("Task ID", style="dim", width=12)
+    table.add_column("Title")
+    table.add_column("Description")
+    table.add_column("Priority")
+    table.add_column("Status")
+    table.add_column("Comments")
+    for project_id, task_id in keys[pager.start:pager.stop]:
+        task = projects[project_id]['tasks'][task_id]
+        table.add_row(project_id, str(task_id), task['title'],task['description'], task['priority'], task['status'], format_comments(task.get('comments')))
+    console.print(table)
+    console.print(pager.footer())
+
+
+def view_tasks(projects, username, role):
+    catch_up(projects)
+    project_ids = list(projects) if role == "admin" else index_of(projects, MembershipIndex).accessible_to(username)
+    user_projects = {pid: projects[pid] for pid in project_ids}
+    keys = accessible_task_keys(projects, username, role)
+    pager = Pager(len(keys))
+
+    while True:
+        console.print("[bold cyan]Tasks you have access to:[/bold cyan]")
+        view_task_page(projects, keys, pager)
         task_project_id = input("Enter the Project ID of the task you want to update (or press Enter to go back): ")
         if not task_project_id:
             break
+        if pager.navigate(task_project_id):
+            continue
 
         if task_project_id not in user_projects:
             console.print("[bold red]Error:[/bold red] Invalid project ID or you don't have access to this project.")
@@ -371,6 +805,8 @@ def view_tasks(projects, username, role):
 
         try:
             if task_id in user_projects[task_project_id]['tasks']:
+                project = user_projects[task_project_id]
+                task = project['tasks'][task_id]
                 if username==project['leader'] or role=='admin':
                    update_task(task,username)
                 else:
@@ -385,6 +821,7 @@ def view_tasks(projects, username, role):
 
 
 def main_menu(projects, username, account, projects_file,user_account):
+    # True when the user logged out, False when they left with their session kept for next time.
     while True:
         if account is not None and account["Role"] != "admin":
             # User Menu
@@ -392,7 +829,11 @@ def main_menu(projects, username, account, projects_file,user_account):
             console.print("1. [bold]Create Project[/bold]")
             console.print("2. [bold]View Projects[/bold]")
             console.print("3. [bold]View Tasks[/bold]")
-            console.print("4. [bold]Log Out[/bold]")
+            console.print("4. [bold]Deadlines[/bold]")
+            console.print("5. [bold]Dashboard[/bold]")
+            console.print("6. [bold]Search Tasks[/bold]")
+            console.print("7. [bold]Log Out[/bold]")
+            console.print("8. [bold]Exit (stay logged in)[/bold]")
             user_choice = input("Enter your choice: ")
 
             if user_choice == '1':
@@ -404,7 +845,15 @@ def main_menu(projects, username, account, projects_file,user_account):
             elif user_choice == '3':
                 view_tasks(projects, username, account["Role"])
             elif user_choice == '4':
-                break
+                view_deadlines(projects, username, account["Role"])
+            elif user_choice == '5':
+                view_dashboard(projects, username, account["Role"])
+            elif user_choice == '6':
+                view_search(projects, username, account["Role"])
+            elif user_choice == '7':
+                return True
+            elif user_choice == '8':
+                return False
             else:
                 console.print("[bold red]Invalid choice.[/bold red] Please enter a valid option.")
         elif account["Role"] == "admin":
@@ -414,7 +863,11 @@ def main_menu(projects, username, account, projects_file,user_account):
             console.print("2. [bold]View Projects[/bold]")
             console.print("3. [bold]View Tasks[/bold]")
             console.print("4. [bold]Manage Users[/bold]")
-            console.print("5. [bold]Log Out[/bold]")
+            console.print("5. [bold]Deadlines[/bold]")
+            console.print("6. [bold]Dashboard[/bold]")
+            console.print("7. [bold]Search Tasks[/bold]")
+            console.print("8. [bold]Log Out[/bold]")
+            console.print("9. [bold]Exit (stay logged in)[/bold]")
             user_choice = input("Enter your choice: ")
 
             if user_choice == '1':
@@ -428,29 +881,327 @@ def main_menu(projects, username, account, projects_file,user_account):
             elif user_choice == '4':
                 user_account.modify_user_status() 
             elif user_choice == '5':
-                break
+                view_deadlines(projects, username, account["Role"])
+            elif user_choice == '6':
+                view_dashboard(projects, username, account["Role"])
+            elif user_choice == '7':
+                view_search(projects, username, account["Role"])
+            elif user_choice == '8':
+                return True
+            elif user_choice == '9':
+                return False
             else:
                 console.print("[bold red]Invalid choice.[/bold red] Please enter a valid option.")
         else:
             console.print("[bold red]Error:[/bold red] Account role not recognized.")
+            return True
+
+
+
+def show_reply(reply):
+    for message in reply.messages:
+        console.print(message)
+    if reply.error and not reply.messages:
+        console.print(f"[bold red]Error:[/bold red] {reply.error}")
+    return reply.status == 200
+
+
+def remote_task_tables(task):
+    console.print(f"[bold cyan]History for Task: {task['title']}[/bold cyan]")
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Field", style="dim", width=12)
+    table.add_column("Old Value")
+    table.add_column("New Value")
+    table.add_column("Updated By")
+    for record in task['history']:
+        table.add_row(record['field'], str(record['old']), str(record['new']), record['updated_by'])
+    console.print(table)
+    console.print(Pager(task['history_count']).footer())
+
+    console.print(f"[bold cyan]Comments for Task: {task['title']}[/bold cyan]")
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Author", style="dim", width=12)
+    table.add_column("Date")
+    table.add_column("Comment")
+    for author, when, text in task['comments']:
+        table.add_row(author or '', when or '', text)
+    console.print(table)
+    console.print(Pager(task['comment_count']).footer())
+
+
+def remote_task(client, project_id, task_id):
+    while True:
+        reply = client.call('task', project=project_id, task=task_id)
+        if not show_reply(reply):
+            return
+        task = reply.result
+        remote_task_tables(task)
+        fields = ('title', 'description', 'start_date', 'end_date', 'assigned_to', 'priority', 'status') if task['manage'] else ('status',)
+        console.print(f"\n[bold]Updating Task: {task['title']}[/bold]")
+        for number, field in enumerate(fields, 1):
+            console.print(f"{number}. [bold]{field.replace('_', ' ').title()}[/bold]")
+        console.print(f"{len(fields) + 1}. [bold]Comments[/bold]")
+        console.print(f"{len(fields) + 2}. [bold]Finish Update[/bold]")
+
+        choice = input("Enter your choice: ")
+        if choice == str(len(fields) + 2) or not choice:
             break
+        if choice == str(len(fields) + 1):
+            text = input("Enter a new comment (leave blank to skip): ")
+            if text:
+                show_reply(client.call('add_comment', project=project_id, task=task_id, text=text))
+            continue
+        if not choice.isdigit() or not 1 <= int(choice) <= len(fields):
+            console.print("[bold red]Error:[/bold red] Invalid choice.")
+            continue
+        field = fields[int(choice) - 1]
+        if field == 'assigned_to':
+            value = task['assigned_to'] + parse_usernames(input(f"Enter new assigned users (comma-separated, leave blank to keep '{', '.join(task['assigned_to'])}'): "))
+        else:
+            value = input(f"Enter new {field.replace('_', ' ')} (leave blank to keep '{task[field]}'): ") or task[field]
+        show_reply(client.call('update_task', project=project_id, task=task_id, field=field, value=value, version=task['version']))
 
 
+def remote_task_table(tasks, with_project=False):
+    table = Table(show_header=True, header_style="bold magenta")
+    if with_project:
+        table.add_column("Project ID", style="dim")
+    else:
+        table.add_column("Index", style="dim", width=6)
+    table.add_column("Task ID", style="dim", width=12)
+    table.add_column("Title")
+    table.add_column("Priority")
+    table.add_column("Status")
+    table.add_column("Comments")
+    for index, task in tasks:
+        table.add_row(task['project'] if with_project else str(index), task['id'], task['title'], task['priority'],
+                      task['status'], format_comments(task['comments']))
+    console.print(table)
 
-if __name__ == "__main__":
-    accounts_file = ".\\APelahishokr\\accounts.csv"
-    projects_file = ".\\APelahishokr\\projects.json"
-    
-    user_account = UserAccount(accounts_file)
-    projects = load_projects(projects_file)
+
+def remote_manage_tasks(client, project_id):
+    pager = Pager(0)
+    while True:
+        reply = client.call('tasks', project=project_id, start=pager.start, stop=pager.start + pager.page_size)
+        if not show_reply(reply):
+            return
+        pager.update(reply.result['total'])
+        tasks = reply.result['tasks']
+        console.print(f"[bold cyan]Tasks in Project: {reply.result['title']}[/bold cyan]")
+        remote_task_table(enumerate(tasks, pager.start))
+        console.print(pager.footer())
+        task_index = input("Enter the Task Index you want to manage (or press Enter to go back): ")
+        if not task_index:
+            break
+        if pager.navigate(task_index):
+            continue
+        if not task_index.isdigit() or not 0 <= int(task_index) - pager.start < len(tasks):
+            console.print("[bold red]Error:[/bold red] Invalid task index.")
+            continue
+        remote_task(client, project_id, tasks[int(task_index) - pager.start]['id'])
+
+
+def remote_add_task(client, project_id):
+    show_reply(client.call(
+        'add_task', project=project_id,
+        title=input("Enter task title: "),
+        description=input("Enter task description: "),
+        start_date=input("Enter start date (YYYY-MM-DD): "),
+        end_date=input("Enter end date (YYYY-MM-DD): "),
+        assigned_to=parse_usernames(input("Enter comma-separated usernames assigned to this task: ")),
+        priority=input("Enter task priority (Critical/High/Medium/Low): "),
+        status=input("Enter task status (Backlog/ToDo/Doing/Done/Archived): "),
+        comment=input("Enter comments for the task: ")))
+
+
+def remote_manage_project(client, project):
     while True:
+        console.print(f"\n[bold]Managing Project: {project['title']}[/bold]")
+        console.print("1. [bold]Add User to Project[/bold]")
+        console.print("2. [bold]Remove User from Project[/bold]")
+        console.print("3. [bold]Add Task[/bold]")
+        console.print("4. [bold]Manage Tasks[/bold]")
+        console.print("5. [bold]Back to Projects[/bold]")
+
+        choice = input("Enter your choice: ")
+
+        if choice == '1':
+            show_reply(client.call('add_user', project=project['id'], username=input("Enter the username to add: ")))
+        elif choice == '2':
+            show_reply(client.call('remove_user', project=project['id'], username=input("Enter the username to remove: ")))
+        elif choice == '3':
+            remote_add_task(client, project['id'])
+        elif choice == '4':
+            remote_manage_tasks(client, project['id'])
+        elif choice == '5':
+            break
+        else:
+            console.print("[bold red]Invalid choice.[/bold red] Please enter a valid option.")
+
+
+def remote_view_projects(client):
+    reply = client.call('projects')
+    if not show_reply(reply):
+        return
+    leader_projects = [project for project in reply.result if project['manage']]
+    console.print("[bold cyan]Projects you are leading:[/bold cyan]")
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Index")
+    table.add_column("Project ID")
+    table.add_column("Title")
+    table.add_column("Leader")
+    for index, project in enumerate(leader_projects):
+        table.add_row(str(index), project['id'], project['title'], project['leader'])
+    console.print(table)
+
+    while True:
+        project_index = input("Enter the index of the Project you want to manage (or press Enter to go back): ")
+        if not project_index:
+            break
+        if not project_index.isdigit() or int(project_index) >= len(leader_projects):
+            console.print("[bold red]Error:[/bold red] Invalid index.")
+            continue
+        remote_manage_project(client, leader_projects[int(project_index)])
+
+
+def remote_view_tasks(client):
+    pager = Pager(0)
+    while True:
+        reply = client.call('my_tasks', start=pager.start, stop=pager.start + pager.page_size)
+        if not show_reply(reply):
+            return
+        pager.update(reply.result['total'])
+        console.print("[bold cyan]Tasks you have access to:[/bold cyan]")
+        remote_task_table(((None, task) for task in reply.result['tasks']), with_project=True)
+        console.print(pager.footer())
+        project_id = input("Enter the Project ID of the task you want to update (or press Enter to go back): ")
+        if not project_id:
+            break
+        if pager.navigate(project_id):
+            continue
+        task_id = input("Enter the Task ID to update (or press Enter to go back): ")
+        if not task_id:
+            break
+        remote_task(client, project_id, task_id)
+
+
+def run_client(client):
+    # Thin client for `manager.py serve`: the server keeps accounts and projects loaded, so nothing is read here.
+    account = None
+    while account is None:
         console.print("[bold cyan]Welcome to the Project Management System[/bold cyan]")
         console.print("1. [bold]Sign Up[/bold]")
         console.print("2. [bold]Log In[/bold]")
         console.print("3. [bold]Exit[/bold]")
+        choice = input("Enter your choice: ")
+        if choice == '1':
+            reply = client.call('sign_up', username=input("Enter username: "), password=input("Enter password: "),
+                                email=input("Enter email: "))
+            if show_reply(reply):
+                console.print("[bold green]Sign up successful![/bold green]")
+        elif choice == '2':
+            reply = client.login(input("Enter username: "), input("Enter password: "))
+            if show_reply(reply):
+                account = reply.result
+        elif choice == '3':
+            return
+
+    while True:
+        console.print("[bold cyan]User Menu[/bold cyan]")
+        console.print("1. [bold]Create Project[/bold]")
+        console.print("2. [bold]View Projects[/bold]")
+        console.print("3. [bold]View Tasks[/bold]")
+        console.print("4. [bold]Log Out[/bold]")
+        user_choice = input("Enter your choice: ")
+
+        if user_choice == '1':
+            show_reply(client.call('create_project', title=input("Enter project title: ")))
+        elif user_choice == '2':
+            remote_view_projects(client)
+        elif user_choice == '3':
+            remote_view_tasks(client)
+        elif user_choice == '4':
+            client.logout()
+            break
+        else:
+            console.print("[bold red]Invalid choice.[/bold red] Please enter a valid option.")
+
+
+def profile_startup():
+    import subprocess
+    from rich.table import Table
+
+    environment = dict(os.environ, PMS_EXIT_AT_WELCOME='1')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', __file__],
+                            env=environment, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+    imports.sort(reverse=True)
+
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Module")
+    table.add_column("Cumulative (ms)", justify="right")
+    table.add_column("Self (ms)", justify="right")
+    for cumulative_us, self_us, name in imports[:25]:
+        table.add_row(name, f"{cumulative_us / 1000:.1f}", f"{self_us / 1000:.1f}")
+    console.print(table)
+    console.print(f"[bold]Time to welcome prompt:[/bold] {elapsed:.1f} ms ({len(imports)} modules imported)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Project Management System")
+    parser.add_argument('--startup-profile', action='store_true', help='Report import times up to the welcome prompt and exit')
+    parser.add_argument('--connect', metavar='ADDRESS', help='Use a running `manager.py serve` at host:port or a Unix socket path')
+    args = parser.parse_args()
+    if args.startup_profile:
+        profile_startup()
+        sys.exit()
+    if args.connect:
+        from client import ServiceClient
+        client = ServiceClient(args.connect)
+        try:
+            run_client(client)
+        except ConnectionError as error:
+            console.print(f"[bold red]Error:[/bold red] Cannot reach the server at {args.connect}: {error}")
+        finally:
+            client.close()
+        sys.exit()
+
+    accounts_file = os.path.join('APelahishokr', 'accounts.csv')
+    projects_file = default_projects_file()
+
+    session_cache = SessionCache(accounts_file, admin_file=ADMIN_FILE)
+    account = None if os.environ.get('PMS_EXIT_AT_WELCOME') else session_cache.resume(read_token())
+    user_account = None
+    if account is not None:
+        setup_logging()
+        logger.info("Resumed session of user: {}", account["Username"])
+        console.print(f"[bold green]Welcome back, {account['Username']}![/bold green]")
+        if account["Role"] == "admin":
+            user_account = UserAccount(accounts_file)
+    while account is None:
+        console.print("[bold cyan]Welcome to the Project Management System[/bold cyan]")
+        console.print("1. [bold]Sign Up[/bold]")
+        console.print("2. [bold]Log In[/bold]")
+        console.print("3. [bold]Exit[/bold]")
+        if os.environ.get('PMS_EXIT_AT_WELCOME'):
+            sys.exit()
+        if user_account is None:
+            prefetch('loguru', 'pandas', 'rich.table')
 
         choice = input("Enter your choice: ")
-        account=""
+        if user_account is None and choice in ('1', '2'):
+            setup_logging()
+            user_account = UserAccount(accounts_file)
         if choice == '1':
             username = input("Enter username: ")
             password = input("Enter password: ")
@@ -460,10 +1211,17 @@ if __name__ == "__main__":
             username = input("Enter username: ")
             password = input("Enter password: ")
             account = user_account.login(username, password)
-        
-        if account is not None and len(account)>0:
-            break
-    
+            if account is not None:
+                write_token(session_cache.issue(account))
+        elif choice == '3':
+            sys.exit()
+
     projects = load_projects(projects_file)
 
-    main_menu(projects, account["Username"], account,projects_file,user_account)
+    try:
+        logged_out = main_menu(projects, account["Username"], account,projects_file,user_account)
+    finally:
+        save_projects(projects_file, projects, force=True)
+    if logged_out:
+        session_cache.end(read_token())
+        clear_token()
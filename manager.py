@@ -1,7 +1,10 @@
 
 import argparse
+import csv
+import json
 import os
 import shutil
+import time
 
 def create_admin(username, password):
     admin_file_path = os.path.join('APelahishokr', 'admin.txt')
@@ -14,8 +17,10 @@ def create_admin(username, password):
         file.write(f'Username: {username}\nPassword: {password}')
     print("Admin created successfully.")
 def purge_data():
+    from store import default_projects_file, JOURNAL_SUFFIX
+    from history import HISTORY_SUFFIX
     accounts_file = os.path.join('APelahishokr', 'accounts.csv')
-    projects_file = os.path.join('APelahishokr', 'projects.json')
+    projects_file = default_projects_file()
     
     if not os.path.exists(accounts_file) and not os.path.exists(projects_file):
         print("Error: Data files do not exist.")
@@ -23,15 +28,123 @@ def purge_data():
 
     confirm = input("Are you sure you want to purge all data? This action cannot be undone. Type 'YES' to confirm: ")
     if confirm == 'YES':
-        if os.path.exists(accounts_file):
-            os.remove(accounts_file)
-        if os.path.exists(projects_file):
+        from account import DELTA_SUFFIX
+        from locks import LOCK_SUFFIX
+        from sessions import SESSIONS_SUFFIX, SESSION_KEY_SUFFIX
+        # The lock files also carry the compaction generation, which must not outlive the data.
+        for suffix in ('', DELTA_SUFFIX, SESSIONS_SUFFIX, SESSION_KEY_SUFFIX, LOCK_SUFFIX,
+                       SESSIONS_SUFFIX + LOCK_SUFFIX):
+            if os.path.exists(accounts_file + suffix):
+                os.remove(accounts_file + suffix)
+        if os.path.isdir(projects_file):
+            shutil.rmtree(projects_file)
+        elif os.path.exists(projects_file):
             os.remove(projects_file)
+        for suffix in (JOURNAL_SUFFIX, HISTORY_SUFFIX, LOCK_SUFFIX):
+            if os.path.exists(projects_file + suffix):
+                os.remove(projects_file + suffix)
         print("All data has been purged.")
     else:
         print("Data purge canceled.")
 
 
+def query_tasks(status, priority, assignee, exclude_status, sort_by):
+    from main import load_projects, query_tasks, view_query_results, parse_enum, TaskStatus, TaskPriority
+
+    try:
+        status = parse_enum(TaskStatus, status) if status else None
+        exclude_status = parse_enum(TaskStatus, exclude_status) if exclude_status else None
+        priority = parse_enum(TaskPriority, priority) if priority else None
+    except ValueError as error:
+        print(f"Error: {error}")
+        return
+    from store import default_projects_file
+    projects = load_projects(default_projects_file())
+    results = query_tasks(projects, status, priority, assignee, exclude_status, sort_by)
+    view_query_results(results)
+    print(f"{len(results)} task(s) found.")
+
+
+def deadline_report(overdue, days, assignee, project_id):
+    from datetime import date, timedelta
+    from main import load_projects, view_query_results
+    from indexes import DeadlineIndex
+    from store import default_projects_file
+    projects = load_projects(default_projects_file())
+    today = date.today()
+    first, last = (None, today.isoformat()) if overdue else (today.isoformat(), (today + timedelta(days=days + 1)).isoformat())
+    entries = projects.index(DeadlineIndex).between(first, last, project_id, assignee)
+    view_query_results([(pid, tid, projects[pid]['tasks'][tid]) for _, pid, tid in entries])
+    print(f"{len(entries)} task(s) {'overdue' if overdue else f'due within {days} days'}.")
+
+
+def read_records(path):
+    with open(path, 'r', newline='') as file:
+        if path.endswith('.jsonl'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def import_data(users_file, projects_file, tasks_file, workers=None):
+    os.makedirs('APelahishokr', exist_ok=True)
+    if users_file:
+        from account import UserAccount
+        start = time.perf_counter()
+        user_account = UserAccount(os.path.join('APelahishokr', 'accounts.csv'))
+        imported, skipped = user_account.import_accounts(read_records(users_file), workers)
+        print(f"Users: {imported} imported, {skipped} skipped in {time.perf_counter() - start:.2f}s.")
+
+    if projects_file or tasks_file:
+        from main import load_projects, import_projects, import_tasks
+        from store import batch_writes, default_projects_file
+        start = time.perf_counter()
+        projects = load_projects(default_projects_file())
+        with batch_writes(projects):
+            if projects_file:
+                imported, skipped = import_projects(projects, read_records(projects_file))
+                print(f"Projects: {imported} imported, {skipped} skipped.")
+            if tasks_file:
+                imported, skipped = import_tasks(projects, read_records(tasks_file))
+                print(f"Tasks: {imported} imported, {skipped} skipped.")
+        print(f"Project store written in {time.perf_counter() - start:.2f}s.")
+
+
+def convert_store(source, target):
+    from history import HISTORY_SUFFIX
+    from locks import file_lock
+    from store import open_store, write_snapshot
+    if os.path.exists(target):
+        print(f"Error: {target} already exists.")
+        return
+    start = time.perf_counter()
+    with file_lock(source, shared=True):
+        projects = open_store(source)
+        write_snapshot(target, projects)
+        # Tasks keep byte offsets into the history file, so it moves along unchanged.
+        if os.path.exists(source + HISTORY_SUFFIX):
+            shutil.copyfile(source + HISTORY_SUFFIX, target + HISTORY_SUFFIX)
+    print(f"Converted {len(projects)} projects from {source} to {target} in {time.perf_counter() - start:.2f}s.")
+
+
+def serve(host, port, socket_path, flush_interval):
+    import asyncio
+    from service import Service
+    from store import default_projects_file
+    service = Service(os.path.join('APelahishokr', 'accounts.csv'), default_projects_file())
+
+    def ready(service):
+        print(f"Serving on {socket_path or f'{host}:{service.address[1]}'}; press Ctrl+C to stop.")
+
+    try:
+        asyncio.run(service.serve(host, port, socket_path, flush_interval, ready))
+    except KeyboardInterrupt:
+        pass
+    print("Server stopped.")
+
+
 parser = argparse.ArgumentParser(description="System management script")
 subparsers = parser.add_subparsers(dest='command')
 
@@ -41,11 +154,56 @@ create_admin_parser.add_argument('--password', type=str, help='Admin password',
 
 purge_data_parser = subparsers.add_parser('purge-data', help='Purge all data')
 
-args = parser.parse_args()
+query_tasks_parser = subparsers.add_parser('query-tasks', help='Find tasks across all projects')
+query_tasks_parser.add_argument('--status', type=str, help='Only tasks with this status')
+query_tasks_parser.add_argument('--not-status', type=str, dest='exclude_status', help='Skip tasks with this status')
+query_tasks_parser.add_argument('--priority', type=str, help='Only tasks with this priority')
+query_tasks_parser.add_argument('--assignee', type=str, help='Only tasks assigned to this user')
+query_tasks_parser.add_argument('--sort', type=str, dest='sort_by', choices=['title', 'start_date', 'end_date', 'priority', 'status'], help='Sort results by this field')
 
-if args.command == 'create-admin':
-    create_admin(args.username, args.password)
-elif args.command == 'purge-data':
-    purge_data()
-else:
-    parser.print_help()
+import_parser = subparsers.add_parser('import', help='Bulk import users, projects and tasks from CSV or JSONL files')
+import_parser.add_argument('--users', type=str, help='Users file (username, password, email, role)')
+import_parser.add_argument('--projects', type=str, help='Projects file (id, title, leader, users)')
+import_parser.add_argument('--tasks', type=str, help='Tasks file (project, id, title, description, start_date, end_date, assigned_to, priority, status, comments)')
+import_parser.add_argument('--workers', type=int, help='Processes used to hash passwords (default: one per core)')
+
+convert_parser = subparsers.add_parser('convert', help='Copy the project store into another layout')
+convert_parser.add_argument('source', type=str, help='Existing store (projects.json, projects.bin, or a directory for the sharded layout)')
+convert_parser.add_argument('target', type=str, help='New store; .bin writes a binary snapshot, a path without an extension one file per project plus a manifest')
+
+for name, help_text in (('overdue', 'List open tasks past their end date'),
+                        ('due-soon', 'List open tasks due within the next days')):
+    deadline_parser = subparsers.add_parser(name, help=help_text)
+    if name == 'due-soon':
+        deadline_parser.add_argument('--days', type=int, default=7, help='How many days ahead (default: 7)')
+    deadline_parser.add_argument('--assignee', type=str, help='Only tasks assigned to this user')
+    deadline_parser.add_argument('--project', type=str, help='Only tasks of this project ID')
+
+serve_parser = subparsers.add_parser('serve', help='Keep accounts and projects loaded and serve them to `main.py --connect` clients')
+serve_parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on (default: 127.0.0.1)')
+serve_parser.add_argument('--port', type=int, default=8765, help='TCP port (default: 8765, 0 picks a free one)')
+serve_parser.add_argument('--socket', type=str, dest='socket_path', help='Listen on this Unix socket instead of TCP')
+serve_parser.add_argument('--flush-interval', type=float, default=1.0, help='Seconds between batched store writes (default: 1)')
+
+# Password hashing workers re-import this module on platforms that spawn processes.
+if __name__ == '__main__':
+    from logs import setup_logging
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.command == 'create-admin':
+        create_admin(args.username, args.password)
+    elif args.command == 'purge-data':
+        purge_data()
+    elif args.command == 'query-tasks':
+        query_tasks(args.status, args.priority, args.assignee, args.exclude_status, args.sort_by)
+    elif args.command == 'import':
+        import_data(args.users, args.projects, args.tasks, args.workers)
+    elif args.command == 'convert':
+        convert_store(args.source, args.target)
+    elif args.command in ('overdue', 'due-soon'):
+        deadline_report(args.command == 'overdue', getattr(args, 'days', 0), args.assignee, args.project)
+    elif args.command == 'serve':
+        serve(args.host, args.port, args.socket_path, args.flush_interval)
+    else:
+        parser.print_help()
@@ -0,0 +1,131 @@
+import atexit
+import json
+import os
+import sys
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Off by default. PMS_METRICS=1 prints a summary at exit; a file name also exports there, in the Prometheus
+# text format for a .prom file and as JSON otherwise.
+METRICS = os.environ.get('PMS_METRICS', '')
+ENABLED = METRICS not in ('', '0')
+METRICS_FILE = None if METRICS.lower() in ('', '0', '1', 'true', 'yes', 'on') else METRICS
+# Upper bounds in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+histograms = {}
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'errors', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = self.errors = 0
+        self.total = self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # Interpolated within the bucket that holds the q-th observation, capped by the slowest one seen.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+def timed(name):
+    # Decides when the module is imported: with metrics off the function is returned untouched, so there is
+    # no cost at all on the call path.
+    def decorate(func):
+        if not ENABLED:
+            return func
+        histogram = histograms.setdefault(name, Histogram())
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                histogram.errors += 1
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    return {name: {'count': histogram.count, 'errors': histogram.errors, 'sum_seconds': histogram.total,
+                   'max_seconds': histogram.max, 'p50_seconds': histogram.quantile(0.5),
+                   'p95_seconds': histogram.quantile(0.95), 'p99_seconds': histogram.quantile(0.99),
+                   'buckets': dict(zip(map(str, BUCKETS + ('+Inf',)), histogram.counts))}
+            for name, histogram in sorted(histograms.items()) if histogram.count}
+
+
+def prometheus_text():
+    lines = ['# HELP pms_operation_duration_seconds Latency of project management operations.',
+             '# TYPE pms_operation_duration_seconds histogram']
+    errors = []
+    for name, histogram in sorted(histograms.items()):
+        if not histogram.count:
+            continue
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f'pms_operation_duration_seconds_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'pms_operation_duration_seconds_sum{{operation="{name}"}} {histogram.total}')
+        lines.append(f'pms_operation_duration_seconds_count{{operation="{name}"}} {histogram.count}')
+        errors.append(f'pms_operation_errors_total{{operation="{name}"}} {histogram.errors}')
+    lines += ['# HELP pms_operation_errors_total Operations that raised.', '# TYPE pms_operation_errors_total counter']
+    return '\n'.join(lines + errors) + '\n'
+
+
+def write_metrics(filename):
+    temp_file = filename + '.tmp'
+    with open(temp_file, 'w') as file:
+        if filename.endswith('.prom'):
+            file.write(prometheus_text())
+        else:
+            json.dump(snapshot(), file, indent=2)
+    os.replace(temp_file, filename)
+
+
+def print_summary(file=None):
+    from rich.console import Console
+    from rich.table import Table
+    table = Table(title="Operation timings", show_header=True, header_style="bold magenta")
+    table.add_column("Operation")
+    for column in ("Count", "Errors", "Mean (ms)", "p50 (ms)", "p95 (ms)", "Max (ms)"):
+        table.add_column(column, justify="right")
+    for name, values in snapshot().items():
+        table.add_row(name, str(values['count']), str(values['errors']),
+                      f"{values['sum_seconds'] / values['count'] * 1000:.2f}", f"{values['p50_seconds'] * 1000:.2f}",
+                      f"{values['p95_seconds'] * 1000:.2f}", f"{values['max_seconds'] * 1000:.2f}")
+    Console(file=file or sys.stderr).print(table)
+
+
+def report():
+    if not any(histogram.count for histogram in histograms.values()):
+        return
+    print_summary()
+    if METRICS_FILE:
+        write_metrics(METRICS_FILE)
+
+
+if ENABLED:
+    atexit.register(report)
@@ -0,0 +1,259 @@
+import sys
+from datetime import date
+from enum import Enum
+
+
+class TaskStatus(Enum):
+    BACKLOG = "Backlog"
+    TODO = "To Do"
+    DOING = "Doing"
+    DONE = "Done"
+    ARCHIVED = "Archived"
+
+
+class TaskPriority(Enum):
+    CRITICAL = "Critical"
+    HIGH = "High"
+    MEDIUM = "Medium"
+    LOW = "Low"
+
+
+CLOSED_STATUSES = frozenset((TaskStatus.DONE.value, TaskStatus.ARCHIVED.value))
+STATUS_VALUES = tuple(status.value for status in TaskStatus)
+PRIORITY_VALUES = tuple(priority.value for priority in TaskPriority)
+STATUS_CODES = {value: code for code, value in enumerate(STATUS_VALUES)}
+PRIORITY_CODES = {value: code for code, value in enumerate(PRIORITY_VALUES)}
+
+
+def encode(codes, value):
+    # Values outside the enum (legacy free-form input) are kept verbatim so conversion stays lossless;
+    # stray integers are boxed so they cannot be mistaken for a code.
+    if type(value) is int:
+        return (value,)
+    return codes.get(value, value)
+
+
+def decode(values, code):
+    if type(code) is int:
+        return values[code]
+    return code[0] if type(code) is tuple else code
+
+
+def parse_date(text):
+    # Dates are kept as ISO strings, which sort in date order; blank means no date.
+    text = text.strip()
+    if not text:
+        return ''
+    try:
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date: {text} (expected YYYY-MM-DD)") from None
+
+
+def is_date(value):
+    # Older versions stored whatever was typed; only canonical dates can be ordered.
+    if type(value) is not str or len(value) != 10:
+        return False
+    try:
+        return parse_date(value) == value
+    except ValueError:
+        return False
+
+
+def intern_value(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def intern_all(usernames):
+    return [intern_value(username) for username in usernames]
+
+
+def parse_comments(text):
+    # Older versions kept the thread as one string of "author: text" lines with no timestamps.
+    comments = []
+    for line in text.split('\n'):
+        if not line:
+            continue
+        author, separator, message = line.partition(': ')
+        comments.append([intern_value(author), None, message] if separator else [None, None, line])
+    return comments
+
+
+class Model:
+    __slots__ = ()
+    FIELDS = ()
+    FIELD_SET = frozenset()
+
+    def __getitem__(self, key):
+        if key in self.FIELD_SET:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        # As with fields, None means absent, so assigning it drops an extra key.
+        if key in self.FIELD_SET:
+            setattr(self, key, value)
+        elif value is None:
+            if self.extra:
+                self.extra.pop(key, None)
+                self.extra = self.extra or None
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __eq__(self, other):
+        if isinstance(other, Model):
+            other = other.to_dict()
+        return isinstance(other, dict) and self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self):
+        data = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+class Task(Model):
+    __slots__ = ('project', 'id', 'title', 'description', 'start_date', 'end_date',
+                 '_assigned_to', '_priority', '_status', '_comments', 'history_log', 'extra')
+    FIELDS = ('title', 'description', 'start_date', 'end_date', 'assigned_to', 'priority', 'status', 'comments',
+              'history_log')
+    FIELD_SET = frozenset(FIELDS)
+
+    def __init__(self, project=None, task_id=None):
+        self.project = project
+        self.id = task_id
+        self.title = self.description = self.start_date = self.end_date = self.history_log = None
+        self._assigned_to = self._priority = self._status = self._comments = self.extra = None
+
+    @property
+    def assigned_to(self):
+        return None if self._assigned_to is None else list(self._assigned_to)
+
+    @assigned_to.setter
+    def assigned_to(self, usernames):
+        self._assigned_to = None if usernames is None else tuple(intern_all(usernames))
+
+    @property
+    def priority(self):
+        return decode(PRIORITY_VALUES, self._priority)
+
+    @priority.setter
+    def priority(self, value):
+        self._priority = encode(PRIORITY_CODES, value)
+
+    @property
+    def status(self):
+        return decode(STATUS_VALUES, self._status)
+
+    @status.setter
+    def status(self, value):
+        self._status = encode(STATUS_CODES, value)
+
+    @property
+    def comments(self):
+        return self._comments
+
+    @comments.setter
+    def comments(self, comments):
+        self._comments = parse_comments(comments) if type(comments) is str else comments
+
+    @classmethod
+    def from_dict(cls, data, project=None, task_id=None):
+        task = cls(project, task_id)
+        get = data.get
+        task.title = get('title')
+        task.description = get('description')
+        task.start_date = intern_value(get('start_date'))
+        task.end_date = intern_value(get('end_date'))
+        task.assigned_to = get('assigned_to')
+        task.priority = get('priority')
+        task.status = get('status')
+        task.comments = get('comments')
+        task.history_log = get('history_log')
+        task.extra = {key: value for key, value in data.items() if key not in cls.FIELD_SET} or None
+        return task
+
+
+class Project(Model):
+    __slots__ = ('store', 'id', 'title', 'leader', 'users', '_tasks', 'extra')
+    FIELDS = ('title', 'leader', 'users', 'tasks')
+    FIELD_SET = frozenset(FIELDS)
+
+    def __init__(self, store=None, project_id=None):
+        self.store = store
+        self.id = project_id
+        self.title = self.leader = self.users = self._tasks = self.extra = None
+
+    @property
+    def tasks(self):
+        # Projects from a sharded or binary store only carry manifest fields until their tasks are needed.
+        if self._tasks is None:
+            loader = getattr(self.store, 'loader', None)
+            if loader is not None:
+                loader.load(self)
+            else:
+                self._tasks = {}
+        return self._tasks
+
+    @tasks.setter
+    def tasks(self, tasks):
+        self._tasks = tasks
+
+    @classmethod
+    def from_dict(cls, data, store=None, project_id=None):
+        project = cls(store, project_id)
+        project.title = data.get('title')
+        project.leader = intern_value(data.get('leader'))
+        users = data.get('users')
+        project.users = None if users is None else intern_all(users)
+        if 'tasks' in data:
+            project.tasks = {task_id: Task.from_dict(task, project, task_id) for task_id, task in data['tasks'].items()}
+        project.extra = {key: value for key, value in data.items() if key not in cls.FIELD_SET} or None
+        return project
+
+
+def to_json(obj):
+    if isinstance(obj, Model):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,46 @@
+import os
+
+PAGE_SIZE = int(os.environ.get('PMS_PAGE_SIZE', 20))
+NAVIGATION_HELP = "n: next, p: previous, g <page>: jump, s <size>: page size"
+
+
+class Pager:
+    def __init__(self, total, page_size=PAGE_SIZE):
+        self.page_size = page_size
+        self.page = 0
+        self.update(total)
+
+    def update(self, total):
+        self.total = total
+        self.page = min(self.page, self.pages - 1)
+
+    @property
+    def pages(self):
+        return max((self.total + self.page_size - 1) // self.page_size, 1)
+
+    @property
+    def start(self):
+        return self.page * self.page_size
+
+    @property
+    def stop(self):
+        return min(self.start + self.page_size, self.total)
+
+    def navigate(self, command):
+        parts = command.strip().lower().split()
+        if parts == ['n']:
+            self.page = min(self.page + 1, self.pages - 1)
+        elif parts == ['p']:
+            self.page = max(self.page - 1, 0)
+        elif len(parts) == 2 and parts[0] == 'g' and parts[1].isdigit():
+            self.page = min(max(int(parts[1]) - 1, 0), self.pages - 1)
+        elif len(parts) == 2 and parts[0] == 's' and parts[1].isdigit() and int(parts[1]) > 0:
+            first_row = self.start
+            self.page_size = int(parts[1])
+            self.page = first_row // self.page_size
+        else:
+            return False
+        return True
+
+    def footer(self):
+        return f"[dim]Page {self.page + 1}/{self.pages} ({self.total} rows) - {NAVIGATION_HELP}[/dim]"
@@ -0,0 +1,415 @@
+import asyncio
+import json
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from datetime import datetime
+from http.client import responses
+from inspect import signature
+from itertools import islice
+import account
+import main
+import metrics
+from account import UserAccount
+from history import history_count
+from indexes import CounterIndex, MembershipIndex
+from lazy import LazyImport
+from models import TaskPriority, TaskStatus, parse_date
+from pager import PAGE_SIZE
+from store import catch_up, index_of, version_of
+
+logger = LazyImport('loguru', 'logger')
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+FLUSH_INTERVAL = 1.0
+MAX_BODY_BYTES = 1024 * 1024
+PUBLIC_OPERATIONS = ('sign_up', 'login')
+OPERATIONS = PUBLIC_OPERATIONS + ('logout', 'projects', 'create_project', 'add_user', 'remove_user', 'remove_project',
+                                  'tasks', 'my_tasks', 'task', 'add_task', 'update_task', 'add_comment', 'remove_task',
+                                  'search', 'dashboard', 'metrics')
+# Fields a project leader may edit; other users may only move the tasks assigned to them along.
+TASK_FIELDS = ('title', 'description', 'start_date', 'end_date', 'assigned_to', 'priority', 'status')
+MEMBER_FIELDS = ('status',)
+
+Session = namedtuple('Session', 'token username role')
+replies = ContextVar('replies', default=None)
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ReplyConsole:
+    # Stands in for a module's console in the server, so what the core functions print goes back to the
+    # client whose request caused it instead of the server's terminal.
+    def __init__(self, console):
+        self.console = console
+
+    def print(self, *objects, **kwargs):
+        messages = replies.get()
+        if messages is None:
+            self.console.print(*objects, **kwargs)
+        else:
+            messages.append(' '.join(map(str, objects)))
+
+    def __getattr__(self, name):
+        return getattr(self.console, name)
+
+
+def install_reply_consoles():
+    for module in (main, account):
+        if not isinstance(module.console, ReplyConsole):
+            module.console = ReplyConsole(module.console)
+
+
+def parse_names(value):
+    if isinstance(value, str):
+        return main.parse_usernames(value)
+    if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        raise ServiceError(400, "Expected a list of usernames.")
+    return value
+
+
+def parse_field(field, value):
+    if field == 'assigned_to':
+        return parse_names(value)
+    if not isinstance(value, str):
+        raise ServiceError(400, f"Expected text for {field}.")
+    try:
+        if field == 'priority':
+            return main.parse_enum(TaskPriority, value)
+        if field == 'status':
+            return main.parse_enum(TaskStatus, value)
+        if field in ('start_date', 'end_date'):
+            return parse_date(value)
+    except ValueError as error:
+        raise ServiceError(400, str(error)) from None
+    return value
+
+
+def task_summary(task_id, task):
+    comments = task.get('comments') or []
+    return {'id': task_id, 'title': task['title'], 'description': task.get('description'),
+            'priority': task['priority'], 'status': task['status'], 'assigned_to': task.get('assigned_to') or [],
+            'end_date': task.get('end_date'), 'comments': comments[-main.COMMENTS_SHOWN:],
+            'comment_count': len(comments)}
+
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+class Service:
+    # One process holds the accounts and the project store in memory for every client. Project changes are
+    # journaled as they happen; snapshot and shard writes are batched on a timer instead of after every request.
+    def __init__(self, accounts_file, projects_file):
+        install_reply_consoles()
+        self.accounts = UserAccount(accounts_file)
+        self.projects_file = projects_file
+        self.store = main.load_projects(projects_file)
+        # Hashing a password takes long enough to stall every other client, so account calls run on a worker
+        # thread; a single one keeps them in order.
+        self.accounts_pool = ThreadPoolExecutor(max_workers=1)
+        self.operations = {name: getattr(self, name) for name in OPERATIONS}
+        self.signatures = {name: signature(operation) for name, operation in self.operations.items()}
+        self.server = None
+        # Open connections, so shutdown can close them and let their handlers finish.
+        self.clients = {}
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None, flush_interval=FLUSH_INTERVAL, ready=None):
+        if path:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        self.loop = asyncio.get_running_loop()
+        self.address = self.server.sockets[0].getsockname()
+        logger.info("Serving projects from {} on {}", self.projects_file, self.address)
+        flusher = asyncio.ensure_future(self.flush_periodically(flush_interval))
+        if ready is not None:
+            ready(self)
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            flusher.cancel()
+            self.server.close()
+            for writer in self.clients:
+                writer.close()
+            await asyncio.gather(*self.clients.values(), return_exceptions=True)
+            self.flush()
+            self.accounts_pool.shutdown()
+            logger.info("Service stopped")
+
+    def stop(self):
+        # Safe to call from any thread.
+        self.loop.call_soon_threadsafe(self.server.close)
+
+    async def flush_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+    def flush(self):
+        # The store knows which projects changed, so a quiet interval writes nothing.
+        main.save_projects(self.projects_file, self.store, force=True)
+
+    async def handle(self, reader, writer):
+        self.clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.dispatch(method, path, headers, body)
+                data = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status} {responses[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as error:
+            logger.debug("Dropping connection: {}", error)
+        finally:
+            del self.clients[writer]
+            writer.close()
+
+    async def dispatch(self, method, path, headers, body):
+        messages = []
+        token = replies.set(messages)
+        try:
+            result = await self.call(method, path.strip('/'), headers, body)
+            return 200, {'result': result, 'messages': messages}
+        except ServiceError as error:
+            return error.status, {'error': error.message, 'messages': messages}
+        except Exception:
+            logger.exception("Request to {} failed", path)
+            return 500, {'error': "Internal server error.", 'messages': messages}
+        finally:
+            replies.reset(token)
+
+    async def call(self, method, name, headers, body):
+        if method != 'POST':
+            raise ServiceError(405, "Operations are called with POST.")
+        operation = self.operations.get(name)
+        if operation is None:
+            raise ServiceError(404, f"Unknown operation: {name}")
+        session = self.session_for(headers.get('authorization', '').partition('Bearer ')[2].strip())
+        if session is None and name not in PUBLIC_OPERATIONS:
+            raise ServiceError(401, "Log in first.")
+        try:
+            arguments = json.loads(body or b'{}')
+            bound = self.signatures[name].bind(session, **arguments)
+        except (ValueError, TypeError) as error:
+            raise ServiceError(400, f"Invalid arguments for {name}: {error}") from None
+        result = operation(*bound.args, **bound.kwargs)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    def session_for(self, token):
+        # Tokens are the signed, expiring ones the CLI caches, so they end when the account is deactivated.
+        account = self.accounts.sessions.resume(token) if token else None
+        return None if account is None else Session(token, account['Username'], account['Role'])
+
+    def run_account(self, function, *args):
+        # The worker runs in a copy of this request's context, so its messages reach the same reply.
+        return self.loop.run_in_executor(self.accounts_pool, copy_context().run, function, *args)
+
+    def project_for(self, session, project_id, manage=False):
+        catch_up(self.store)
+        project = self.store.get(project_id) if isinstance(project_id, str) else None
+        if project is None or not main.can_access_project(project, session.username, session.role):
+            raise ServiceError(404, "Project ID not found.")
+        if manage and not self.leads(session, project):
+            raise ServiceError(403, "Only the project leader can do that.")
+        return project
+
+    def task_for(self, session, project_id, task_id, manage=False):
+        project = self.project_for(session, project_id, manage)
+        task = project['tasks'].get(task_id) if isinstance(task_id, str) else None
+        if task is None or not main.can_access_task(task, project['leader'], session.username, session.role):
+            raise ServiceError(404, "Task ID not found.")
+        return task
+
+    def leads(self, session, project):
+        return session.username == project['leader'] or session.role == 'admin'
+
+    async def sign_up(self, session, username, password, email):
+        if not (username and password and email):
+            raise ServiceError(400, "Username, password and email are required.")
+        if not await self.run_account(self.accounts.sign_up, username, password, email):
+            raise ServiceError(409)
+        return True
+
+    async def login(self, session, username, password):
+        account = await self.run_account(self.accounts.login, username, password)
+        if account is None:
+            raise ServiceError(401)
+        return {'session': self.accounts.sessions.issue(account), 'username': account['Username'],
+                'role': account['Role']}
+
+    def logout(self, session):
+        self.accounts.sessions.end(session.token)
+        return True
+
+    def projects(self, session):
+        catch_up(self.store)
+        if session.role == 'admin':
+            project_ids = list(self.store)
+        else:
+            project_ids = index_of(self.store, MembershipIndex).accessible_to(session.username)
+        summaries = []
+        for project_id in project_ids:
+            project = self.store[project_id]
+            summaries.append({'id': project_id, 'title': project['title'], 'leader': project['leader'],
+                              'users': project['users'], 'manage': self.leads(session, project)})
+        return summaries
+
+    def create_project(self, session, title):
+        if not isinstance(title, str) or not title.strip():
+            raise ServiceError(400, "A project needs a title.")
+        project_id = str(uuid.uuid4())
+        main.create_project(self.store, title, session.username, project_id)
+        return project_id
+
+    def add_user(self, session, project, username):
+        self.project_for(session, project, manage=True)
+        if not isinstance(username, str) or not username:
+            raise ServiceError(400, "A username is required.")
+        return main.add_user_to_project(self.store, project, username)
+
+    def remove_user(self, session, project, username):
+        self.project_for(session, project, manage=True)
+        return main.remove_user_from_project(self.store, project, username)
+
+    def remove_project(self, session, project):
+        self.project_for(session, project, manage=True)
+        main.remove_project(self.store, project)
+        return True
+
+    def tasks(self, session, project, start=0, stop=None):
+        project = self.project_for(session, project, manage=True)
+        tasks = project['tasks']
+        stop = start + PAGE_SIZE if stop is None else stop
+        return {'title': project['title'], 'leader': project['leader'], 'version': version_of(project),
+                'total': len(tasks), 'tasks': [task_summary(task_id, task)
+                                               for task_id, task in islice(tasks.items(), start, stop)]}
+
+    def my_tasks(self, session, start=0, stop=None):
+        catch_up(self.store)
+        keys = main.accessible_task_keys(self.store, session.username, session.role)
+        stop = start + PAGE_SIZE if stop is None else stop
+        return {'total': len(keys),
+                'tasks': [dict(task_summary(task_id, self.store[project_id]['tasks'][task_id]), project=project_id)
+                          for project_id, task_id in keys[start:stop]]}
+
+    def task(self, session, project, task, history_start=0, history_stop=None, comments_start=0, comments_stop=None):
+        project_id, task_id = project, task
+        task = self.task_for(session, project_id, task_id)
+        comments = task.get('comments') or []
+        history_stop = history_start + PAGE_SIZE if history_stop is None else history_stop
+        comments_stop = comments_start + PAGE_SIZE if comments_stop is None else comments_stop
+        details = task_summary(task_id, task)
+        details.update(project=project_id, start_date=task.get('start_date'), version=version_of(task),
+                       manage=self.leads(session, task.project),
+                       history=list(main.task_history(task, history_start, history_stop)),
+                       history_count=history_count(task), comments=comments[::-1][comments_start:comments_stop])
+        return details
+
+    def add_task(self, session, project, title, description='', start_date='', end_date='', assigned_to=(),
+                 priority='Medium', status='To Do', comment=''):
+        project = self.project_for(session, project, manage=True)
+        if not isinstance(title, str) or not title.strip():
+            raise ServiceError(400, "A task needs a title.")
+        task = {'title': title, 'description': parse_field('description', description),
+                'start_date': parse_field('start_date', start_date), 'end_date': parse_field('end_date', end_date),
+                'assigned_to': parse_names(list(assigned_to) if isinstance(assigned_to, tuple) else assigned_to),
+                'priority': parse_field('priority', priority), 'status': parse_field('status', status),
+                'comments': [[session.username, str(datetime.now()), comment]] if comment else []}
+        try:
+            main.validate_dates(task['start_date'], task['end_date'])
+        except ValueError as error:
+            raise ServiceError(400, str(error)) from None
+        task_id = main.create_task(project, task)
+        if task_id is None:
+            raise ServiceError(409)
+        return task_id
+
+    def update_task(self, session, project, task, field, value, version=None):
+        task = self.task_for(session, project, task)
+        if field not in (TASK_FIELDS if self.leads(session, task.project) else MEMBER_FIELDS):
+            raise ServiceError(403, f"You cannot change {field} of this task.")
+        if version is not None and not isinstance(version, int):
+            raise ServiceError(400, "version must be a number.")
+        value = parse_field(field, value)
+        try:
+            if field == 'start_date':
+                main.validate_dates(value, task.get('end_date'))
+            elif field == 'end_date':
+                main.validate_dates(task.get('start_date'), value)
+        except ValueError as error:
+            raise ServiceError(400, str(error)) from None
+        if not main.set_task_field(task, field, value, session.username, version):
+            raise ServiceError(409)
+        # Sessions share this process's store, so their edits have to count as concurrent changes too.
+        self.store.changes[(task.project.id, task.id, field)] = version_of(task)
+        return version_of(task)
+
+    def add_comment(self, session, project, task, text):
+        task = self.task_for(session, project, task)
+        if not isinstance(text, str) or not text:
+            raise ServiceError(400, "A comment needs text.")
+        main.add_comment(task, session.username, text)
+        return True
+
+    def remove_task(self, session, project, task):
+        project = self.project_for(session, project, manage=True)
+        main.remove_task_from_project(project, task)
+        return True
+
+    def search(self, session, query, limit=PAGE_SIZE):
+        if not isinstance(query, str) or not isinstance(limit, int) or limit < 1:
+            raise ServiceError(400, "A search needs query text and a positive limit.")
+        catch_up(self.store)
+        return [dict(task_summary(task_id, task), project=project_id)
+                for project_id, task_id, task in main.search_tasks(self.store, session.username, session.role, query,
+                                                                   limit)]
+
+    def dashboard(self, session):
+        catch_up(self.store)
+        if session.role == 'admin':
+            project_ids = list(self.store)
+        else:
+            project_ids = index_of(self.store, MembershipIndex).led_by(session.username)
+        counters = index_of(self.store, CounterIndex)
+        summary = counters.summary(project_ids)
+        return {'projects': {project_id: counters.counts_for(project_id) for project_id in project_ids},
+                'total': summary}
+
+    def metrics(self, session):
+        # A long-running server rarely reaches the summary printed at exit, so admins can read the timings live.
+        if session.role != 'admin':
+            raise ServiceError(403, "Only an admin can read metrics.")
+        return metrics.snapshot()
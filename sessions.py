@@ -0,0 +1,150 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from locks import file_lock
+
+SESSIONS_SUFFIX = '.sessions'
+SESSION_KEY_SUFFIX = '.session-key'
+SESSION_TTL = int(os.environ.get('PMS_SESSION_TTL', 8 * 3600))
+TOKEN_FILE = os.environ.get('PMS_SESSION_FILE', os.path.join(os.path.expanduser('~'), '.pms_session'))
+SESSION_COLUMNS = ('Username', 'Email', 'Role')
+
+
+def write_private(filename, data):
+    # Readable by the owner only; the file is replaced whole so readers never see half of it.
+    temp_file = filename + '.tmp'
+    descriptor = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(data)
+    os.replace(temp_file, filename)
+
+
+def file_signature(filename):
+    try:
+        stat = os.stat(filename)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_token(token_file=TOKEN_FILE):
+    try:
+        with open(token_file) as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_token(token, token_file=TOKEN_FILE):
+    write_private(token_file, token.encode())
+
+
+def clear_token(token_file=TOKEN_FILE):
+    if os.path.exists(token_file):
+        os.remove(token_file)
+
+
+class SessionCache:
+    # Signed, expiring tokens mapped to the account row they were issued for, kept next to the accounts file.
+    # Resuming one needs neither the password hash nor the accounts file; an admin session only needs a stat of
+    # the admin file, and ends once that file is rewritten.
+    def __init__(self, accounts_file, ttl=SESSION_TTL, admin_file=None):
+        self.filename = accounts_file + SESSIONS_SUFFIX
+        self.key_file = accounts_file + SESSION_KEY_SUFFIX
+        self.admin_file = admin_file
+        self.ttl = ttl
+        self.entries = {}
+        self.signature = None
+        self.key = None
+
+    def signing_key(self):
+        if self.key is None:
+            with file_lock(self.filename):
+                try:
+                    with open(self.key_file, 'rb') as file:
+                        self.key = file.read()
+                except FileNotFoundError:
+                    self.key = secrets.token_bytes(32)
+                    write_private(self.key_file, self.key)
+        return self.key
+
+    def sign(self, session_id, expires, username):
+        message = f"{session_id}\n{expires}\n{username}".encode()
+        return hmac.new(self.signing_key(), message, hashlib.sha256).hexdigest()
+
+    def load(self):
+        # Called with the sessions lock held; re-read only after another process replaced the file.
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            self.entries, self.signature = {}, None
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self.signature:
+            return
+        try:
+            with open(self.filename, 'r') as file:
+                self.entries = json.load(file)
+        except ValueError:
+            self.entries = {}
+        self.signature = signature
+
+    def save(self):
+        write_private(self.filename, json.dumps(self.entries).encode())
+        stat = os.stat(self.filename)
+        self.signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def issue(self, account):
+        now = time.time()
+        session_id = secrets.token_urlsafe(16)
+        expires = int(now + self.ttl)
+        entry = {column: str(account[column]) for column in SESSION_COLUMNS}
+        entry['expires'] = expires
+        if entry['Role'] == 'admin':
+            entry['admin'] = file_signature(self.admin_file)
+        with file_lock(self.filename):
+            self.load()
+            self.entries = {key: value for key, value in self.entries.items() if value['expires'] > now}
+            self.entries[session_id] = entry
+            self.save()
+        return f"{session_id}.{expires}.{self.sign(session_id, expires, entry['Username'])}"
+
+    def resume(self, token):
+        # The account row the token was issued for, or None once it expired, was ended or was revoked.
+        try:
+            session_id, expires, signature = token.split('.')
+            expires = int(expires)
+        except (AttributeError, ValueError):
+            return None
+        if expires <= time.time():
+            return None
+        with file_lock(self.filename, shared=True):
+            self.load()
+        entry = self.entries.get(session_id)
+        if entry is None or entry['expires'] != expires:
+            return None
+        if entry['Role'] == 'admin':
+            admin_file = file_signature(self.admin_file)
+            if admin_file is None or entry.get('admin') != admin_file:
+                return None
+        if not hmac.compare_digest(signature, self.sign(session_id, expires, entry['Username'])):
+            return None
+        return {column: entry[column] for column in SESSION_COLUMNS}
+
+    def end(self, token):
+        session_id = (token or '').split('.')[0]
+        with file_lock(self.filename):
+            self.load()
+            if self.entries.pop(session_id, None) is not None:
+                self.save()
+
+    def revoke(self, username):
+        with file_lock(self.filename):
+            self.load()
+            remaining = {key: value for key, value in self.entries.items() if value['Username'] != username}
+            if len(remaining) != len(self.entries):
+                self.entries = remaining
+                self.save()
@@ -0,0 +1,295 @@
+import gc
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+from itertools import islice
+from indexes import counts_record
+from models import Model, Project, Task, PRIORITY_CODES, STATUS_CODES, encode, to_json
+
+MAGIC = b'PMSB'
+VERSION = 3
+NONE = 0xFFFFFFFF
+RAW = 1
+COMMENTS_JSON = 2
+# magic, version, string count, project count
+HEADER = struct.Struct('<4sHQQ')
+# raw flag, id, title, leader, extra, task counts, user count, task count
+PROJECT = struct.Struct('<BIIIIIII')
+# Projects before version 3 carry no task counts.
+PROJECT_V2 = struct.Struct('<BIIIIII')
+# flags, id, title, description, start_date, end_date, priority, status, comments, extra, assignee count,
+# history count, history head
+TASK = struct.Struct('<BIIIIIIIIIIIQ')
+# Version 1 tasks predate the history store and end at the assignee count.
+TASK_V1 = struct.Struct('<BIIIIIIIIII')
+NO_HISTORY = (NONE, 0)
+
+
+DECODER = json.JSONDecoder()
+ENCODER = json.JSONEncoder(separators=(',', ':'), default=to_json)
+
+
+TEXT_TYPES = frozenset((str, type(None)))
+
+
+class StringTable(dict):
+    # Seeded with None so lookups of repeated strings stay in C; only new strings reach __missing__.
+    def __init__(self):
+        super().__init__({None: NONE})
+
+    def __missing__(self, value):
+        ref = self[value] = len(self) - 1
+        return ref
+
+    def blobs(self):
+        return [value.encode('utf-8') for value in islice(self, 1, None)]
+
+
+def is_text(*values):
+    return TEXT_TYPES.issuperset(map(type, values))
+
+
+def is_log(log):
+    return log is None or (type(log) is list and len(log) == 2 and type(log[0]) is int and type(log[1]) is int
+                           and 0 <= log[0] < NONE and log[1] >= 0)
+
+
+def is_names(values):
+    return values is None or (type(values) in (list, tuple) and TEXT_TYPES.issuperset(map(type, values)))
+
+
+def extra_of(obj, model):
+    if isinstance(obj, Model):
+        return obj.extra
+    return {key: value for key, value in obj.items() if key not in model.FIELD_SET} or None
+
+
+@contextmanager
+def paused_gc():
+    # Bulk decoding only creates objects that stay alive, so collector passes over them are wasted work.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def dump_json(value):
+    return ENCODER.encode(value)
+
+
+def load_json(text):
+    return DECODER.raw_decode(text)[0]
+
+
+def encode_task(strings, task_id, task, out):
+    ref = strings.__getitem__
+    if isinstance(task, Task):
+        assigned_to = task._assigned_to
+        history_log = task.history_log
+        comments = task.comments
+        fields = (task.title, task.description, task.start_date, task.end_date, task.priority, task.status)
+    else:
+        get = task.get
+        assigned_to = get('assigned_to')
+        history_log = get('history_log')
+        comments = get('comments')
+        fields = (get('title'), get('description'), get('start_date'), get('end_date'), get('priority'), get('status'))
+    flags = 0
+    if type(comments) is list:
+        flags = COMMENTS_JSON
+        comments = dump_json(comments)
+    if not (is_text(comments, *fields) and is_names(assigned_to) and is_log(history_log)):
+        # Anything the fixed layout cannot hold is kept verbatim as JSON.
+        out += TASK.pack(RAW, ref(task_id), NONE, NONE, NONE, NONE, NONE, NONE, NONE, ref(dump_json(task)), NONE, NONE, 0)
+        return
+    extra = extra_of(task, Task)
+    out += TASK.pack(flags, ref(task_id), *map(ref, fields), ref(comments),
+                     NONE if extra is None else ref(dump_json(extra)),
+                     NONE if assigned_to is None else len(assigned_to),
+                     *(history_log or (NONE, 0)))
+    if assigned_to:
+        out += struct.pack(f'<{len(assigned_to)}I', *map(ref, assigned_to))
+
+
+def encode_project(strings, project_id, project, out):
+    ref = strings.__getitem__
+    users = project.get('users')
+    tasks = project.get('tasks') or {}
+    if not (is_text(project.get('title'), project.get('leader')) and is_names(users)):
+        out += PROJECT.pack(1, ref(project_id), NONE, NONE, ref(dump_json(project)), NONE, NONE, 0)
+        return
+    extra = extra_of(project, Project)
+    counts = counts_record(tasks)
+    out += PROJECT.pack(0, ref(project_id), ref(project.get('title')), ref(project.get('leader')),
+                        NONE if extra is None else ref(dump_json(extra)),
+                        NONE if counts is None else ref(dump_json(counts)),
+                        NONE if users is None else len(users), len(tasks))
+    if users:
+        out += struct.pack(f'<{len(users)}I', *map(ref, users))
+    for task_id, task in tasks.items():
+        encode_task(strings, task_id, task, out)
+
+
+def write_binary(filename, projects):
+    strings = StringTable()
+    records = bytearray()
+    offsets = array('Q')
+    for project_id, project in projects.items():
+        offsets.append(len(records))
+        encode_project(strings, project_id, project, records)
+    # Every task is decoded by now, so a mapping of the file being replaced can be released.
+    loader = getattr(projects, 'loader', None)
+    if isinstance(loader, BinarySnapshot) and os.path.abspath(loader.filename) == os.path.abspath(filename):
+        loader.close()
+        projects.loader = None
+    blobs = strings.blobs()
+    string_offsets = array('Q', [0])
+    for blob in blobs:
+        string_offsets.append(string_offsets[-1] + len(blob))
+    position = HEADER.size + string_offsets.itemsize * len(string_offsets) + string_offsets[-1] + offsets.itemsize * len(offsets)
+    record_offsets = array('Q', [position + offset for offset in offsets])
+    if sys.byteorder == 'big':
+        string_offsets.byteswap()
+        record_offsets.byteswap()
+    temp_file = filename + '.tmp'
+    with open(temp_file, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(blobs), len(offsets)))
+        file.write(string_offsets.tobytes())
+        file.write(b''.join(blobs))
+        file.write(record_offsets.tobytes())
+        file.write(records)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, filename)
+
+
+def read_array(buffer, position, count):
+    values = array('Q')
+    values.frombytes(buffer[position:position + values.itemsize * count])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, position + values.itemsize * count
+
+
+class BinarySnapshot:
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, string_count, project_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version not in (1, 2, VERSION):
+            self.close()
+            raise ValueError(f"{filename} is not a version {VERSION} project snapshot")
+        self.project_struct = PROJECT if version == VERSION else PROJECT_V2
+        self.task_struct = TASK_V1 if version == 1 else TASK
+        self.offsets, self.blob = read_array(self.map, HEADER.size, string_count + 1)
+        self.records, _ = read_array(self.map, self.blob + self.offsets[-1], project_count)
+        self.strings = [None] * string_count
+        self.pending = {}
+        # project id -> string ref of the task counts saved with it
+        self.counts = {}
+
+    def string(self, ref):
+        if ref == NONE:
+            return None
+        value = self.strings[ref]
+        if value is None:
+            # Decoded once per distinct string, so repeated usernames and enum values share one object.
+            value = self.strings[ref] = str(self.map[self.blob + self.offsets[ref]:self.blob + self.offsets[ref + 1]], 'utf-8')
+        return value
+
+    def refs(self, position, count):
+        return [self.string(ref) for ref in struct.unpack_from(f'<{count}I', self.map, position)], position + 4 * count
+
+    def projects(self, store=None):
+        string = self.string
+        unpack = self.project_struct.unpack_from
+        size = self.project_struct.size
+        legacy = self.project_struct is PROJECT_V2
+        for position in self.records:
+            fields = unpack(self.map, position)
+            if legacy:
+                fields = fields[:5] + (NONE,) + fields[5:]
+            raw, project_id, title, leader, extra, counts, user_count, task_count = fields
+            project_id = string(project_id)
+            if raw:
+                yield project_id, Project.from_dict(load_json(string(extra)), store, project_id)
+                continue
+            project = Project(store, project_id)
+            project.title = string(title)
+            project.leader = string(leader)
+            if counts != NONE:
+                self.counts[project_id] = counts
+            position += size
+            if user_count != NONE:
+                project.users, position = self.refs(position, user_count)
+            if extra != NONE:
+                project.extra = load_json(string(extra))
+            # Tasks stay in the mapping until the project is opened.
+            self.pending[project_id] = (position, task_count)
+            yield project_id, project
+
+    def saved_counts(self, project_id):
+        # Only asked for projects still pending, so the mapping is open.
+        counts = self.counts.get(project_id)
+        return None if counts is None else load_json(self.string(counts))
+
+    def load(self, project):
+        position, task_count = self.pending.pop(project.id, (0, 0))
+        tasks = {}
+        with paused_gc():
+            self.decode_tasks(project, tasks, position, task_count)
+        project.tasks = tasks
+        if not self.pending:
+            self.close()
+
+    def decode_tasks(self, project, tasks, position, task_count):
+        string = self.string
+        unpack = self.task_struct.unpack_from
+        size = self.task_struct.size
+        legacy = self.task_struct is TASK_V1
+        new_task = Task.__new__
+        for _ in range(task_count):
+            fields = unpack(self.map, position)
+            if legacy:
+                fields += NO_HISTORY
+            (flags, task_id, title, description, start_date, end_date, priority, status,
+             comments, extra, assignee_count, history_count, history_head) = fields
+            position += size
+            task_id = string(task_id)
+            if flags & RAW:
+                tasks[task_id] = Task.from_dict(load_json(string(extra)), project, task_id)
+                continue
+            # Every slot is assigned below, so Task.__init__ is skipped.
+            task = new_task(Task)
+            task.project = project
+            task.id = task_id
+            task.title = string(title)
+            task.description = string(description)
+            task.start_date = string(start_date)
+            task.end_date = string(end_date)
+            task._priority = encode(PRIORITY_CODES, string(priority))
+            task._status = encode(STATUS_CODES, string(status))
+            if flags & COMMENTS_JSON:
+                task._comments = load_json(string(comments))
+            else:
+                task.comments = string(comments)
+            task.history_log = None if history_count == NONE else [history_count, history_head]
+            if assignee_count == NONE:
+                task._assigned_to = None
+            else:
+                task._assigned_to = struct.unpack_from(f'<{assignee_count}I', self.map, position)
+                task._assigned_to = tuple([string(ref) for ref in task._assigned_to])
+                position += 4 * assignee_count
+            task.extra = None if extra == NONE else load_json(string(extra))
+            tasks[task_id] = task
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,647 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+from lazy import LazyImport
+from models import Project, Task, to_json
+from snapshot import BinarySnapshot, paused_gc, write_binary
+from history import HistoryStore
+from indexes import counts_record
+from locks import bump_generation, file_lock, generation
+from metrics import timed
+
+logger = LazyImport('loguru', 'logger')
+
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+MANIFEST_FILE = 'manifest.json'
+BINARY_SUFFIX = '.bin'
+DATA_DIRECTORY = 'APelahishokr'
+# Snapshot and shard saves closer together than this are coalesced into the next one, the flush at logout, or
+# the one at interpreter exit; only a process killed outright loses what was held back.
+SAVE_INTERVAL = float(os.environ.get('PMS_SAVE_INTERVAL', 5))
+
+
+class ProjectStore(dict):
+    def __init__(self, filename=None):
+        super().__init__()
+        self.filename = filename
+        self.listeners = []
+        self.indexes = {}
+        self.journal = None
+        self.shards = None
+        self.loader = None
+        self.history = None
+        # (project id, task id, field) -> project version of the last change made by another process
+        self.changes = {}
+        # Whether anything changed here since the last full save, when that save happened, and whether a save
+        # held back by SAVE_INTERVAL is already due at exit.
+        self.dirty = False
+        self.saved_at = None
+        self.flush_at_exit = False
+
+    def emit(self, event, *args, replayed=False):
+        # Changes read back from disk are already saved, so only the indexes need to follow them.
+        if not replayed:
+            self.dirty = True
+        for listener in list(self.indexes.values()) if replayed else self.listeners:
+            handler = getattr(listener, event, None)
+            if handler is not None:
+                handler(*args)
+
+    def index(self, index_class):
+        index = self.indexes.get(index_class)
+        if index is None:
+            index = index_class(self)
+            self.indexes[index_class] = index
+            self.listeners.append(index)
+        return index
+
+    def mark_saved(self):
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    def save_due(self, force=False):
+        if not self.dirty:
+            return False
+        return force or self.saved_at is None or time.monotonic() - self.saved_at >= SAVE_INTERVAL
+
+    def drop_indexes(self):
+        # A full refresh replaces projects and tasks wholesale, so indexes are rebuilt on next use instead.
+        for index in self.indexes.values():
+            self.listeners.remove(index)
+        self.indexes.clear()
+
+
+def index_of(projects, index_class):
+    # Plain dicts have nobody to keep an index current, so build a throwaway one.
+    if isinstance(projects, ProjectStore):
+        return projects.index(index_class)
+    return index_class(projects)
+
+
+def store_of(obj):
+    if isinstance(obj, ProjectStore):
+        return obj
+    if isinstance(obj, Task):
+        obj = obj.project
+    if isinstance(obj, Project):
+        return obj.store
+    return None
+
+
+def history_of(obj):
+    return getattr(store_of(obj), 'history', None)
+
+
+def version_of(obj):
+    project = obj.project if isinstance(obj, Task) else obj
+    return project.get('version') or 0
+
+
+def is_attached(obj):
+    if isinstance(obj, Task):
+        return obj.project.tasks.get(obj.id) is obj and is_attached(obj.project)
+    store = obj.store
+    return store is None or store.get(obj.id) is obj
+
+
+def changed_since(task, field, version):
+    # True when another process changed the field, or replaced the task, after the caller read it at version.
+    changes = getattr(store_of(task), 'changes', None)
+    if not changes:
+        return False
+    project_id = task.project.id
+    return max(changes.get((project_id, task.id, field), 0), changes.get((project_id, task.id, None), 0)) > version
+
+
+def notify(obj, event, *args):
+    store = store_of(obj)
+    if store is not None:
+        store.emit(event, obj, *args)
+
+
+def adopt_project(projects, project_id, data):
+    store = projects if isinstance(projects, ProjectStore) else None
+    project = Project.from_dict(data, store, project_id)
+    projects[project_id] = project
+    return project
+
+
+def adopt_task(project, task_id, data):
+    task = Task.from_dict(data, project if isinstance(project, Project) else None, task_id)
+    project['tasks'][task_id] = task
+    return task
+
+
+def attach_project(projects, project_id, data):
+    project = adopt_project(projects, project_id, data)
+    notify(project, 'project_added')
+    return project
+
+
+def detach_project(projects, project_id):
+    project = projects.pop(project_id)
+    notify(project, 'project_removed')
+    return project
+
+
+def attach_task(project, task_id, data):
+    task = adopt_task(project, task_id, data)
+    notify(task, 'task_added')
+    return task
+
+
+def detach_task(project, task_id):
+    task = project['tasks'].pop(task_id)
+    notify(task, 'task_removed')
+    return task
+
+
+class Journal:
+    def __init__(self, filename, projects):
+        self.filename = filename + JOURNAL_SUFFIX
+        self.projects = projects
+        # Bytes of the journal already applied in memory, and the compaction generation they belong to.
+        self.size = 0
+        self.generation = 0
+        self.depth = 0
+
+    def append(self, project, record):
+        record['version'] = project['version'] = (project.get('version') or 0) + 1
+        line = (json.dumps(record, separators=(',', ':'), default=to_json) + '\n').encode('utf-8')
+        with file_lock(self.projects.filename):
+            with open(self.filename, 'ab') as file:
+                end = file.seek(0, os.SEEK_END)
+                if end > self.size and self.depth:
+                    # Left behind by a writer that crashed mid-record; end it so replay skips it.
+                    line = b'\n' + line
+                file.write(line)
+            # Outside a transaction, records from other processes may still be pending; they are read
+            # (together with this one, harmlessly) on the next catch-up.
+            if self.depth or (end == self.size and generation(self.projects.filename) == self.generation):
+                self.size = end + len(line)
+
+    def project_added(self, project):
+        self.append(project, {'op': 'project', 'id': project.id, 'value': project})
+
+    def project_removed(self, project):
+        self.append(project, {'op': 'del', 'id': project.id})
+
+    def users_changed(self, project):
+        self.append(project, {'op': 'users', 'id': project.id, 'value': project['users']})
+
+    def task_added(self, task):
+        self.append(task.project, {'op': 'task', 'id': task.project.id, 'task': task.id, 'value': task})
+
+    def task_removed(self, task):
+        self.append(task.project, {'op': 'deltask', 'id': task.project.id, 'task': task.id})
+
+    def task_changed(self, task, field):
+        self.append(task.project, {'op': 'set', 'id': task.project.id, 'task': task.id, 'field': field,
+                                   'value': task.get(field)})
+
+    def comment_added(self, task, entry):
+        self.append(task.project, {'op': 'comment', 'id': task.project.id, 'task': task.id,
+                                   'index': len(task['comments']) - 1, 'value': entry})
+
+    def replay(self, projects, changes=None):
+        try:
+            if os.path.getsize(self.filename) == self.size:
+                return 0
+            file = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return 0
+        count = 0
+        with file:
+            file.seek(self.size)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # Not terminated yet; read again once it is.
+                    break
+                self.size += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Ignoring torn record in {}", self.filename)
+                    continue
+                apply_record(projects, record)
+                if changes is not None:
+                    note_change(projects, changes, record)
+                count += 1
+        return count
+
+    def catch_up(self, projects):
+        # Called with the store locked; applies what other processes appended since the last call.
+        current = generation(projects.filename)
+        if current != self.generation:
+            logger.info("{} was compacted by another process, reloading", self.filename)
+            refresh_store(projects)
+            self.size = 0
+            self.generation = current
+            count = self.replay(projects, projects.changes)
+            projects.drop_indexes()
+            return count
+        return self.replay(projects, projects.changes)
+
+    def truncate(self):
+        # A new file rather than truncating in place, so other processes notice the compaction.
+        temp_file = self.filename + '.tmp'
+        with open(temp_file, 'wb'):
+            pass
+        os.replace(temp_file, self.filename)
+        self.generation = bump_generation(self.projects.filename)
+        self.size = 0
+
+
+def note_change(projects, changes, record):
+    # Remembers the project version at which another process last touched each task field.
+    project = projects.get(record['id'])
+    if project is None:
+        return
+    op = record['op']
+    if 'task' in record:
+        field = record['field'] if op == 'set' else 'comments' if op == 'comment' else None
+        changes[(record['id'], record['task'], field)] = project.get('version') or 0
+    if record.get('field') == 'history_log' and projects.history is not None:
+        projects.history.forget(record['id'], record['task'])
+
+
+def apply_record(projects, record):
+    # Emitted as replayed, so indexes follow in place without the journal writing the record again.
+    op = record['op']
+    if op == 'project':
+        previous = projects.get(record['id'])
+        if previous is not None:
+            projects.emit('project_removed', previous, replayed=True)
+        projects.emit('project_added', adopt_project(projects, record['id'], record['value']), replayed=True)
+        return
+    if op == 'del':
+        project = projects.pop(record['id'], None)
+        if project is not None:
+            projects.emit('project_removed', project, replayed=True)
+        return
+    project = projects.get(record['id'])
+    if project is None:
+        return
+    if 'version' in record:
+        project['version'] = max(project.get('version') or 0, record['version'])
+    if op == 'users':
+        project['users'] = record['value']
+        projects.emit('users_changed', project, replayed=True)
+    elif op == 'task':
+        previous = project['tasks'].get(record['task'])
+        if previous is not None:
+            projects.emit('task_removed', previous, replayed=True)
+        projects.emit('task_added', adopt_task(project, record['task'], record['value']), replayed=True)
+    elif op == 'deltask':
+        task = project['tasks'].pop(record['task'], None)
+        if task is not None:
+            projects.emit('task_removed', task, replayed=True)
+    elif op in ('set', 'hist', 'comment'):
+        task = project['tasks'].get(record['task'])
+        if task is None:
+            return
+        if op == 'set':
+            task[record['field']] = record['value']
+            projects.emit('task_changed', task, record['field'], replayed=True)
+        elif op == 'comment':
+            comments = task.setdefault('comments', [])
+            if len(comments) == record['index']:
+                comments.append(record['value'])
+                projects.emit('comment_added', task, record['value'], replayed=True)
+        else:
+            # Inline history records are only written by older versions.
+            history = task.setdefault('history', [])
+            if len(history) == record['index']:
+                history.append(record['value'])
+
+
+def is_sharded(filename):
+    return os.path.isdir(filename) or not os.path.splitext(filename)[1]
+
+
+def is_binary(filename):
+    return filename.endswith(BINARY_SUFFIX)
+
+
+def default_projects_file():
+    for filename in ('projects', 'projects' + BINARY_SUFFIX):
+        filename = os.path.join(DATA_DIRECTORY, filename)
+        if os.path.exists(filename):
+            return filename
+    return os.path.join(DATA_DIRECTORY, 'projects.json')
+
+
+class Shards:
+    def __init__(self, directory):
+        self.directory = directory
+        self.dirty = set()
+        self.removed = set()
+        self.manifest_dirty = False
+        # project id -> version of its shard when this process last read or wrote it
+        self.versions = {}
+        # project id -> task counts from the manifest, for listing projects whose shards are not loaded
+        self.counts = {}
+
+    def path(self, project_id):
+        return os.path.join(self.directory, quote(project_id, safe='') + '.json')
+
+    def load(self, project):
+        try:
+            with open(self.path(project.id), 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            data = {}
+        logger.debug("Loading tasks of project {}", project.id)
+        loaded = Project.from_dict(data, None, project.id)
+        project.tasks = {}
+        for task_id, task in loaded.tasks.items():
+            task.project = project
+            project.tasks[task_id] = task
+        # The manifest fields already in memory are as new as the shard's, or newer.
+        project.extra = {**(loaded.extra or {}), **(project.extra or {})} or None
+
+    def saved_counts(self, project_id):
+        return self.counts.get(project_id)
+
+    def adopt(self, projects, project_id, entry):
+        # The counts are the shard's, not a project field, so they stay out of the project.
+        entry = dict(entry)
+        counts = entry.pop('counts', None)
+        if counts is None:
+            self.counts.pop(project_id, None)
+        else:
+            self.counts[project_id] = counts
+        self.versions[project_id] = entry.get('version')
+        return Project.from_dict(entry, projects, project_id)
+
+    def project_added(self, project):
+        self.dirty.add(project.id)
+        self.removed.discard(project.id)
+        self.manifest_dirty = True
+
+    def project_removed(self, project):
+        self.dirty.discard(project.id)
+        self.removed.add(project.id)
+        self.manifest_dirty = True
+
+    def users_changed(self, project):
+        self.dirty.add(project.id)
+        self.manifest_dirty = True
+
+    def task_added(self, task):
+        self.dirty.add(task.project.id)
+
+    def task_removed(self, task):
+        self.dirty.add(task.project.id)
+
+    def task_changed(self, task, field):
+        self.dirty.add(task.project.id)
+
+    def comment_added(self, task, entry):
+        self.dirty.add(task.project.id)
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST_FILE), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def reread(self, projects, project_id, entry):
+        # Another process saved this project; its manifest entry replaces ours and the tasks load again lazily.
+        project = self.adopt(projects, project_id, entry)
+        current = projects.get(project_id)
+        if current is None:
+            projects[project_id] = project
+        else:
+            projects.emit('project_removed', current, replayed=True)
+            copy_fields(project, current)
+            project = current
+        projects.emit('project_added', project, replayed=True)
+
+    def save(self, projects):
+        # Each shard carries a version; a project saved by another process since this one read it is a
+        # conflict and is reloaded rather than overwritten. Everything else merges at project granularity.
+        os.makedirs(self.directory, exist_ok=True)
+        conflicts = []
+        with file_lock(self.directory):
+            manifest = self.read_manifest() or {}
+            for project_id in self.dirty | self.removed:
+                entry = manifest.get(project_id)
+                known = project_id in self.versions
+                if known and (entry is None or entry.get('version') != self.versions[project_id]):
+                    conflicts.append(project_id)
+                    continue
+                if project_id in self.removed:
+                    manifest.pop(project_id, None)
+                    self.versions.pop(project_id, None)
+                    self.counts.pop(project_id, None)
+                    if os.path.exists(self.path(project_id)):
+                        os.remove(self.path(project_id))
+                    continue
+                project = projects[project_id]
+                project['version'] = self.versions[project_id] = ((entry or {}).get('version') or 0) + 1
+                write_json(self.path(project_id), project)
+                self.counts[project_id] = counts_record(project['tasks'])
+                manifest[project_id] = {'title': project['title'], 'leader': project['leader'],
+                                        'users': project['users'], 'version': project['version'],
+                                        'counts': self.counts[project_id]}
+            if self.dirty or self.removed or self.manifest_dirty:
+                write_json(os.path.join(self.directory, MANIFEST_FILE), manifest)
+        logger.info("Saved {} project shards to {}", len(self.dirty) + len(self.removed) - len(conflicts), self.directory)
+        self.dirty.clear()
+        self.removed.clear()
+        self.manifest_dirty = False
+        if getattr(projects, 'shards', None) is not self:
+            return conflicts
+        stale = [project_id for project_id, entry in manifest.items() if project_id in conflicts
+                 or project_id not in projects or entry.get('version') != self.versions.get(project_id)]
+        gone = [project_id for project_id in projects if project_id not in manifest]
+        for project_id in stale:
+            self.reread(projects, project_id, manifest[project_id])
+        for project_id in gone:
+            projects.emit('project_removed', projects.pop(project_id), replayed=True)
+            self.versions.pop(project_id, None)
+            self.counts.pop(project_id, None)
+        if conflicts:
+            logger.warning("Projects changed by another process were reloaded instead of saved: {}", conflicts)
+        return conflicts
+
+
+def open_sharded_store(directory):
+    projects = ProjectStore(directory)
+    projects.shards = projects.loader = Shards(directory)
+    projects.history = HistoryStore(directory)
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), 'r') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        logger.warning("Projects manifest not found, creating a new one.")
+        manifest = {}
+    for project_id, entry in manifest.items():
+        projects[project_id] = projects.shards.adopt(projects, project_id, entry)
+    projects.listeners.append(projects.shards)
+    return projects
+
+
+def open_store(filename, journal=True):
+    if is_sharded(filename):
+        return open_sharded_store(filename)
+    projects = ProjectStore(filename)
+    projects.history = HistoryStore(filename)
+    # Shared, so loads only wait for a compaction in progress, never for each other.
+    with file_lock(filename, shared=True):
+        load_snapshot(projects, filename)
+        if journal:
+            projects.journal = Journal(filename, projects)
+            projects.journal.generation = generation(filename)
+            replayed = projects.journal.replay(projects)
+            if replayed:
+                logger.info("Replayed {} journal records from {}", replayed, projects.journal.filename)
+            projects.listeners.append(projects.journal)
+    return projects
+
+
+def load_snapshot(projects, filename):
+    if is_binary(filename):
+        open_binary(projects, filename)
+        return
+    try:
+        with open(filename, 'r') as file, paused_gc():
+            data = json.load(file)
+            for project_id, project in data.items():
+                adopt_project(projects, project_id, project)
+    except FileNotFoundError:
+        logger.warning("Projects file not found, creating a new one.")
+
+
+def copy_fields(source, target):
+    for slot in type(source).__slots__:
+        if slot not in ('store', 'project', 'id'):
+            setattr(target, slot, getattr(source, slot))
+
+
+def refresh_store(projects):
+    # Rebuilt from the new snapshot in place, so Project and Task objects held by callers stay current.
+    fresh = ProjectStore(projects.filename)
+    load_snapshot(fresh, projects.filename)
+    loader = projects.loader
+    projects.loader = fresh.loader
+    for project_id in [project_id for project_id in projects if project_id not in fresh]:
+        del projects[project_id]
+    for project_id, project in fresh.items():
+        project.store = projects
+        current = projects.get(project_id)
+        if current is None:
+            projects[project_id] = project
+            continue
+        if current._tasks is not None:
+            for task_id, task in project.tasks.items():
+                held = current._tasks.get(task_id)
+                if held is not None:
+                    # The journal that named the changed fields is gone, so compare them.
+                    old, new = held.to_dict(), task.to_dict()
+                    for field in old.keys() | new.keys():
+                        if old.get(field) != new.get(field):
+                            projects.changes[(project_id, task_id, field)] = version_of(project)
+                    copy_fields(task, held)
+                    project.tasks[task_id] = held
+                else:
+                    task.project = current
+        copy_fields(project, current)
+    if projects.history is not None:
+        projects.history.forget()
+    if loader is not None and loader is not projects.loader:
+        loader.close()
+
+
+def catch_up(projects):
+    # Readers pick up other sessions' changes under the shared lock, so they never wait for each other.
+    journal = getattr(projects, 'journal', None)
+    if journal is None or journal.depth:
+        return 0
+    with file_lock(projects.filename, shared=True):
+        return journal.catch_up(projects)
+
+
+@contextmanager
+def transaction(obj):
+    # Writers lock the store and apply what other processes appended before making their own change,
+    # so it is checked and journaled against the latest state.
+    projects = store_of(obj)
+    journal = getattr(projects, 'journal', None)
+    if journal is None:
+        yield
+        return
+    with file_lock(projects.filename):
+        if not journal.depth:
+            journal.catch_up(projects)
+        journal.depth += 1
+        try:
+            yield
+        finally:
+            journal.depth -= 1
+
+
+def open_binary(projects, filename):
+    try:
+        snapshot = BinarySnapshot(filename)
+    except FileNotFoundError:
+        logger.warning("Projects file not found, creating a new one.")
+        return
+    projects.loader = snapshot
+    projects.update(snapshot.projects(projects))
+
+
+def write_json(filename, data):
+    temp_file = filename + '.tmp'
+    with open(temp_file, 'w') as file:
+        # Without indent json uses its C encoder; one dumps() call avoids thousands of small writes.
+        file.write(json.dumps(data, separators=(',', ':'), default=to_json))
+        # On disk before the rename, so a crash leaves the old file or the new one, never a torn one.
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, filename)
+
+
+def write_snapshot(filename, projects):
+    if is_sharded(filename):
+        shards = Shards(filename)
+        shards.dirty.update(projects)
+        shards.manifest_dirty = True
+        shards.save(projects)
+    elif is_binary(filename):
+        write_binary(filename, projects)
+    else:
+        write_json(filename, projects)
+
+
+@timed('compact_projects')
+def compact_projects(projects):
+    if projects.shards is not None:
+        projects.shards.save(projects)
+    elif projects.journal is None:
+        write_snapshot(projects.filename, projects)
+    else:
+        with transaction(projects):
+            logger.info("Compacting project journal into {}", projects.filename)
+            write_snapshot(projects.filename, projects)
+            projects.journal.truncate()
+    projects.mark_saved()
+
+
+@contextmanager
+def batch_writes(projects):
+    # Bulk mutations skip the per-record journal and are saved as one snapshot.
+    journal = projects.journal
+    if journal is not None:
+        projects.listeners.remove(journal)
+    try:
+        yield projects
+        compact_projects(projects)
+    finally:
+        if journal is not None:
+            projects.listeners.append(journal)
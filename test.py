@@ -2,10 +2,17 @@ import unittest
 import os
 import pandas as pd
 import json
+import shutil
 from unittest.mock import patch, mock_open
 from io import StringIO
-from account import UserAccount
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+from contextlib import redirect_stdout
+from account import UserAccount, load_admin_credentials, verify_password
 from main import (
+    add_comment,
     load_projects,
     save_projects,
     create_project,
@@ -18,8 +25,40 @@ from main import (
     view_projects,
     can_access_project,
     manage_tasks,
-    update_task_status_or_comment
+    update_task_status_or_comment,
+    set_task_field,
+    query_tasks,
+    parse_enum,
+    TaskStatus,
+    import_projects,
+    import_tasks,
+    next_task_id,
+    set_task_date,
+    overdue_tasks,
+    due_soon_tasks,
+    view_dashboard,
+    search_tasks,
+    task_history
 )
+from store import (compact_projects, batch_writes, write_snapshot, open_store, transaction, attach_task, version_of,
+                   catch_up, JOURNAL_SUFFIX, MANIFEST_FILE)
+from pager import Pager
+from history import history_count, HISTORY_SUFFIX, HISTORY_TAIL
+from models import Project, Task, parse_date
+from indexes import CounterIndex, MembershipIndex, SearchIndex, TaskIndex
+from locks import LOCK_SUFFIX
+from logs import Sampler, BackgroundSink
+from sessions import SessionCache, SESSIONS_SUFFIX, SESSION_KEY_SUFFIX
+import metrics
+from types import SimpleNamespace
+import threading
+import account as account_module
+import main as main_module
+from client import ServiceClient
+from service import Service
+from manager import convert_store
+from snapshot import HEADER, MAGIC, NONE, PROJECT_V2, TASK_V1
+import struct
 
 class TestUserAccount(unittest.TestCase):
 
@@ -34,14 +73,23 @@ class TestUserAccount(unittest.TestCase):
 
         # Mocking the logger to avoid file creation
         patch('account.logger').start()
+        # Keep the KDF cheap so the tests stay fast
+        patch('account.HASH_ITERATIONS', 1000).start()
 
         # Initialize the UserAccount class
-        self.user_account = UserAccount(self.accounts_file)
+        self.user_account = UserAccount(self.accounts_file, self.admin_file)
 
     def tearDown(self):
         # Remove the temporary files after tests
         if os.path.exists(self.accounts_file):
             os.remove(self.accounts_file)
+        if os.path.exists(self.accounts_file + '.delta'):
+            os.remove(self.accounts_file + '.delta')
+        if os.path.exists(self.accounts_file + LOCK_SUFFIX):
+            os.remove(self.accounts_file + LOCK_SUFFIX)
+        for suffix in (SESSIONS_SUFFIX, SESSIONS_SUFFIX + LOCK_SUFFIX, SESSION_KEY_SUFFIX):
+            if os.path.exists(self.accounts_file + suffix):
+                os.remove(self.accounts_file + suffix)
         if os.path.exists(self.admin_file):
             os.remove(self.admin_file)
         if os.path.exists(self.projects_file):
@@ -61,7 +109,8 @@ class TestUserAccount(unittest.TestCase):
         account = self.user_account.login('testuser', 'password123')
         self.assertIsNotNone(account)
         self.assertEqual(account['Username'], 'testuser')
-def test_03_login_fail(self):
+
+    def test_03_login_fail(self):
         print("Running test 03: test_login_fail")
         self.user_account.sign_up('testuser', 'password123', 'testuser@example.com')
         account = self.user_account.login('testuser', 'wrongpassword')
@@ -73,6 +122,161 @@ def test_03_login_fail(self):
         result = self.user_account.sign_up('testuser', 'password123', 'testuser@example.com')
         self.assertFalse(result)
 
+    def test_05_account_indexes(self):
+        print("Running test 05: test_account_indexes")
+        with open(self.accounts_file, 'w') as file:
+            file.write("Username,Password,Email,Role\n1001,hash1,a@example.com,user\nbob,hash2,b@example.com,Inactive\n")
+        user_account = UserAccount(self.accounts_file)
+        self.assertEqual(user_account.find_account('bob')['Role'], 'Inactive')
+        self.assertEqual(user_account.find_account('1001')['Email'], 'a@example.com')
+        self.assertIsNone(user_account.find_account('carol'))
+        self.assertTrue(user_account.account_exists('carol', 'b@example.com'))
+        self.assertFalse(user_account.account_exists('carol', 'c@example.com'))
+
+    def test_06_role_changes_go_to_delta_file(self):
+        print("Running test 06: test_role_changes_go_to_delta_file")
+        with open(self.accounts_file, 'w') as file:
+            file.write("Username,Password,Email,Role\nalice,hash1,a@example.com,user\nbob,hash2,b@example.com,user\n")
+        user_account = UserAccount(self.accounts_file)
+        with patch('account.console') as mock_console:
+            mock_console.input.side_effect = ['1', '']
+            user_account.modify_user_status()
+        self.assertEqual(pd.read_csv(self.accounts_file).iloc[1]['Role'], 'user')
+        self.assertEqual(UserAccount(self.accounts_file).find_account('bob')['Role'], 'Inactive')
+
+        user_account.compact_accounts()
+        self.assertFalse(os.path.exists(self.accounts_file + '.delta'))
+        self.assertEqual(pd.read_csv(self.accounts_file).iloc[1]['Role'], 'Inactive')
+
+    def test_07_new_accounts_are_appended(self):
+        print("Running test 07: test_new_accounts_are_appended")
+        user_account = UserAccount(self.accounts_file)
+        user_account.append_account(['alice', 'hash1', 'a@example.com', 'user'])
+        user_account.append_account(['bob', 'hash2', 'b@example.com', 'user'])
+        accounts = pd.read_csv(self.accounts_file)
+        self.assertEqual(list(accounts['Username']), ['alice', 'bob'])
+
+    def test_08_admin_credentials_reload_on_change(self):
+        print("Running test 08: test_admin_credentials_reload_on_change")
+        self.assertEqual(load_admin_credentials(self.admin_file), ('admin', 'adminpass'))
+        with patch('builtins.open', side_effect=AssertionError("admin file re-read")):
+            self.assertEqual(load_admin_credentials(self.admin_file), ('admin', 'adminpass'))
+        with open(self.admin_file, 'w') as file:
+            file.write("Username:root\nPassword:rootpass")
+        stat = os.stat(self.admin_file)
+        os.utime(self.admin_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertEqual(load_admin_credentials(self.admin_file), ('root', 'rootpass'))
+        self.assertTrue(self.user_account.login('root', 'rootpass') is not None)
+
+    def test_09_import_accounts(self):
+        print("Running test 09: test_import_accounts")
+        self.user_account.sign_up('testuser', 'password123', 'testuser@example.com')
+        imported, skipped = self.user_account.import_accounts([
+            {'username': 'alice', 'password': 'pw1', 'email': 'alice@example.com'},
+            {'username': 'testuser', 'password': 'pw2', 'email': 'other@example.com'},
+            {'username': 'alice', 'password': 'pw3', 'email': 'alice2@example.com'},
+            {'username': 'admin', 'password': 'pw4', 'email': 'admin@example.com'},
+            {'username': 'bob', 'password': 'pw5', 'email': 'bob@example.com', 'role': 'Inactive'},
+        ])
+        self.assertEqual((imported, skipped), (2, 3))
+        self.assertEqual(list(pd.read_csv(self.accounts_file)['Username']), ['testuser', 'alice', 'bob'])
+        self.assertIsNotNone(self.user_account.login('alice', 'pw1'))
+        self.assertIsNone(self.user_account.login('bob', 'pw5'))
+
+    def test_10_legacy_hash_is_upgraded_on_login(self):
+        print("Running test 10: test_legacy_hash_is_upgraded_on_login")
+        legacy = hashlib.sha256(b'password123').hexdigest()
+        with open(self.accounts_file, 'w') as file:
+            file.write(f"Username,Password,Email,Role\nalice,{legacy},a@example.com,user\n")
+        user_account = UserAccount(self.accounts_file, self.admin_file)
+        self.assertIsNone(user_account.login('alice', 'wrong'))
+        self.assertIsNotNone(user_account.login('alice', 'password123'))
+        stored = UserAccount(self.accounts_file, self.admin_file).find_account('alice')['Password']
+        self.assertTrue(stored.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(verify_password('password123', stored), (True, False))
+        self.assertEqual(verify_password('password123', stored, 2000), (True, True))
+
+    def test_11_parallel_import_hashes_with_salt(self):
+        print("Running test 11: test_parallel_import_hashes_with_salt")
+        records = [{'username': f'user{i}', 'password': 'same', 'email': f'user{i}@example.com'} for i in range(8)]
+        self.assertEqual(self.user_account.import_accounts(records, workers=2), (8, 0))
+        passwords = list(pd.read_csv(self.accounts_file)['Password'])
+        self.assertEqual(len(set(passwords)), 8)
+        self.assertIsNotNone(self.user_account.login('user7', 'same'))
+
+    def test_12_sessions_resume_until_deactivated(self):
+        print("Running test 12: test_sessions_resume_until_deactivated")
+        self.user_account.sign_up('alice', 'password123', 'alice@example.com')
+        self.user_account.sign_up('bob', 'password456', 'bob@example.com')
+        alice = self.user_account.sessions.issue(self.user_account.login('alice', 'password123'))
+        bob = self.user_account.sessions.issue(self.user_account.login('bob', 'password456'))
+        # Another process resumes from the cache alone: no hashing, accounts file or admin file.
+        cache = SessionCache(self.accounts_file)
+        with patch('account.verify_password', side_effect=AssertionError("password hashed")), \
+                patch('account.load_admin_credentials', side_effect=AssertionError("admin file read")):
+            self.assertEqual(cache.resume(alice), {'Username': 'alice', 'Email': 'alice@example.com', 'Role': 'user'})
+        session_id, expires, signature = alice.split('.')
+        self.assertIsNone(cache.resume(f"{session_id}.{int(expires) + 60}.{signature}"))
+        self.assertIsNone(cache.resume(f"{session_id}.{expires}.{'0' * len(signature)}"))
+        self.assertIsNone(SessionCache(self.accounts_file, ttl=-1).resume(
+            SessionCache(self.accounts_file, ttl=-1).issue({'Username': 'alice', 'Email': '', 'Role': 'user'})))
+
+        # alice is the first row; deactivating her ends her session at once, bob's stays.
+        with patch('account.console') as mock_console:
+            mock_console.input.side_effect = ['0', '']
+            self.user_account.modify_user_status()
+        self.assertIsNone(cache.resume(alice))
+        self.assertEqual(cache.resume(bob)['Username'], 'bob')
+        cache.end(bob)
+        self.assertIsNone(cache.resume(bob))
+
+    def test_13_import_streams_batches_through_one_pool(self):
+        print("Running test 13: test_import_streams_batches_through_one_pool")
+        appended = []
+        seen = []
+
+        def records():
+            for i in range(10):
+                # Each batch is appended before the next one is read.
+                seen.append(len(appended))
+                username = 'user0' if i == 6 else f'user{i}'
+                yield {'username': username, 'password': 'same', 'email': f'user{i}@example.com'}
+
+        original = self.user_account.append_accounts
+
+        def append_accounts(rows):
+            appended.append(len(rows))
+            original(rows)
+
+        with patch('account.IMPORT_BATCH_ROWS', 4), \
+                patch.object(self.user_account, 'append_accounts', side_effect=append_accounts), \
+                patch('concurrent.futures.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as mock_pool:
+            self.assertEqual(self.user_account.import_accounts(records(), workers=2), (9, 1))
+        self.assertEqual(appended, [4, 3, 2])
+        self.assertEqual(seen, [0] * 4 + [1] * 4 + [2] * 2)
+        self.assertEqual(mock_pool.call_count, 1)
+        self.assertIsNotNone(self.user_account.login('user9', 'same'))
+
+    def test_14_sessions_end_on_role_or_admin_change(self):
+        print("Running test 14: test_sessions_end_on_role_or_admin_change")
+        self.user_account.sign_up('alice', 'password123', 'alice@example.com')
+        alice = self.user_account.sessions.issue(self.user_account.login('alice', 'password123'))
+        admin = self.user_account.sessions.issue(self.user_account.login('admin', 'adminpass'))
+        cache = SessionCache(self.accounts_file, admin_file=self.admin_file)
+        self.assertEqual(cache.resume(admin)['Role'], 'admin')
+        with patch.object(self.user_account, 'catch_up', wraps=self.user_account.catch_up) as mock_catch_up:
+            self.user_account.set_account_field('alice', 'Role', 'admin')
+        self.assertEqual(mock_catch_up.call_count, 1)
+        self.assertIsNone(cache.resume(alice))
+
+        with open(self.admin_file, 'w') as file:
+            file.write("Username:root\nPassword:rootpass")
+        stat = os.stat(self.admin_file)
+        os.utime(self.admin_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertIsNone(cache.resume(admin))
+        self.assertIsNone(SessionCache(self.accounts_file).resume(
+            SessionCache(self.accounts_file).issue({'Username': 'root', 'Email': '', 'Role': 'admin'})))
+
 
 class TestProjectManagement(unittest.TestCase):
 
@@ -86,6 +290,10 @@ class TestProjectManagement(unittest.TestCase):
         # Remove the temporary files after tests
         if os.path.exists(self.projects_file):
             os.remove(self.projects_file)
+        if os.path.exists(self.projects_file + HISTORY_SUFFIX):
+            os.remove(self.projects_file + HISTORY_SUFFIX)
+        if os.path.exists(self.projects_file + LOCK_SUFFIX):
+            os.remove(self.projects_file + LOCK_SUFFIX)
         patch.stopall()
 
     def test_01_load_projects(self):
@@ -111,7 +319,8 @@ class TestProjectManagement(unittest.TestCase):
         project_id = list(projects.keys())[0]
         self.assertEqual(projects[project_id]['title'], 'New Project')
         self.assertEqual(projects[project_id]['leader'], 'leader1')
-def test_04_add_user_to_project(self):
+
+    def test_04_add_user_to_project(self):
         print("Running test 04: test_add_user_to_project")
         projects = create_project({}, 'New Project', 'leader1')
         project_id = list(projects.keys())[0]
@@ -227,5 +436,968 @@ def test_04_add_user_to_project(self):
         self.assertFalse(can_access_project(project, 'user2', 'user'))
         self.assertTrue(can_access_project(project, 'user2', 'admin'))
 
+def concurrent_writer(projects_file, accounts_file, admin_file, worker, rounds):
+    # Runs in a child process; every writer works on the same project and task.
+    with patch('main.logger'), patch('store.logger'), patch('account.logger'), redirect_stdout(StringIO()):
+        projects = load_projects(projects_file)
+        project = projects['shared']
+        for number in range(rounds):
+            with transaction(project):
+                attach_task(project, next_task_id(project), {'title': f'Worker {worker} task {number}'})
+            add_comment(project['tasks']['1'], f'worker{worker}', f'Comment {number}')
+            if worker % 8 == 0 and number == rounds // 2:
+                compact_projects(projects)
+        set_task_field(project['tasks']['1'], f'worker{worker}', number, f'worker{worker}')
+        add_user_to_project(projects, 'shared', f'worker{worker}')
+        UserAccount(accounts_file, admin_file, 1000).sign_up(f'worker{worker}', 'password', f'worker{worker}@example.com')
+
+
+class TestConcurrentAccess(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_file = 'test_projects.json'
+        self.projects_dir = 'test_projects'
+        self.accounts_file = 'test_accounts.csv'
+        self.admin_file = 'test_admin.txt'
+        with open(self.admin_file, 'w') as file:
+            file.write("Username: admin\nPassword: admin")
+        patch('main.logger').start()
+        patch('store.logger').start()
+
+    def tearDown(self):
+        for filename in (self.projects_file, self.projects_file + JOURNAL_SUFFIX, self.projects_file + HISTORY_SUFFIX,
+                         self.projects_file + LOCK_SUFFIX, self.projects_dir + HISTORY_SUFFIX,
+                         self.projects_dir + LOCK_SUFFIX, self.accounts_file, self.accounts_file + LOCK_SUFFIX,
+                         self.admin_file):
+            if os.path.exists(filename):
+                os.remove(filename)
+        shutil.rmtree(self.projects_dir, ignore_errors=True)
+        patch.stopall()
+
+    def test_01_concurrent_writers_merge(self):
+        print("Running test 01: test_concurrent_writers_merge")
+        writers, rounds = 32, 5
+        write_snapshot(self.projects_file, {'shared': {'title': 'Shared', 'leader': 'leader1', 'users': ['leader1'],
+                                                       'tasks': {'1': {'title': 'Task 1', 'comments': []}}}})
+        processes = [multiprocessing.Process(target=concurrent_writer, args=(
+            self.projects_file, self.accounts_file, self.admin_file, worker, rounds)) for worker in range(writers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(120)
+            self.assertEqual(process.exitcode, 0)
+
+        project = load_projects(self.projects_file)['shared']
+        titles = sorted(task['title'] for task_id, task in project['tasks'].items() if task_id != '1')
+        self.assertEqual(titles, sorted(f'Worker {worker} task {number}' for worker in range(writers) for number in range(rounds)))
+        shared = project['tasks']['1']
+        self.assertEqual(len(shared['comments']), writers * rounds)
+        self.assertTrue(all(shared[f'worker{worker}'] == rounds - 1 for worker in range(writers)))
+        self.assertEqual(history_count(shared), writers * (rounds + 1))
+        self.assertEqual(sorted(project['users']), sorted(['leader1'] + [f'worker{worker}' for worker in range(writers)]))
+        accounts = UserAccount(self.accounts_file, self.admin_file, 1000).accounts
+        self.assertEqual(sorted(accounts['Username']), sorted(f'worker{worker}' for worker in range(writers)))
+
+    def test_02_same_field_conflict_is_detected(self):
+        print("Running test 02: test_same_field_conflict_is_detected")
+        first = load_projects(self.projects_file)
+        create_project(first, 'Project', 'leader1')
+        project_id = list(first)[0]
+        with transaction(first):
+            attach_task(first[project_id], '1', {'title': 'Task 1', 'status': 'To Do'})
+        second = load_projects(self.projects_file)
+        task, other = first[project_id]['tasks']['1'], second[project_id]['tasks']['1']
+        version = version_of(task)
+        self.assertTrue(set_task_field(other, 'status', 'Doing', 'user2'))
+        self.assertTrue(set_task_field(task, 'title', 'Renamed', 'user1', version))
+        self.assertEqual(task['status'], 'Doing')
+        self.assertFalse(set_task_field(task, 'status', 'Done', 'user1', version))
+        self.assertEqual(task['status'], 'Doing')
+        self.assertTrue(set_task_field(task, 'status', 'Done', 'user1'))
+        compact_projects(second)
+        remove_task_from_project(second[project_id], '1')
+        self.assertFalse(set_task_field(task, 'title', 'Again', 'user1'))
+        self.assertNotIn('1', first[project_id]['tasks'])
+        self.assertEqual(load_projects(self.projects_file), first)
+
+    def test_03_sharded_saves_merge_by_project(self):
+        print("Running test 03: test_sharded_saves_merge_by_project")
+        write_snapshot(self.projects_dir, {'p1': {'title': 'Project 1', 'leader': 'leader1', 'users': ['leader1'], 'tasks': {}}})
+        first, second = load_projects(self.projects_dir), load_projects(self.projects_dir)
+        create_project(first, 'Project 2', 'leader2')
+        add_user_to_project(second, 'p1', 'user2')
+        self.assertEqual(second.shards.save(second), [])
+        self.assertEqual(first.shards.save(first), [])
+        self.assertEqual(first['p1']['users'], ['leader1', 'user2'])
+        add_user_to_project(first, 'p1', 'user1')
+        add_user_to_project(second, 'p1', 'user3')
+        self.assertEqual(first.shards.save(first), [])
+        self.assertEqual(second.shards.save(second), ['p1'])
+        self.assertEqual(second['p1']['users'], ['leader1', 'user2', 'user1'])
+        self.assertEqual(len(second), 2)
+
+
+class TestProjectJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_file = 'test_projects.json'
+        self.journal_file = self.projects_file + JOURNAL_SUFFIX
+        patch('main.logger').start()
+        patch('store.logger').start()
+
+    def tearDown(self):
+        for filename in (self.projects_file, self.journal_file, self.projects_file + HISTORY_SUFFIX,
+                         self.projects_file + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_mutations_replay_from_journal(self):
+        print("Running test 01: test_mutations_replay_from_journal")
+        projects = load_projects(self.projects_file)
+        create_project(projects, 'New Project', 'leader1')
+        project_id = list(projects.keys())[0]
+        add_user_to_project(projects, project_id, 'user1')
+        with patch('builtins.input', side_effect=[
+            'Task 1', 'Description 1', '2024-05-28', '2024-06-28', 'user1', 'High', 'ToDo', 'No comments'
+        ]):
+            add_task(projects[project_id])
+        task = projects[project_id]['tasks']['1']
+        set_task_field(task, 'status', 'Done', 'user1')
+        save_projects(self.projects_file, projects)
+        self.assertFalse(os.path.exists(self.projects_file))
+
+        reloaded = load_projects(self.projects_file)
+        self.assertEqual(reloaded, projects)
+        self.assertEqual(reloaded[project_id]['tasks']['1']['status'], 'Done')
+        self.assertEqual(history_count(reloaded[project_id]['tasks']['1']), 1)
+        self.assertNotIn('history', reloaded[project_id]['tasks']['1'])
+
+    def test_02_compaction_folds_journal_into_snapshot(self):
+        print("Running test 02: test_compaction_folds_journal_into_snapshot")
+        projects = load_projects(self.projects_file)
+        create_project(projects, 'New Project', 'leader1')
+        project_id = list(projects.keys())[0]
+        compact_projects(projects)
+        self.assertEqual(os.path.getsize(self.journal_file), 0)
+        remove_project(projects, project_id)
+        create_project(projects, 'Other Project', 'leader2')
+
+        with open(self.projects_file, 'r') as file:
+            self.assertIn(project_id, json.load(file))
+        reloaded = load_projects(self.projects_file)
+        self.assertEqual(reloaded, projects)
+        self.assertNotIn(project_id, reloaded)
+
+    def test_03_torn_journal_record_is_ignored(self):
+        print("Running test 03: test_torn_journal_record_is_ignored")
+        projects = load_projects(self.projects_file)
+        create_project(projects, 'New Project', 'leader1')
+        with open(self.journal_file, 'a') as file:
+            file.write('{"op": "del", "id"')
+        reloaded = load_projects(self.projects_file)
+        self.assertEqual(reloaded, projects)
+
+    def test_04_unjournaled_saves_skip_and_coalesce(self):
+        print("Running test 04: test_unjournaled_saves_skip_and_coalesce")
+        projects = load_projects(self.projects_file, journal=False)
+        with patch('main.write_snapshot', wraps=write_snapshot) as mock_write, \
+                patch('main.atexit.register') as mock_register:
+            save_projects(self.projects_file, projects)
+            self.assertEqual(mock_write.call_count, 0)
+            create_project(projects, 'First Project', 'leader1')
+            save_projects(self.projects_file, projects)
+            self.assertEqual(mock_write.call_count, 1)
+            # A second change right after the first waits for the interval, or for the flush at logout.
+            create_project(projects, 'Second Project', 'leader1')
+            save_projects(self.projects_file, projects)
+            self.assertEqual(mock_write.call_count, 1)
+            self.assertEqual(len(load_projects(self.projects_file, journal=False)), 1)
+            # Held back, so it is written at exit at the latest.
+            save_projects(self.projects_file, projects)
+            mock_register.assert_called_once_with(save_projects, self.projects_file, projects, True)
+            save_projects(self.projects_file, projects, force=True)
+            save_projects(self.projects_file, projects, force=True)
+            self.assertEqual(mock_write.call_count, 2)
+            with patch('store.SAVE_INTERVAL', 0):
+                remove_project(projects, list(projects)[0])
+                save_projects(self.projects_file, projects)
+            self.assertEqual(mock_write.call_count, 3)
+        self.assertEqual(load_projects(self.projects_file, journal=False), projects)
+        self.assertFalse(projects.dirty)
+        self.assertFalse(os.path.exists(self.projects_file + '.tmp'))
+
+    def test_05_catch_up_updates_indexes_in_place(self):
+        print("Running test 05: test_catch_up_updates_indexes_in_place")
+        projects = load_projects(self.projects_file)
+        import_projects(projects, [{'id': 'p1', 'title': 'Project 1', 'leader': 'leader1'}])
+        import_tasks(projects, [
+            {'project': 'p1', 'title': 'Billing', 'status': 'To Do', 'priority': 'Low'},
+            {'project': 'p1', 'title': 'Deploy', 'status': 'To Do', 'priority': 'Low'},
+        ])
+        tasks, words = projects.index(TaskIndex), projects.index(SearchIndex)
+        projects.mark_saved()
+        other = load_projects(self.projects_file)
+        set_task_field(other['p1']['tasks']['1'], 'status', 'Done', 'leader1')
+        remove_task_from_project(other['p1'], '2')
+        with patch('builtins.input', side_effect=[
+            'Invoices', 'Description', '2024-05-28', '2024-06-28', 'leader1', 'High', 'ToDo', 'No comments'
+        ]):
+            add_task(other['p1'])
+
+        self.assertEqual(catch_up(projects), 4)
+        self.assertIs(projects.index(TaskIndex), tasks)
+        self.assertIs(projects.index(SearchIndex), words)
+        self.assertEqual(tasks.tasks, TaskIndex(projects).tasks)
+        self.assertEqual(words.postings, SearchIndex(projects).postings)
+        self.assertEqual([task['title'] for _, _, task in query_tasks(projects, status='Done')], ['Billing'])
+        self.assertEqual([task['title'] for _, _, task in query_tasks(projects, status='To Do')], ['Invoices'])
+        self.assertFalse(projects.dirty)
+
+
+class TestShardedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_dir = 'test_projects'
+        patch('main.logger').start()
+        patch('store.logger').start()
+
+    def tearDown(self):
+        shutil.rmtree(self.projects_dir, ignore_errors=True)
+        for filename in (self.projects_dir + HISTORY_SUFFIX, self.projects_dir + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_manifest_loads_without_tasks(self):
+        print("Running test 01: test_manifest_loads_without_tasks")
+        projects = load_projects(self.projects_dir)
+        create_project(projects, 'Project 1', 'leader1')
+        create_project(projects, 'Project 2', 'leader2')
+        first, second = list(projects.keys())
+        add_user_to_project(projects, first, 'user1')
+        with patch('builtins.input', side_effect=[
+            'Task 1', 'Description 1', '2024-05-28', '2024-06-28', 'user1', 'High', 'ToDo', 'No comments'
+        ]):
+            add_task(projects[first])
+        save_projects(self.projects_dir, projects)
+
+        with open(os.path.join(self.projects_dir, MANIFEST_FILE), 'r') as file:
+            self.assertNotIn('tasks', json.load(file)[first])
+        reloaded = load_projects(self.projects_dir)
+        self.assertEqual(reloaded[first]['users'], ['leader1', 'user1'])
+        self.assertTrue(all(project._tasks is None for project in reloaded.values()))
+        self.assertEqual(reloaded[first]['tasks']['1']['title'], 'Task 1')
+        self.assertIsNone(reloaded[second]._tasks)
+        self.assertEqual(reloaded, projects)
+
+    def test_02_only_touched_shards_are_written(self):
+        print("Running test 02: test_only_touched_shards_are_written")
+        projects = {'p1': {'title': 'Project 1', 'leader': 'leader1', 'users': ['leader1'], 'tasks': {}},
+                    'p2': {'title': 'Project 2', 'leader': 'leader2', 'users': ['leader2'], 'tasks': {}}}
+        write_snapshot(self.projects_dir, projects)
+        reloaded = load_projects(self.projects_dir)
+        os.remove(os.path.join(self.projects_dir, 'p1.json'))
+        remove_project(reloaded, 'p2')
+        save_projects(self.projects_dir, reloaded)
+        self.assertEqual(os.listdir(self.projects_dir), [MANIFEST_FILE])
+        self.assertEqual(list(load_projects(self.projects_dir)), ['p1'])
+
+    def test_03_view_projects_loads_only_shown_projects(self):
+        print("Running test 03: test_view_projects_loads_only_shown_projects")
+        task = {'title': 'Task 1', 'assigned_to': ['alice'], 'priority': 'High', 'status': 'Doing'}
+        write_snapshot(self.projects_dir, {
+            project_id: {'title': project_id, 'leader': leader, 'users': [leader], 'tasks': {'1': task}}
+            for project_id, leader in (('p1', 'alice'), ('p2', 'bob'), ('p3', 'carol'))})
+        projects = load_projects(self.projects_dir)
+        with patch('builtins.input', return_value=''), patch('rich.console.Console.print'):
+            view_projects(projects, 'alice', 'user')
+            view_dashboard(projects, 'alice', 'user')
+        self.assertEqual(projects.index(CounterIndex).counts_for('p1')['status'], {'Doing': 1})
+        self.assertIsNone(projects['p2']._tasks)
+        self.assertIsNone(projects['p3']._tasks)
+
+    def test_04_admin_project_list_uses_saved_counts(self):
+        print("Running test 04: test_admin_project_list_uses_saved_counts")
+        task = {'title': 'Task 1', 'assigned_to': ['alice'], 'priority': 'High', 'status': 'Doing'}
+        write_snapshot(self.projects_dir, {
+            project_id: {'title': project_id, 'leader': 'alice', 'users': ['alice'], 'tasks': {'1': task, '2': task}}
+            for project_id in ('p1', 'p2', 'p3')})
+        other = load_projects(self.projects_dir)
+        set_task_field(other['p2']['tasks']['1'], 'status', 'Done', 'alice')
+        save_projects(self.projects_dir, other, force=True)
+
+        projects = load_projects(self.projects_dir)
+        with patch('builtins.input', return_value=''), patch('rich.console.Console.print'):
+            view_projects(projects, 'admin', 'admin')
+            summary = view_dashboard(projects, 'admin', 'admin')
+        self.assertEqual(summary['status'], {'Doing': 5, 'Done': 1})
+        self.assertEqual(summary['load'], {'alice': 5})
+        self.assertTrue(all(project._tasks is None for project in projects.values()))
+        self.assertEqual(projects.index(CounterIndex).counts_for('p2')['status'], {'Doing': 1, 'Done': 1})
+        self.assertNotIn('counts', projects['p2'].to_dict())
+
+
+class TestBinarySnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_file = 'test_projects.bin'
+        self.journal_file = self.projects_file + JOURNAL_SUFFIX
+        patch('main.logger').start()
+        patch('store.logger').start()
+
+    def tearDown(self):
+        for filename in (self.projects_file, self.journal_file, self.projects_file + HISTORY_SUFFIX,
+                         self.projects_file + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_round_trip_and_lazy_tasks(self):
+        print("Running test 01: test_round_trip_and_lazy_tasks")
+        data = {
+            'p1': {'title': 'Project 1', 'leader': 'leader1', 'users': ['leader1', 'user1'], 'tasks': {
+                '1': {'title': 'Task 1', 'description': 'Description 1', 'start_date': '2024-05-28',
+                      'end_date': '2024-06-28', 'assigned_to': ['user1'], 'priority': 'High',
+                      'status': 'Done', 'comments': [['leader1', '2024-05-28 10:00:00', 'No comments']], 'hisotry': []},
+                '2': {'title': 'Task 2', 'assigned_to': [], 'status': 7}
+            }},
+            'p2': {'title': 'Project 2', 'leader': 'leader2', 'users': ['leader2'], 'tasks': {}, 'archived': True},
+            'p3': {'title': 3, 'leader': 'leader3', 'users': ['leader3'], 'tasks': {}}
+        }
+        write_snapshot(self.projects_file, data)
+        projects = load_projects(self.projects_file)
+        self.assertIsNone(projects['p1']._tasks)
+        self.assertEqual(projects['p1']['users'], ['leader1', 'user1'])
+        self.assertEqual(projects, data)
+        self.assertIs(projects['p1']['leader'], projects['p1']['users'][0])
+
+    def test_02_journal_compacts_into_snapshot(self):
+        print("Running test 02: test_journal_compacts_into_snapshot")
+        write_snapshot(self.projects_file, {'p1': {'title': 'Project 1', 'leader': 'leader1', 'users': ['leader1'], 'tasks': {}}})
+        projects = load_projects(self.projects_file)
+        create_project(projects, 'Project 2', 'leader2')
+        with patch('builtins.input', side_effect=[
+            'Task 1', 'Description 1', '2024-05-28', '2024-06-28', 'user1', 'High', 'ToDo', 'No comments'
+        ]):
+            add_task(projects['p1'])
+        self.assertEqual(load_projects(self.projects_file), projects)
+        compact_projects(projects)
+        self.assertEqual(os.path.getsize(self.journal_file), 0)
+        self.assertEqual(open_store(self.projects_file, journal=False), projects)
+
+    def test_03_version_1_snapshot_still_loads(self):
+        print("Running test 03: test_version_1_snapshot_still_loads")
+        strings = ['p1', 'Project 1', 'leader1', '1', 'Task 1', 'High', 'Doing', 'user1']
+        ref = strings.index
+        blobs = [value.encode() for value in strings]
+        string_offsets = [0]
+        for blob in blobs:
+            string_offsets.append(string_offsets[-1] + len(blob))
+        record = PROJECT_V2.pack(0, ref('p1'), ref('Project 1'), ref('leader1'), NONE, 1, 1) + struct.pack('<I', ref('leader1'))
+        record += TASK_V1.pack(0, ref('1'), ref('Task 1'), NONE, NONE, NONE, ref('High'), ref('Doing'), NONE, NONE, 1)
+        record += struct.pack('<I', ref('user1'))
+        position = HEADER.size + 8 * len(string_offsets) + string_offsets[-1] + 8
+        with open(self.projects_file, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, 1, len(strings), 1) + struct.pack(f'<{len(string_offsets)}Q', *string_offsets)
+                       + b''.join(blobs) + struct.pack('<Q', position) + record)
+
+        projects = load_projects(self.projects_file)
+        task = projects['p1']['tasks']['1']
+        self.assertEqual((task['title'], task['status'], task['assigned_to']), ('Task 1', 'Doing', ['user1']))
+        self.assertEqual((history_count(task), task_history(task, 0, 10)), (0, []))
+        set_task_field(task, 'status', 'Done', 'user1')
+        compact_projects(projects)
+        task = load_projects(self.projects_file)['p1']['tasks']['1']
+        self.assertEqual(task_history(task, 0, 10)[0]['new'], 'Done')
+
+    def test_04_admin_project_list_uses_saved_counts(self):
+        print("Running test 04: test_admin_project_list_uses_saved_counts")
+        task = {'title': 'Task 1', 'assigned_to': ['alice'], 'priority': 'High', 'status': 'Doing'}
+        write_snapshot(self.projects_file, {
+            project_id: {'title': project_id, 'leader': 'alice', 'users': ['alice'], 'tasks': {'1': task}}
+            for project_id in ('p1', 'p2')})
+        projects = load_projects(self.projects_file)
+        with patch('builtins.input', return_value=''), patch('rich.console.Console.print'):
+            summary = view_dashboard(projects, 'admin', 'admin')
+        self.assertEqual(summary['priority'], {'High': 2})
+        self.assertTrue(all(project._tasks is None for project in projects.values()))
+        set_task_field(projects['p1']['tasks']['1'], 'priority', 'Low', 'alice')
+        self.assertEqual(projects.index(CounterIndex).summary(['p1', 'p2'])['priority'], {'High': 1, 'Low': 1})
+
+
+class TestTaskHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_file = 'test_projects.json'
+        patch('main.logger').start()
+        patch('store.logger').start()
+
+    def tearDown(self):
+        for filename in (self.projects_file, self.projects_file + JOURNAL_SUFFIX, self.projects_file + HISTORY_SUFFIX,
+                         self.projects_file + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_history_pages_from_disk(self):
+        print("Running test 01: test_history_pages_from_disk")
+        legacy = [{'field': 'title', 'old': 'Task', 'new': 'Task 1', 'updated_by': 'leader1', 'date': '2024-05-28'}]
+        with open(self.projects_file, 'w') as file:
+            json.dump({'p1': {'title': 'Project 1', 'leader': 'leader1', 'users': ['leader1'], 'tasks': {
+                '1': {'title': 'Task 1', 'status': 'To Do', 'history': legacy}}}}, file)
+        projects = load_projects(self.projects_file)
+        task = projects['p1']['tasks']['1']
+        for i in range(HISTORY_TAIL + 5):
+            set_task_field(task, 'description', f'Description {i}', 'leader1')
+        self.assertNotIn('history', task)
+        self.assertEqual(history_count(task), HISTORY_TAIL + 6)
+
+        reloaded = load_projects(self.projects_file)
+        task = reloaded['p1']['tasks']['1']
+        history = reloaded.history
+        self.assertEqual(task['description'], f'Description {HISTORY_TAIL + 4}')
+        newest = history.entries(task, 0, 3)
+        self.assertEqual([entry['new'] for entry in newest], [f'Description {i}' for i in (14, 13, 12)])
+        self.assertEqual(history.entries(task, HISTORY_TAIL + 5, 100), legacy)
+        set_task_field(task, 'status', 'Done', 'user1')
+        self.assertEqual(history.entries(task, 0, 2)[0]['new'], 'Done')
+        self.assertEqual(history.entries(task, 1, 2)[0]['new'], f'Description {HISTORY_TAIL + 4}')
+        with open(self.projects_file + JOURNAL_SUFFIX, 'r') as file:
+            self.assertNotIn('updated_by', file.read())
+
+    def test_02_history_survives_conversion(self):
+        print("Running test 02: test_history_survives_conversion")
+        projects = load_projects(self.projects_file)
+        create_project(projects, 'Project 1', 'leader1', 'p1')
+        with patch('builtins.input', side_effect=[
+            'Task 1', 'Description 1', '2024-05-28', '2024-06-28', 'user1', 'High', 'ToDo', 'No comments'
+        ]):
+            add_task(projects['p1'])
+        for i in range(HISTORY_TAIL + 3):
+            set_task_field(projects['p1']['tasks']['1'], 'description', f'Description {i}', 'leader1')
+        for target in ('test_converted.bin', 'test_converted'):
+            self.addCleanup(lambda target=target: [shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+                                                   for path in (target, target + HISTORY_SUFFIX, target + LOCK_SUFFIX)
+                                                   if os.path.exists(path)])
+            with redirect_stdout(StringIO()):
+                convert_store(self.projects_file, target)
+            task = load_projects(target)['p1']['tasks']['1']
+            self.assertEqual(history_count(task), HISTORY_TAIL + 3)
+            self.assertEqual([entry['new'] for entry in task_history(task, HISTORY_TAIL, HISTORY_TAIL + 3)],
+                             ['Description 2', 'Description 1', 'Description 0'])
+
+
+class TestTaskComments(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_file = 'test_projects.json'
+        patch('main.logger').start()
+        patch('store.logger').start()
+
+    def tearDown(self):
+        for filename in (self.projects_file, self.projects_file + JOURNAL_SUFFIX, self.projects_file + HISTORY_SUFFIX,
+                         self.projects_file + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_comments_are_appended(self):
+        print("Running test 01: test_comments_are_appended")
+        with open(self.projects_file, 'w') as file:
+            json.dump({'p1': {'title': 'Project 1', 'leader': 'leader1', 'users': ['leader1', 'user1'], 'tasks': {
+                '1': {'title': 'Task 1', 'status': 'To Do', 'comments': 'leader1: No comments'}}}}, file)
+        projects = load_projects(self.projects_file)
+        task = projects['p1']['tasks']['1']
+        with patch('builtins.input', side_effect=['2', 'Looks good', '3']):
+            update_task_status_or_comment(task, 'user1')
+        add_comment(task, 'leader1', 'Thanks')
+        self.assertEqual([(author, text) for author, date, text in task['comments']],
+                         [('leader1', 'No comments'), ('user1', 'Looks good'), ('leader1', 'Thanks')])
+        self.assertEqual(projects.history.entries(task, 0, 1)[0]['new'], 'Thanks')
+
+        with open(self.projects_file + JOURNAL_SUFFIX, 'r') as file:
+            self.assertEqual(file.read().count('No comments'), 0)
+        self.assertEqual(load_projects(self.projects_file), projects)
+
+
+class TestMembershipIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_file = 'test_projects.json'
+        patch('main.logger').start()
+        patch('store.logger').start()
+
+    def tearDown(self):
+        for filename in (self.projects_file, self.projects_file + JOURNAL_SUFFIX, self.projects_file + HISTORY_SUFFIX,
+                         self.projects_file + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_index_follows_mutations(self):
+        print("Running test 01: test_index_follows_mutations")
+        projects = load_projects(self.projects_file)
+        create_project(projects, 'Project A', 'leader1')
+        create_project(projects, 'Project B', 'leader2')
+        project_a, project_b = list(projects.keys())
+        add_user_to_project(projects, project_b, 'leader1')
+        add_user_to_project(projects, project_a, 'user1')
+        remove_user_from_project(projects, project_a, 'user1')
+        add_user_to_project(projects, project_b, 'user1')
+
+        index = projects.index(MembershipIndex)
+        self.assertEqual(index.led_by('leader1'), [project_a])
+        self.assertEqual(index.accessible_to('leader1'), [project_a, project_b])
+        self.assertEqual(index.accessible_to('user1'), [project_b])
+
+        remove_project(projects, project_b)
+        self.assertEqual(index.accessible_to('leader1'), [project_a])
+        self.assertEqual(index.accessible_to('user1'), [])
+
+        rebuilt = MembershipIndex(load_projects(self.projects_file))
+        self.assertEqual(rebuilt.led, index.led)
+        self.assertEqual(rebuilt.users, index.users)
+
+
+class TestTaskQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_file = 'test_projects.json'
+        patch('main.logger').start()
+        patch('store.logger').start()
+        self.projects = load_projects(self.projects_file)
+        create_project(self.projects, 'Project A', 'leader1')
+        self.project_id = list(self.projects.keys())[0]
+        self.project = self.projects[self.project_id]
+        for title, end_date, assigned_to, priority, status in [
+            ('Task 1', '2024-07-01', 'alice, bob', 'Critical', 'ToDo'),
+            ('Task 2', '2024-06-01', 'alice', 'critical', 'Doing'),
+            ('Task 3', '2024-05-01', 'alice', 'Critical', 'Done'),
+            ('Task 4', '2024-04-01', 'bob', 'Low', 'To Do'),
+        ]:
+            with patch('builtins.input', side_effect=[
+                title, 'Description', '2024-01-01', end_date, assigned_to, priority, status, 'No comments'
+            ]):
+                add_task(self.project)
+
+    def tearDown(self):
+        for filename in (self.projects_file, self.projects_file + JOURNAL_SUFFIX, self.projects_file + HISTORY_SUFFIX,
+                         self.projects_file + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def titles(self, results):
+        return [task['title'] for _, _, task in results]
+
+    def test_01_parse_enum(self):
+        print("Running test 01: test_parse_enum")
+        self.assertEqual(parse_enum(TaskStatus, 'todo'), 'To Do')
+        self.assertEqual(parse_enum(TaskStatus, 'To Do'), 'To Do')
+        with self.assertRaises(ValueError):
+            parse_enum(TaskStatus, 'Finished')
+
+    def test_02_query_by_priority_assignee_and_status(self):
+        print("Running test 02: test_query_by_priority_assignee_and_status")
+        results = query_tasks(self.projects, priority='Critical', assignee='alice', exclude_status='Done', sort_by='end_date')
+        self.assertEqual(self.titles(results), ['Task 2', 'Task 1'])
+        self.assertEqual(self.titles(query_tasks(self.projects, assignee='bob', sort_by='title')), ['Task 1', 'Task 4'])
+
+    def test_03_query_follows_task_updates(self):
+        print("Running test 03: test_query_follows_task_updates")
+        query_tasks(self.projects, status='Done')
+        task_1 = self.project['tasks']['1']
+        set_task_field(task_1, 'status', 'Done', 'alice')
+        set_task_field(task_1, 'assigned_to', ['carol'], 'leader1')
+        remove_task_from_project(self.project, '3')
+        self.assertEqual(self.titles(query_tasks(self.projects, status='Done')), ['Task 1'])
+        self.assertEqual(self.titles(query_tasks(self.projects, assignee='carol')), ['Task 1'])
+        self.assertEqual(self.titles(query_tasks(self.projects, assignee='alice', sort_by='title')), ['Task 2'])
+
+    def test_04_dates_are_validated(self):
+        print("Running test 04: test_dates_are_validated")
+        self.assertEqual(parse_date(' 20240601 '), '2024-06-01')
+        self.assertEqual(parse_date(''), '')
+        with self.assertRaises(ValueError):
+            parse_date('next friday')
+        with patch('builtins.input', side_effect=[
+            'Task 5', 'Description', '2024-02-30', '2024-02-01', '2024-01-15', '2024-03-01', '', 'Low', 'ToDo', ''
+        ]), patch('rich.console.Console.print') as mock_print:
+            add_task(self.project)
+        self.assertEqual(mock_print.call_count, 3)
+        task_5 = self.project['tasks']['5']
+        self.assertEqual((task_5['start_date'], task_5['end_date']), ('2024-02-01', '2024-03-01'))
+        with patch('rich.console.Console.print'):
+            self.assertFalse(set_task_date(task_5, 'end_date', '2024-01-01', 'leader1'))
+        self.assertTrue(set_task_date(task_5, 'end_date', '2024-03-15', 'leader1'))
+        self.assertEqual(task_5['end_date'], '2024-03-15')
+
+    def test_05_overdue_and_due_soon(self):
+        print("Running test 05: test_overdue_and_due_soon")
+        today = '2024-06-15'
+        self.assertEqual(self.titles(overdue_tasks(self.projects, 'leader1', 'user', today)), ['Task 4', 'Task 2'])
+        # Queries bisect the index instead of parsing dates task by task.
+        with patch('indexes.is_date', side_effect=AssertionError("task scanned")):
+            self.assertEqual(self.titles(overdue_tasks(self.projects, 'alice', 'user', today)), ['Task 2'])
+            self.assertEqual(self.titles(overdue_tasks(self.projects, 'bob', 'user', today)), ['Task 4'])
+            self.assertEqual(self.titles(due_soon_tasks(self.projects, 'bob', 'user', 16, today)), ['Task 1'])
+            self.assertEqual(due_soon_tasks(self.projects, 'bob', 'user', 15, today), [])
+            self.assertEqual(overdue_tasks(self.projects, 'carol', 'user', today), [])
+
+        task_1, task_2 = self.project['tasks']['1'], self.project['tasks']['2']
+        set_task_field(task_2, 'status', 'Done', 'alice')
+        set_task_field(task_1, 'end_date', '2024-06-10', 'leader1')
+        set_task_field(task_1, 'assigned_to', ['carol'], 'leader1')
+        remove_task_from_project(self.project, '4')
+        self.assertEqual(overdue_tasks(self.projects, 'alice', 'user', today), [])
+        self.assertEqual(self.titles(overdue_tasks(self.projects, 'carol', 'user', today)), ['Task 1'])
+        self.assertEqual(self.titles(overdue_tasks(self.projects, 'admin', 'admin', today)), ['Task 1'])
+
+
+    def test_06_dashboard_counters(self):
+        print("Running test 06: test_dashboard_counters")
+        counters = self.projects.index(CounterIndex)
+        counts = counters.counts_for(self.project_id)
+        self.assertEqual(counts['tasks'], 4)
+        self.assertEqual(counts['status'], {'To Do': 2, 'Doing': 1, 'Done': 1})
+        self.assertEqual(counts['priority'], {'Critical': 3, 'Low': 1})
+        self.assertEqual(counts['load'], {'alice': 2, 'bob': 2})
+
+        set_task_field(self.project['tasks']['2'], 'status', 'Done', 'alice')
+        set_task_field(self.project['tasks']['1'], 'assigned_to', ['carol'], 'leader1')
+        remove_task_from_project(self.project, '4')
+        create_project(self.projects, 'Project B', 'leader2')
+        other = self.projects[[project_id for project_id in self.projects if project_id != self.project_id][0]]
+        with patch('builtins.input', side_effect=[
+            'Task 1', 'Description', '2024-01-01', '2024-02-01', 'carol', 'High', 'Backlog', ''
+        ]):
+            add_task(other)
+        self.assertEqual(counts['status'], {'To Do': 1, 'Done': 2})
+        self.assertEqual(counts['load'], {'carol': 1})
+        fresh = CounterIndex(self.projects)
+        self.assertEqual({project_id: counters.counts_for(project_id) for project_id in self.projects},
+                         {project_id: fresh.counts_for(project_id) for project_id in self.projects})
+
+        with patch('builtins.input', return_value=''), patch('rich.console.Console.print'):
+            summary = view_dashboard(self.projects, 'admin', 'admin')
+            self.assertEqual(view_dashboard(self.projects, 'leader2', 'user')['tasks'], 1)
+        self.assertEqual(summary['tasks'], 4)
+        self.assertEqual(summary['priority'], {'Critical': 3, 'High': 1})
+        self.assertEqual(summary['load'], {'carol': 2})
+
+    def test_07_search(self):
+        print("Running test 07: test_search")
+        task_1, task_2 = self.project['tasks']['1'], self.project['tasks']['2']
+        set_task_field(task_1, 'title', 'Deploy billing service', 'leader1')
+        set_task_field(task_2, 'description', 'Billing reports for deployment', 'leader1')
+        add_comment(self.project['tasks']['4'], 'bob', 'Blocked on billing')
+        index = self.projects.index(SearchIndex)
+        self.assertEqual(index.postings, SearchIndex(self.projects).postings)
+        # Title words outrank description and comment words; every query word has to match.
+        self.assertEqual(self.titles(search_tasks(self.projects, 'admin', 'admin', 'BILL')),
+                         ['Deploy billing service', 'Task 2', 'Task 4'])
+        self.assertEqual(self.titles(search_tasks(self.projects, 'admin', 'admin', 'bill deploy')),
+                         ['Deploy billing service', 'Task 2'])
+        self.assertEqual(search_tasks(self.projects, 'admin', 'admin', 'bill nothing'), [])
+        self.assertEqual(search_tasks(self.projects, 'admin', 'admin', '  '), [])
+
+        # Members see the tasks assigned to them, leaders their whole project, outsiders nothing.
+        add_user_to_project(self.projects, self.project_id, 'bob')
+        self.assertEqual(self.titles(search_tasks(self.projects, 'bob', 'user', 'billing')),
+                         ['Deploy billing service', 'Task 4'])
+        self.assertEqual(len(search_tasks(self.projects, 'leader1', 'user', 'billing')), 3)
+        self.assertEqual(search_tasks(self.projects, 'carol', 'user', 'billing'), [])
+
+        remove_task_from_project(self.project, '4')
+        set_task_field(task_1, 'title', 'Task 1', 'leader1')
+        self.assertEqual(self.titles(search_tasks(self.projects, 'admin', 'admin', 'billing')), ['Task 2'])
+        self.assertNotIn('blocked', index.postings)
+        self.assertEqual(index.terms, sorted(index.postings))
+
+
+class TestBulkImport(unittest.TestCase):
+
+    def setUp(self):
+        self.projects_file = 'test_projects.json'
+        patch('main.logger').start()
+        patch('store.logger').start()
+
+    def tearDown(self):
+        for filename in (self.projects_file, self.projects_file + JOURNAL_SUFFIX, self.projects_file + HISTORY_SUFFIX,
+                         self.projects_file + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_import_projects_and_tasks(self):
+        print("Running test 01: test_import_projects_and_tasks")
+        projects = load_projects(self.projects_file)
+        with batch_writes(projects):
+            self.assertEqual(import_projects(projects, [
+                {'id': 'p1', 'title': 'Project 1', 'leader': 'leader1', 'users': 'user1, user2'},
+                {'id': 'p1', 'title': 'Duplicate', 'leader': 'leader2'},
+                {'title': 'No leader'},
+            ]), (1, 2))
+            self.assertEqual(import_tasks(projects, [
+                {'project': 'p1', 'title': 'Task 1', 'assigned_to': 'user1', 'priority': 'high', 'status': 'ToDo'},
+                {'project': 'p1', 'title': 'Task 2', 'assigned_to': ['user2'], 'priority': 'Low', 'status': 'Done'},
+                {'project': 'p1', 'title': 'Task 3', 'priority': 'Urgent', 'status': 'Done'},
+                {'project': 'missing', 'title': 'Task 4', 'priority': 'Low', 'status': 'Done'},
+            ]), (2, 2))
+        self.assertEqual(os.path.getsize(self.projects_file + JOURNAL_SUFFIX), 0)
+
+        reloaded = load_projects(self.projects_file)
+        self.assertEqual(reloaded['p1']['users'], ['leader1', 'user1', 'user2'])
+        self.assertEqual(reloaded['p1']['tasks']['1']['priority'], 'High')
+        self.assertEqual(reloaded['p1']['tasks']['2']['assigned_to'], ['user2'])
+
+    def test_02_existing_task_ids_are_skipped(self):
+        print("Running test 02: test_existing_task_ids_are_skipped")
+        projects = load_projects(self.projects_file)
+        import_projects(projects, [{'id': 'p1', 'title': 'Project 1', 'leader': 'leader1'}])
+        self.assertEqual(import_tasks(projects, [
+            {'project': 'p1', 'id': '1', 'title': 'Task 1', 'status': 'Done', 'priority': 'Low'},
+        ]), (1, 0))
+        self.assertEqual(len(query_tasks(projects, status='Done')), 1)
+        self.assertEqual(import_tasks(projects, [
+            {'project': 'p1', 'id': '1', 'title': 'Replacement', 'status': 'To Do', 'priority': 'Low'},
+            {'project': 'p1', 'title': 'Task 2', 'status': 'To Do', 'priority': 'Low'},
+        ]), (1, 1))
+        self.assertEqual(projects['p1']['tasks']['1']['title'], 'Task 1')
+        self.assertEqual([task['title'] for _, _, task in query_tasks(projects, status='Done')], ['Task 1'])
+        self.assertEqual([task['title'] for _, _, task in query_tasks(projects, status='To Do')], ['Task 2'])
+        self.assertEqual(load_projects(self.projects_file)['p1']['tasks']['1']['status'], 'Done')
+
+
+class TestModels(unittest.TestCase):
+
+    def test_01_lossless_round_trip(self):
+        print("Running test 01: test_lossless_round_trip")
+        data = {
+            'title': 'Project 1', 'leader': 'leader1', 'users': ['leader1', 'user1'],
+            'tasks': {'1': {
+                'title': 'Task 1', 'description': 'Description 1', 'start_date': '2024-05-28',
+                'end_date': '2024-06-28', 'assigned_to': ['user1'], 'priority': 'High',
+                'status': 'finished', 'comments': [['leader1', None, 'No comments']], 'hisotry': []
+            }},
+            'archived': False
+        }
+        project = Project.from_dict(json.loads(json.dumps(data)), None, 'p1')
+        self.assertEqual(json.loads(json.dumps(project.to_dict(), default=Task.to_dict)), data)
+        self.assertEqual(project, data)
+
+    def test_02_enum_codes_and_interning(self):
+        print("Running test 02: test_enum_codes_and_interning")
+        first = Task.from_dict({'title': 'A', 'status': 'Done', 'priority': 'Low', 'assigned_to': ['al' + 'ice']})
+        second = Task.from_dict({'title': 'B', 'status': 'Done', 'priority': 'Low', 'assigned_to': ['ali' + 'ce']})
+        self.assertIsInstance(first._status, int)
+        self.assertEqual(first['status'], 'Done')
+        self.assertIs(first._assigned_to[0], second._assigned_to[0])
+        first['priority'] = 'Critical'
+        self.assertEqual(first.get('priority'), 'Critical')
+        self.assertIsNone(first.get('history'))
+        first.setdefault('history', []).append({'field': 'priority'})
+        self.assertEqual(first['history'], [{'field': 'priority'}])
+
+    def test_03_string_comments_migrate(self):
+        print("Running test 03: test_string_comments_migrate")
+        task = Task.from_dict({'title': 'A', 'comments': 'leader1: First\nuser1: Second: with colon\nfree text'})
+        self.assertEqual(task['comments'], [['leader1', None, 'First'], ['user1', None, 'Second: with colon'],
+                                            [None, None, 'free text']])
+
+
+class TestLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = 'test_logs'
+        os.makedirs(self.directory, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_01_sampler_and_background_sink(self):
+        print("Running test 01: test_sampler_and_background_sink")
+        sampler = Sampler(4)
+        debug = {'level': SimpleNamespace(no=10), 'name': 'main', 'line': 1}
+        info = {'level': SimpleNamespace(no=20), 'name': 'main', 'line': 1}
+        self.assertEqual(sum(sampler(debug) for _ in range(12)), 3)
+        self.assertTrue(all(sampler(info) for _ in range(5)))
+        sink = BackgroundSink(os.path.join(self.directory, 'application.log'), rotation_bytes=100)
+        for number in range(10):
+            sink.put(f"message {number:02d} " + 'x' * 30 + '\n')
+        sink.close()
+        written = ''
+        for filename in sorted(os.listdir(self.directory)):
+            with open(os.path.join(self.directory, filename)) as file:
+                written += file.read()
+        self.assertGreater(len(os.listdir(self.directory)), 1)
+        self.assertEqual(sorted(written.splitlines()), [f"message {number:02d} " + 'x' * 30 for number in range(10)])
+
+
+class TestPager(unittest.TestCase):
+
+    def test_01_navigation(self):
+        print("Running test 01: test_navigation")
+        pager = Pager(45, page_size=20)
+        self.assertEqual((pager.start, pager.stop, pager.pages), (0, 20, 3))
+        self.assertTrue(pager.navigate('n'))
+        self.assertTrue(pager.navigate('n'))
+        self.assertTrue(pager.navigate('n'))
+        self.assertEqual((pager.start, pager.stop), (40, 45))
+        self.assertTrue(pager.navigate('p'))
+        self.assertEqual(pager.start, 20)
+        self.assertTrue(pager.navigate('s 10'))
+        self.assertEqual((pager.start, pager.pages), (20, 5))
+        self.assertTrue(pager.navigate('g 5'))
+        self.assertEqual((pager.start, pager.stop), (40, 45))
+        self.assertFalse(pager.navigate('3'))
+        pager.update(12)
+        self.assertEqual((pager.start, pager.stop), (10, 12))
+
+    def test_02_task_view_renders_one_page(self):
+        print("Running test 02: test_task_view_renders_one_page")
+        patch('main.logger').start()
+        self.addCleanup(patch.stopall)
+        projects = create_project({}, 'New Project', 'leader1')
+        project = list(projects.values())[0]
+        for number in range(1, 31):
+            project['tasks'][str(number)] = {'title': f'Task {number}', 'priority': 'Low', 'status': 'To Do', 'comments': ''}
+        with patch('main.Table') as mock_table:
+            view_tasks_for_project(project, 'leader1', 'user', Pager(30, page_size=7))
+        self.assertEqual(mock_table.return_value.add_row.call_count, 7)
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        self.accounts_file = 'test_accounts.csv'
+        self.admin_file = 'test_admin.txt'
+        self.projects_file = 'test_projects.json'
+        with open(self.admin_file, 'w') as file:
+            file.write("Username:admin\nPassword:adminpass")
+        for name in ('account.logger', 'main.logger', 'store.logger', 'service.logger'):
+            patch(name).start()
+        patch('account.HASH_ITERATIONS', 1000).start()
+        patch('account.ADMIN_FILE', self.admin_file).start()
+        # The service redirects module consoles to its replies; put them back afterwards.
+        for module in (main_module, account_module):
+            patch.object(module, 'console', module.console).start()
+        ready = threading.Event()
+        self.service = Service(self.accounts_file, self.projects_file)
+        self.service.accounts.admin_file = self.admin_file
+        self.service.accounts.sessions.admin_file = self.admin_file
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.service.serve(port=0, ready=lambda service: ready.set())))
+        self.thread.start()
+        ready.wait(5)
+        self.address = f"127.0.0.1:{self.service.address[1]}"
+
+    def tearDown(self):
+        self.service.stop()
+        self.thread.join(5)
+        for filename in (self.accounts_file, self.accounts_file + '.delta', self.accounts_file + LOCK_SUFFIX,
+                         self.accounts_file + SESSIONS_SUFFIX, self.accounts_file + SESSIONS_SUFFIX + LOCK_SUFFIX,
+                         self.accounts_file + SESSION_KEY_SUFFIX, self.admin_file, self.projects_file, self.projects_file + JOURNAL_SUFFIX,
+                         self.projects_file + HISTORY_SUFFIX, self.projects_file + LOCK_SUFFIX):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_sessions_and_shared_projects(self):
+        print("Running test 01: test_sessions_and_shared_projects")
+        leader, member = ServiceClient(self.address), ServiceClient(self.address)
+        self.addCleanup(leader.close)
+        self.addCleanup(member.close)
+        self.assertEqual(leader.call('projects').status, 401)
+        self.assertEqual(leader.call('sign_up', username='leader1', password='secret', email='l@example.com').status, 200)
+        self.assertEqual(member.call('sign_up', username='user1', password='secret', email='u@example.com').status, 200)
+        reply = member.call('sign_up', username='user1', password='other', email='x@example.com')
+        self.assertEqual(reply.status, 409)
+        self.assertIn('already exists', reply.messages[0])
+        self.assertEqual(leader.login('leader1', 'wrong').status, 401)
+        self.assertEqual(leader.login('leader1', 'secret').result['role'], 'user')
+        member.login('user1', 'secret')
+
+        project_id = leader.call('create_project', title='Shared').result
+        self.assertEqual(leader.call('add_user', project=project_id, username='user1').result, True)
+        task_id = leader.call('add_task', project=project_id, title='Task 1', assigned_to='user1',
+                              priority='high', status='todo').result
+        self.assertEqual(member.call('add_task', project=project_id, title='Not mine').status, 403)
+        self.assertEqual(leader.call('add_task', project=project_id, title='Bad', priority='urgent').status, 400)
+
+        task = member.call('task', project=project_id, task=task_id).result
+        self.assertEqual((task['priority'], task['status'], task['manage']), ('High', 'To Do', False))
+        self.assertEqual(member.call('update_task', project=project_id, task=task_id, field='title', value='X').status, 403)
+        self.assertEqual(member.call('update_task', project=project_id, task=task_id, field='status', value='Doing',
+                                     version=task['version']).status, 200)
+        # The leader's edit is based on the version read before the member's change.
+        reply = leader.call('update_task', project=project_id, task=task_id, field='status', value='Done',
+                            version=task['version'])
+        self.assertEqual(reply.status, 409)
+        self.assertIn('changed by another user', reply.messages[0])
+        self.assertEqual(member.call('add_comment', project=project_id, task=task_id, text='On it').status, 200)
+
+        tasks = member.call('my_tasks').result
+        self.assertEqual(tasks['total'], 1)
+        self.assertEqual((tasks['tasks'][0]['status'], tasks['tasks'][0]['comments'][-1][2]), ('Doing', 'On it'))
+        dashboard = leader.call('dashboard').result
+        self.assertEqual(dashboard['projects'][project_id]['status'], {'Doing': 1})
+        self.assertEqual(dashboard['total']['load'], {'user1': 1})
+        self.assertEqual(member.call('dashboard').result['total']['tasks'], 0)
+        self.assertEqual([task['title'] for task in member.call('search', query='tas').result], ['Task 1'])
+        self.assertEqual(member.call('search', query='tas', limit=0).status, 400)
+        self.assertEqual(member.logout().status, 200)
+        self.assertEqual(member.call('my_tasks').status, 401)
+
+        # Every change is durable without the server saving a snapshot.
+        projects = load_projects(self.projects_file)
+        self.assertEqual(projects[project_id]['tasks'][task_id]['status'], 'Doing')
+        self.assertEqual(projects[project_id]['users'], ['leader1', 'user1'])
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics_file = 'test_metrics.prom'
+        patch.object(metrics, 'histograms', {}).start()
+
+    def tearDown(self):
+        for filename in (self.metrics_file, 'test_metrics.json'):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patch.stopall()
+
+    def test_01_disabled_leaves_functions_untouched(self):
+        print("Running test 01: test_disabled_leaves_functions_untouched")
+        def operation():
+            return 1
+        with patch.object(metrics, 'ENABLED', False):
+            self.assertIs(metrics.timed('operation')(operation), operation)
+        self.assertEqual(metrics.histograms, {})
+
+    def test_02_histograms_and_export(self):
+        print("Running test 02: test_histograms_and_export")
+        with patch.object(metrics, 'ENABLED', True):
+            @metrics.timed('operation')
+            def operation(fail=False):
+                if fail:
+                    raise ValueError(fail)
+                return 'done'
+        self.assertEqual(operation(), 'done')
+        with self.assertRaises(ValueError):
+            operation(True)
+        values = metrics.snapshot()['operation']
+        self.assertEqual((values['count'], values['errors'], sum(values['buckets'].values())), (2, 1, 2))
+        self.assertLessEqual(values['p95_seconds'], values['max_seconds'])
+        metrics.write_metrics(self.metrics_file)
+        with open(self.metrics_file) as file:
+            text = file.read()
+        self.assertIn('pms_operation_duration_seconds_bucket{operation="operation",le="+Inf"} 2', text)
+        self.assertIn('pms_operation_errors_total{operation="operation"} 1', text)
+        metrics.write_metrics('test_metrics.json')
+        with open('test_metrics.json') as file:
+            self.assertEqual(json.load(file)['operation']['count'], 2)
+
+
 if __name__ == '__main__':
     unittest.main()